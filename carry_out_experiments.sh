@@ -1,7 +1,7 @@
 #! /bin/bash
 
 echo echo Processing raw data
-python -m src.data.poland_dem
+python -m src.data.poland_dem -e .asc
 python -m src.data.generate
 echo echo Processing finished
 echo ''
@@ -76,17 +76,15 @@ IDW_PREDICTIONS_SUFFIX=_predicted_idw
 IDW_POWERS=("0.5" "1" "2")
 IDW_N_NEIGHBORS=("3" "7" "15")
 
-max_count=$((${#DATA_FILES[@]}*${#IDW_POWERS[@]}*${#IDW_N_NEIGHBORS[@]}))
+max_count=${#DATA_FILES[@]}
 counter=0
 
+# Predictions for all combinations of parameters are saved next to the query under names
+# <query>_<power>_<neighbors>_predicted_idw
 for file in "${DATA_FILES[@]}"; do
-    for power in "${IDW_POWERS[@]}"; do
-        for neighbors in "${IDW_N_NEIGHBORS[@]}"; do
-            python -m src.models.idw -q $file$SUBSAMPLE_SUFFIX${SUBSAMPLING_RATIOS[2]//.}$EXT -p $power -n $neighbors -t $file$SUBSAMPLE_SUFFIX${SUBSAMPLING_RATIOS[2]//.}_${power//.}_$neighbors$IDW_PREDICTIONS_SUFFIX$EXT
-            ((counter++))
-            echo IDW predictions made: ${counter} out of ${max_count}
-        done
-    done
+    python -m src.models.idw -q $file$SUBSAMPLE_SUFFIX${SUBSAMPLING_RATIOS[2]//.}$EXT -p ${IDW_POWERS[@]} -n ${IDW_N_NEIGHBORS[@]}
+    ((counter++))
+    echo IDW predictions made: ${counter} out of ${max_count}
 done
 
 # Kriging
@@ -148,4 +146,25 @@ for file in "${DATA_FILES[@]}"; do
     echo Kriging visualizations made: ${counter} out of ${max_count}
 done
 echo Generating visualizations finished
-echo ''
\ No newline at end of file
+echo ''
+
+
+echo Computing metrics
+METRICS_PREFIX=reports/metrics/
+METRICS_SUFFIX=_metrics.csv
+mkdir -p $METRICS_PREFIX
+
+max_count=$((${#DATA_FILES[@]}*${#SUBSAMPLING_RATIOS[@]}))
+counter=0
+
+for file in "${DATA_FILES[@]}"; do
+    for ratio in "${SUBSAMPLING_RATIOS[@]}"; do
+        samples=$file$SUBSAMPLE_SUFFIX${ratio//.}
+        # IDW and kriging predictions exist only for the smallest ratio
+        python -m src.visualization.metrics -r $file$EXT -s $samples$EXT -p ${samples}_*predicted_*$EXT -o $METRICS_PREFIX${samples##*/}$METRICS_SUFFIX
+        ((counter++))
+        echo Metrics tables made: ${counter} out of ${max_count}
+    done
+done
+echo Computing metrics finished
+echo ''
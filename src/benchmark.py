@@ -0,0 +1,553 @@
+"""
+Measure time and memory used by data processing, training and prediction over a grid of problem
+sizes and compare results with a baseline
+"""
+import itertools
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from src.data.generate import waves
+from src.models import (
+    idw,
+    kriging,
+    linear_regression,
+    pyramid,
+    regression_kriging,
+    trend_surface,
+)
+from src.models.idw import IDWPredictor
+from src.models.kriging import KrigingPredictor
+from src.util import precision
+from src.util.cli import limited_float, limited_int
+from src.util.data import holdout, subsample
+from src.util.data_io import (
+    ASCII_EXTENSION,
+    BINARY_EXTENSION,
+    SPARSE_EXTENSION,
+    read_data,
+    read_known_points,
+    write_data,
+)
+from src.visualization.heatmaps_comparison import compare_predictions
+
+_PERCENTILES = (10, 90)
+_DOUBLE = precision.Precision.DOUBLE.value
+_PYRAMID_FACTOR = 4
+
+
+def parse_args(argv: list[str] = None):
+    parser = ArgumentParser(
+        description="""Benchmark training, prediction and data processing and save results as
+        JSON"""
+    )
+    parser.add_argument(
+        "-d",
+        "--data",
+        type=Path,
+        default=None,
+        help="""File containing data to benchmark on, cropped to every grid size. If omitted,
+        generated waves are used""",
+    )
+    parser.add_argument(
+        "-g",
+        "--grid-sizes",
+        nargs="+",
+        type=limited_int(1),
+        default=[300],
+        help="Lengths of sides of square grids benchmarks are run on",
+    )
+    parser.add_argument(
+        "-s",
+        "--samples",
+        nargs="+",
+        type=limited_int(1),
+        default=[1000, 4000],
+        help="Numbers of samples models are trained on",
+    )
+    parser.add_argument(
+        "-m",
+        "--missing",
+        nargs="+",
+        type=limited_int(1),
+        default=[10000, 40000],
+        help="Numbers of missing values that are predicted",
+    )
+    parser.add_argument(
+        "--kriging-solvers",
+        nargs="+",
+        choices=[solver.value for solver in kriging.Solver],
+        type=str,
+        default=[kriging.Solver.LOCAL.value, kriging.Solver.GLOBAL.value],
+        help=f"""Implementations of kriging to benchmark. Defaults to
+        '{kriging.Solver.LOCAL.value}' and '{kriging.Solver.GLOBAL.value}', as
+        '{kriging.Solver.SKGSTAT.value}' solves a system of all samples for every missing value,
+        which takes hours on larger grids""",
+    )
+    parser.add_argument(
+        "--precisions",
+        nargs="+",
+        choices=[precision_.value for precision_ in precision.Precision],
+        type=str,
+        default=[precision.Precision.DOUBLE.value],
+        help=f"""Floating point precisions to run benchmarks in. Predictions made in other
+        precisions than '{precision.Precision.DOUBLE.value}' are compared with predictions made
+        in it, if it is also given""",
+    )
+    parser.add_argument(
+        "--pyramid-tolerances",
+        nargs="+",
+        type=limited_float(0.0, low_inclusive=True),
+        default=[0.01, 0.1],
+        help=f"""Tolerances of coarse-to-fine predictions, which are made with factor
+        {_PYRAMID_FACTOR} and compared with predictions made at full resolution""",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        type=limited_int(1),
+        default=5,
+        help="Number of measured runs of every benchmark",
+    )
+    parser.add_argument(
+        "-f",
+        "--filter",
+        type=str,
+        default=None,
+        help="Run only benchmarks which names contain this string",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=None,
+        help="File to save results in. If omitted results are printed",
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        type=Path,
+        default=None,
+        help="""File with results of previous run. Median times of matching benchmarks are
+        compared with it and the script fails if any of them regressed""",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=limited_float(0.0, low_inclusive=True),
+        default=0.1,
+        help="""Relative increase of median time over baseline that is considered a regression.
+        Defaults to 0.1""",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed to use for RNG used in subsampling",
+    )
+    return parser.parse_args(argv)
+
+
+@dataclass
+class Benchmark:
+    name: str
+    params: dict
+    # Number of grid cells processed by a single run
+    cells: int
+    run: Callable[[], object] = field(repr=False)
+    # Complete data and mask of cells predicted by `run`, if it fills missing values
+    truth: np.ndarray | None = field(default=None, repr=False)
+    missing: np.ndarray | None = field(default=None, repr=False)
+    # Predictions `run` approximates, made at full resolution
+    full_resolution: np.ndarray | None = field(default=None, repr=False)
+
+
+@dataclass
+class Result:
+    name: str
+    params: dict
+    repeats: int
+    median_s: float
+    min_s: float
+    percentiles_s: dict
+    throughput_cells_per_s: float
+    peak_traced_mb: float
+    # Errors of predictions, for benchmarks filling missing values
+    accuracy: dict | None = None
+
+
+def measure(benchmark: Benchmark, repeats: int):
+    # Warm-up run, excluded from statistics, compiles JIT kernels and fills caches
+    benchmark.run()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        benchmark.run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    output = benchmark.run()
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    accuracy = None
+    if benchmark.truth is not None:
+        errors = (output - benchmark.truth)[benchmark.missing].astype(np.float64)
+        accuracy = {
+            "rmse": float(np.sqrt(np.mean(np.square(errors)))),
+            "max_abs_error": float(np.abs(errors).max(initial=0)),
+        }
+    if benchmark.full_resolution is not None:
+        mse, max_absolute_difference = compare_predictions(benchmark.full_resolution, output)
+        accuracy["mse_from_full_resolution"] = float(mse)
+        accuracy["max_abs_difference_from_full_resolution"] = float(max_absolute_difference)
+    median = float(np.median(times))
+    result = Result(
+        name=benchmark.name,
+        params=benchmark.params,
+        repeats=repeats,
+        median_s=median,
+        min_s=min(times),
+        percentiles_s={f"p{p}": float(np.percentile(times, p)) for p in _PERCENTILES},
+        throughput_cells_per_s=benchmark.cells / median if median > 0 else float("inf"),
+        peak_traced_mb=peak_traced / 2**20,
+        accuracy=accuracy,
+    )
+    return result, output
+
+
+def _grid(source: np.ndarray | None, size: int):
+    if source is None:
+        return waves((size, size))
+    if source.shape[0] < size or source.shape[1] < size:
+        raise ValueError(f"Data of shape {source.shape} is smaller than grid size {size}")
+    return np.array(source[:size, :size])
+
+
+def _selected(name: str, name_filter: str | None):
+    return name_filter is None or name_filter in name
+
+
+def benchmarks(
+    source: np.ndarray | None,
+    grid_sizes: list[int],
+    samples_counts: list[int],
+    missing_counts: list[int],
+    kriging_solvers: list[kriging.Solver],
+    seed: int,
+    directory: Path,
+    precisions: list[precision.Precision] = (precision.Precision.DOUBLE,),
+    pyramid_tolerances: list[float] = (),
+    name_filter: str = None,
+):
+    """
+    Generate benchmarks of all cases for every combination of precision, grid size, number of
+    samples and number of missing values. Precision of the process is set to the one of yielded
+    benchmark until the next one is requested. Only benchmarks which names contain `name_filter`
+    are generated, without preparing data and models for the other ones
+    """
+    selected = partial(_selected, name_filter=name_filter)
+    for grid_precision, size in itertools.product(precisions, grid_sizes):
+        precision.set_precision(grid_precision)
+        data = precision.as_float(_grid(source, size))
+        grid_params = {"grid_size": size, "precision": grid_precision.value}
+
+        for extension in (ASCII_EXTENSION, BINARY_EXTENSION):
+            path = directory / f"grid_{size}{extension}"
+            params = {**grid_params, "format": extension}
+            if selected("write_data"):
+                yield Benchmark(
+                    "write_data", params, data.size, lambda p=path: write_data(p, data)
+                )
+            if selected("read_data"):
+                write_data(path, data)
+                # Memory mapped data is loaded only when accessed, so it is summed to read it all
+                yield Benchmark(
+                    "read_data", params, data.size, lambda p=path: np.sum(read_data(p))
+                )
+
+        for samples_count in samples_counts:
+            ratio = samples_count / data.size
+            params = {**grid_params, "samples": samples_count}
+            if selected("subsample"):
+                yield Benchmark(
+                    "subsample", params, samples_count, lambda r=ratio: subsample(data, r, seed)
+                )
+            if not selected("read_known_points"):
+                continue
+            samples = subsample(data, ratio, seed)
+            for extension in (ASCII_EXTENSION, BINARY_EXTENSION, SPARSE_EXTENSION):
+                path = directory / f"samples_{size}_{samples_count}{extension}"
+                write_data(path, samples)
+                yield Benchmark(
+                    "read_known_points",
+                    {**params, "format": extension, "bytes": path.stat().st_size},
+                    samples_count,
+                    lambda p=path: read_known_points(p),
+                )
+
+        for samples_count, missing_count in itertools.product(samples_counts, missing_counts):
+            if samples_count + missing_count > data.size:
+                continue
+            samples, incomplete_data = holdout(
+                data, samples_count / data.size, missing_count / data.size, seed
+            )
+            params = {**grid_params, "samples": samples_count, "missing": missing_count}
+            for benchmark in _model_benchmarks(
+                samples, incomplete_data, params, kriging_solvers, pyramid_tolerances, selected
+            ):
+                if benchmark.name.endswith(".predict"):
+                    benchmark.truth, benchmark.missing = data, np.isnan(incomplete_data)
+                yield benchmark
+
+
+def _model_benchmarks(
+    samples: np.ndarray,
+    incomplete_data: np.ndarray,
+    params: dict,
+    kriging_solvers: list[kriging.Solver],
+    pyramid_tolerances: list[float],
+    selected: Callable[[str], bool],
+):
+    samples_count, missing_count = params["samples"], params["missing"]
+
+    if selected("linear_regression.train"):
+        yield Benchmark(
+            "linear_regression.train",
+            params,
+            samples_count,
+            lambda: linear_regression.train(samples),
+        )
+    if selected("linear_regression.predict"):
+        linear_model = linear_regression.train(samples)
+        yield Benchmark(
+            "linear_regression.predict",
+            params,
+            missing_count,
+            lambda: linear_regression.predict(linear_model, incomplete_data),
+        )
+
+    # Closed-form trend surface of degree 1 fits the same plane as linear regression
+    if selected("trend_surface.train"):
+        yield Benchmark(
+            "trend_surface.train",
+            params,
+            samples_count,
+            lambda: trend_surface.train(samples),
+        )
+    if selected("trend_surface.predict"):
+        trend_model = trend_surface.train(samples)
+        yield Benchmark(
+            "trend_surface.predict",
+            params,
+            missing_count,
+            lambda: trend_surface.predict(trend_model, incomplete_data),
+        )
+
+    # IDW uses all known values of data with missing values, like in the experiments
+    if selected("idw.predict"):
+        for backend in idw.Backend:
+            yield Benchmark(
+                "idw.predict",
+                {**params, "backend": backend.value},
+                missing_count,
+                lambda b=backend: idw.predict(incomplete_data, 5, 1, b),
+            )
+    # Grid of parameters of the experiments, with neighbors of every missing value queried once
+    if selected("idw.sweep"):
+        yield Benchmark(
+            "idw.sweep",
+            {**params, "combinations": 9},
+            missing_count,
+            lambda: idw.sweep(incomplete_data, [3, 7, 15], [0.5, 1, 2]),
+        )
+
+    if selected("kriging.train"):
+        yield Benchmark("kriging.train", params, samples_count, lambda: kriging.train(samples))
+    if selected("kriging.predict"):
+        variogram = kriging.train(samples)
+        for solver in kriging_solvers:
+            kriging_model = kriging.build_kriging(variogram, solver)
+            yield Benchmark(
+                "kriging.predict",
+                {**params, "solver": solver.value},
+                missing_count,
+                lambda k=kriging_model: kriging.predict(variogram, incomplete_data, kriging=k),
+            )
+
+    # Kriging of residuals from the trend reaches accuracy of kriging with fewer samples
+    if selected("regression_kriging.train"):
+        yield Benchmark(
+            "regression_kriging.train",
+            params,
+            samples_count,
+            lambda: regression_kriging.train(samples),
+        )
+    if selected("regression_kriging.predict"):
+        regression_kriging_model = regression_kriging.train(samples)
+        yield Benchmark(
+            "regression_kriging.predict",
+            {**params, "solver": kriging.Solver.LOCAL.value},
+            missing_count,
+            lambda: regression_kriging.predict(regression_kriging_model, incomplete_data),
+        )
+
+    # Coarse-to-fine predictions of models predicting every missing value independently
+    if not (pyramid_tolerances and selected("pyramid.predict")):
+        return
+    for predictor in (
+        IDWPredictor(power=1).fit_grid(incomplete_data),
+        KrigingPredictor(kriging.Solver.LOCAL).fit_grid(samples),
+    ):
+        full_resolution = predictor.predict_grid(incomplete_data)
+        for tolerance in pyramid_tolerances:
+            yield Benchmark(
+                "pyramid.predict",
+                {
+                    **params,
+                    "model": predictor.name,
+                    "factor": _PYRAMID_FACTOR,
+                    "tolerance": tolerance,
+                },
+                missing_count,
+                lambda p=predictor, t=tolerance: pyramid.predict_pyramid(
+                    p, incomplete_data, factor=_PYRAMID_FACTOR, tolerance=t
+                ),
+                full_resolution=full_resolution,
+            )
+
+
+def _key(result: dict):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float):
+    """
+    Compare median times of benchmarks with the same names and parameters
+
+    Returns:
+        list[dict]: Comparisons of matching benchmarks, with ratio of current median time to
+        baseline and flag marking regressions
+    """
+    baseline_by_key = {_key(result): result for result in baseline}
+    comparisons = []
+    for result in results:
+        reference = baseline_by_key.get(_key(result))
+        if reference is None:
+            continue
+        ratio = result["median_s"] / reference["median_s"]
+        comparisons.append(
+            {
+                "name": result["name"],
+                "params": result["params"],
+                "baseline_median_s": reference["median_s"],
+                "median_s": result["median_s"],
+                "ratio": ratio,
+                "regression": ratio > 1 + tolerance,
+            }
+        )
+    return comparisons
+
+
+def _compare_precisions(results: list[dict], outputs: dict):
+    """
+    Add differences between predictions made in other precisions and in float64 to accuracy of
+    results
+    """
+    for result in results:
+        if result["accuracy"] is None or result["params"]["precision"] == _DOUBLE:
+            continue
+        double_params = {**result["params"], "precision": _DOUBLE}
+        reference = outputs.get(_key({"name": result["name"], "params": double_params}))
+        if reference is None:
+            continue
+        output = outputs[_key(result)]
+        differences = (output.astype(np.float64) - reference)[~np.isnan(reference)]
+        result["accuracy"][f"max_abs_difference_from_{_DOUBLE}"] = float(
+            np.abs(differences).max(initial=0)
+        )
+
+
+def _metadata(args):
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "data": str(args.data) if args.data is not None else "generated waves",
+        "repeats": args.repeats,
+        "seed": args.seed,
+    }
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    source = read_data(args.data) if args.data is not None else None
+    results = []
+    # Predictions of benchmarks filling missing values, to compare precisions
+    outputs = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for benchmark in benchmarks(
+            source,
+            args.grid_sizes,
+            args.samples,
+            args.missing,
+            [kriging.Solver(solver) for solver in args.kriging_solvers],
+            args.seed,
+            Path(directory),
+            # float64 goes first, so that predictions in other precisions can be compared with it
+            sorted(
+                (precision.Precision(value) for value in set(args.precisions)),
+                key=lambda value: value != precision.Precision.DOUBLE,
+            ),
+            args.pyramid_tolerances,
+            args.filter,
+        ):
+            result, output = measure(benchmark, args.repeats)
+            if result.accuracy is not None:
+                outputs[_key(asdict(result))] = output
+            print(
+                f"{result.name} {result.params}: median {result.median_s:.4f}s, "
+                f"{result.throughput_cells_per_s:.0f} cells/s",
+                file=sys.stderr,
+            )
+            results.append(asdict(result))
+
+    _compare_precisions(results, outputs)
+    report = {"metadata": _metadata(args), "results": results}
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as reader:
+            baseline = json.load(reader)["results"]
+        report["comparison"] = compare(results, baseline, args.tolerance)
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as writer:
+            json.dump(report, writer, indent=2)
+
+    regressions = [c for c in report.get("comparison", []) if c["regression"]]
+    for regression in regressions:
+        print(
+            f"Regression: {regression['name']} {regression['params']} took "
+            f"{regression['ratio']:.2f} times as long as in baseline",
+            file=sys.stderr,
+        )
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Convert data files between ASCII grid format and binary grid format
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+
+from src.util.data_io import (
+    ASCII_EXTENSION,
+    BINARY_EXTENSION,
+    is_binary,
+    read_data,
+    write_data,
+)
+
+
+def parse_args():
+    parser = ArgumentParser(
+        description=f"""Convert data files between ASCII ('{ASCII_EXTENSION}') and binary
+        ('{BINARY_EXTENSION}') grid formats"""
+    )
+    parser.add_argument(
+        "data",
+        nargs="+",
+        type=Path,
+        help="Files containing data to be converted",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=Path,
+        default=None,
+        help="""Directory to save converted files in. If omitted, converted files will be saved in
+        the same directory as source files, under the same name with changed extension""",
+    )
+    return parser.parse_args()
+
+
+def convert(source: Path, dest: Path):
+    write_data(dest, read_data(source))
+
+
+def converted_path(source: Path, output_dir: Path = None):
+    extension = ASCII_EXTENSION if is_binary(source) else BINARY_EXTENSION
+    dest = source.with_suffix(extension)
+    if output_dir is not None:
+        dest = output_dir / dest.name
+    return dest
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.output_dir is not None and not args.output_dir.is_dir():
+        args.output_dir.mkdir(parents=True)
+    for file in args.data:
+        convert(file, converted_path(file, args.output_dir))
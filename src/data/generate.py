@@ -1,3 +1,4 @@
+from argparse import ArgumentParser
 from pathlib import Path
 
 import numpy as np
@@ -23,8 +24,15 @@ def waves(
     return data
 
 
-if __name__ == "__main__":
-    GENERATED_DIR = Path("data/processed/generated")
+GENERATED_DIR = Path("data/processed/generated")
+
+
+def main(argv: list[str] = None):
+    ArgumentParser(description=f"Generate data and save it in '{GENERATED_DIR}'").parse_args(argv)
     if not GENERATED_DIR.is_dir():
-        GENERATED_DIR.mkdir()
+        GENERATED_DIR.mkdir(parents=True)
     write_data(GENERATED_DIR.joinpath("waves.asc"), waves((360, 360)))
+
+
+if __name__ == "__main__":
+    main()
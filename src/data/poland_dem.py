@@ -1,23 +1,297 @@
 """
-Remove headers from files with segments of Poland DEM
+Convert segments of Poland DEM from ESRI ASCII grids to data files, in parallel, skipping segments
+that did not change since they were last converted, and mosaic them into a single grid.
+
+Cells equal to NODATA_value of a segment are converted to missing values, while earlier versions
+kept the NODATA_value itself, so grids converted before differ in those cells and results of
+experiments on them are not comparable with results on grids converted now
 """
+import hashlib
+import json
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
+
+from src.util import precision
+from src.util.cli import limited_int
+from src.util.data_io import (
+    ASCII_EXTENSION,
+    BINARY_EXTENSION,
+    Georeference,
+    RowBandWriter,
+    read_data,
+    read_georeference,
+    read_shape,
+    write_data,
+)
+
+DATA_DIR = Path("data/raw/poland_DEM")
+RESULTS_DIR = Path("data/processed/poland_DEM")
+_MANIFEST_NAME = "manifest.json"
+_BAND_ROWS = 1024
+_HASH_CHUNK_SIZE = 2**20
+
+# Keys of ESRI ASCII grid header
+_COLUMNS_NUMBER_HEADER = "ncols"
+_ROWS_NUMBER_HEADER = "nrows"
+_CELL_SIZE_HEADER = "cellsize"
+_NODATA_HEADER = "nodata_value"
+_X_CORNER_HEADER = "xllcorner"
+_Y_CORNER_HEADER = "yllcorner"
+_X_CENTER_HEADER = "xllcenter"
+_Y_CENTER_HEADER = "yllcenter"
+
+
+def parse_args(argv: list[str] = None):
+    parser = ArgumentParser(
+        description="""Convert segments of Poland DEM saved as ESRI ASCII grids to data files and
+        mosaic them into a single grid. Cells equal to NODATA_value become missing values, unlike
+        in grids converted by earlier versions, which kept NODATA_value"""
+    )
+    parser.add_argument(
+        "-s",
+        "--source-dir",
+        type=Path,
+        default=DATA_DIR,
+        help=f"Directory containing raw segments. Defaults to '{DATA_DIR}'",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=Path,
+        default=RESULTS_DIR,
+        help=f"""Directory to save converted segments in, under the same names with changed
+        extension. Defaults to '{RESULTS_DIR}'""",
+    )
+    parser.add_argument(
+        "-e",
+        "--extension",
+        choices=[ASCII_EXTENSION, BINARY_EXTENSION],
+        default=BINARY_EXTENSION,
+        help=f"""Extension of converted segments, which determines their format. Only
+        '{BINARY_EXTENSION}' keeps their georeference, which is needed to mosaic them. Defaults
+        to '{BINARY_EXTENSION}'""",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=limited_int(1),
+        default=os.cpu_count() or 1,
+        help="Positive integer. Number of processes converting segments concurrently",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        default=False,
+        help="Convert all segments, including those which are up to date",
+    )
+    parser.add_argument(
+        "-m",
+        "--mosaic",
+        type=Path,
+        default=None,
+        help=f"""File to save mosaic of all converted segments in, placed on the basis of their
+        georeference. Cells not covered by any segment are missing. Requires
+        '{BINARY_EXTENSION}' extension of segments""",
+    )
+    precision.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def read_raw_segment(file: Path):
+    """
+    Read ESRI ASCII grid, with cells equal to its NODATA_value marked as missing
+
+    Returns:
+        tuple[np.ndarray, Georeference]: Data and its georeference
+    """
+    header = {}
+    with open(file, encoding="utf-8") as reader:
+        while True:
+            position = reader.tell()
+            fields = reader.readline().split()
+            if not fields or not fields[0][0].isalpha():
+                reader.seek(position)
+                break
+            header[fields[0].lower()] = float(fields[1])
+        data = np.fromfile(reader, sep=" ")
+    data = data.reshape(int(header[_ROWS_NUMBER_HEADER]), int(header[_COLUMNS_NUMBER_HEADER]))
+    if _NODATA_HEADER in header:
+        data[data == header[_NODATA_HEADER]] = np.nan
+
+    cell_size = header[_CELL_SIZE_HEADER]
+    if _X_CORNER_HEADER in header:
+        georeference = Georeference(
+            header[_X_CORNER_HEADER], header[_Y_CORNER_HEADER], cell_size
+        )
+    else:
+        georeference = Georeference(
+            header[_X_CENTER_HEADER] - cell_size / 2,
+            header[_Y_CENTER_HEADER] - cell_size / 2,
+            cell_size,
+        )
+    return data, georeference
+
+
+def _file_hash(file: Path):
+    digest = hashlib.sha256()
+    with open(file, "rb") as reader:
+        while chunk := reader.read(_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _state(file: Path):
+    stat = file.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def convert_segment(source: Path, dest: Path, previous_hash: str = None):
+    """
+    Convert raw segment, unless its content has hash equal to `previous_hash` and `dest` exists
+
+    Returns:
+        tuple[dict, bool]: Entry of manifest describing converted segment, and whether it was
+        converted
+    """
+    entry = {**_state(source), "hash": _file_hash(source), "output": dest.name}
+    if entry["hash"] == previous_hash and dest.exists():
+        return entry, False
+    data, georeference = read_raw_segment(source)
+    write_data(dest, precision.as_float(data), georeference)
+    return entry, True
+
+
+def _convert_segment(task: tuple[Path, Path, str | None, precision.Precision]):
+    source, dest, previous_hash, segment_precision = task
+    precision.set_precision(segment_precision)
+    return convert_segment(source, dest, previous_hash)
+
+
+def _read_manifest(output_dir: Path):
+    manifest = output_dir / _MANIFEST_NAME
+    if not manifest.exists():
+        return {}
+    with open(manifest, encoding="utf-8") as reader:
+        return json.load(reader)
+
+
+def _write_manifest(output_dir: Path, entries: dict):
+    with open(output_dir / _MANIFEST_NAME, "w", encoding="utf-8") as writer:
+        json.dump(entries, writer, indent=2, sort_keys=True)
+
+
+def convert_segments(
+    source_dir: Path,
+    output_dir: Path,
+    extension: str = BINARY_EXTENSION,
+    workers: int = 1,
+    force: bool = False,
+):
+    """
+    Convert all raw segments in `source_dir` concurrently. Manifest saved in `output_dir` records
+    size, modification time and hash of every converted segment. Segments with unchanged size and
+    modification time are skipped without reading them, and those with unchanged hash are not
+    converted again
+
+    Returns:
+        list[Path]: Converted segments, including skipped ones
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    previous_entries = {} if force else _read_manifest(output_dir)
+    entries = {}
+    tasks = []
+    for source in sorted(path for path in source_dir.iterdir() if path.is_file()):
+        dest = output_dir / source.with_suffix(extension).name
+        entry = previous_entries.get(source.name)
+        if entry is not None and entry["output"] == dest.name and dest.exists():
+            if {key: entry[key] for key in ("size", "mtime_ns")} == _state(source):
+                entries[source.name] = entry
+                continue
+        previous_hash = entry["hash"] if entry is not None else None
+        tasks.append((source, dest, previous_hash, precision.get_precision()))
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+            converted = list(pool.map(_convert_segment, tasks))
+    else:
+        converted = [_convert_segment(task) for task in tasks]
+    for (source, *_), (entry, was_converted) in zip(tasks, converted):
+        entries[source.name] = entry
+        print(f"{'Converted' if was_converted else 'Up to date'}: {source.name}")
+    _write_manifest(output_dir, entries)
+    return [output_dir / entry["output"] for _, entry in sorted(entries.items())]
+
+
+def mosaic(segments: list[Path], dest: Path, band_rows: int = _BAND_ROWS):
+    """
+    Place georeferenced segments of equal cell size in a single grid, covering all of them, which
+    is written in bands of rows. Where segments overlap, values known in later ones are used
+    """
+    georeferences = [read_georeference(segment) for segment in segments]
+    for segment, georeference in zip(segments, georeferences):
+        if georeference is None:
+            raise ValueError(f"{segment} is not georeferenced")
+    cell_size = georeferences[0].cellsize
+    if not np.allclose([georeference.cellsize for georeference in georeferences], cell_size):
+        raise ValueError("Segments with different cell sizes can not be mosaicked")
+
+    shapes = [read_shape(segment) for segment in segments]
+    left = min(georeference.xllcorner for georeference in georeferences)
+    bottom = min(georeference.yllcorner for georeference in georeferences)
+    tops = [
+        georeference.yllcorner + shape[0] * cell_size
+        for georeference, shape in zip(georeferences, shapes)
+    ]
+    right = max(
+        georeference.xllcorner + shape[1] * cell_size
+        for georeference, shape in zip(georeferences, shapes)
+    )
+    top = max(tops)
+    shape = (round((top - bottom) / cell_size), round((right - left) / cell_size))
+    # Index of the first row and column of every segment in the mosaic
+    offsets = [
+        (
+            round((top - segment_top) / cell_size),
+            round((georeference.xllcorner - left) / cell_size),
+        )
+        for georeference, segment_top in zip(georeferences, tops)
+    ]
+
+    with RowBandWriter(dest, shape, georeference=Georeference(left, bottom, cell_size)) as writer:
+        for first_row in range(0, shape[0], band_rows):
+            band = np.full(
+                (min(band_rows, shape[0] - first_row), shape[1]),
+                np.nan,
+                dtype=precision.float_dtype(),
+            )
+            for segment, segment_shape, (row, column) in zip(segments, shapes, offsets):
+                start = max(first_row, row)
+                stop = min(first_row + band.shape[0], row + segment_shape[0])
+                if start >= stop:
+                    continue
+                values = read_data(segment)[start - row : stop - row]
+                np.copyto(
+                    band[start - first_row : stop - first_row, column : column + values.shape[1]],
+                    values,
+                    where=~np.isnan(values),
+                )
+            writer.write(band)
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    precision.set_precision(precision.Precision(args.precision))
+    segments = convert_segments(
+        args.source_dir, args.output_dir, args.extension, args.workers, args.force
+    )
+    if args.mosaic is not None:
+        mosaic(segments, args.mosaic)
+
+
 if __name__ == "__main__":
-    DATA_DIR = Path("data/raw/poland_DEM")
-    RESULTS_DIR = Path("data/processed/poland_DEM")
-    if not RESULTS_DIR.is_dir():
-        RESULTS_DIR.mkdir()
-    for file in (path for path in DATA_DIR.iterdir() if path.is_file()):
-        result = RESULTS_DIR.joinpath(file.name)
-        with (
-            open(file, encoding="utf-8") as reader,
-            open(result, "w", encoding="utf-8") as writer,
-        ):
-            for _ in range(2):
-                line = reader.readline()
-                writer.write(line)
-            for _ in range(4):
-                next(reader)
-            for line in reader:
-                writer.write(line)
+    main()
@@ -1,14 +1,16 @@
 from argparse import ArgumentParser
 from pathlib import Path
 
+from src.util import precision
 from src.util.cli import limited_float
-from src.util.data import subsample
-from src.util.data_io import read_data, write_data
+from src.util.data import holdout, subsample, subsample_points
+from src.util.data_io import SPARSE_EXTENSION, is_sparse, read_data, write_data, write_sparse
 
 _TARGET_SUFFIX = "_subsampled"
+_QUERY_SUFFIX = "_query"
 
 
-def parse_args():
+def parse_args(argv: list[str] = None):
     parser = ArgumentParser(
         description="Subsample data and save results in another file"
     )
@@ -25,7 +27,8 @@ def parse_args():
         type=Path,
         default=None,
         help=f"""File to save results in. If omitted results will be saved in the same directory as
-        `data` under name '<data>{_TARGET_SUFFIX}'""",
+        `data` under name '<data>{_TARGET_SUFFIX}'. If it has '{SPARSE_EXTENSION}' extension,
+        only coordinates and values of samples are saved""",
     )
     parser.add_argument(
         "-r",
@@ -42,13 +45,45 @@ def parse_args():
         default=None,
         help="Seed to use for RNG used in subsampling",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "-m",
+        "--missing-ratio",
+        type=limited_float(0.0, 1.0),
+        default=None,
+        help="""If specified, additionally save copy of `data` in which this part of data points,
+        disjoint with sampled ones, is missing, to be predicted on the basis of samples. Needs to
+        be in range (0.0, 1.0)""",
+    )
+    parser.add_argument(
+        "-q",
+        "--query-target",
+        type=Path,
+        default=None,
+        help=f"""File to save data with missing values in. If omitted it will be saved in the same
+        directory as `data` under name '<data>{_QUERY_SUFFIX}'""",
+    )
+    precision.add_arguments(parser)
+    return parser.parse_args(argv)
 
 
-if __name__ == "__main__":
-    args = parse_args()
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    precision.set_precision(precision.Precision(args.precision))
     if args.target is None:
         args.target = args.data.with_stem(args.data.stem + _TARGET_SUFFIX)
     data = read_data(args.data)
-    subsampled = subsample(data, args.ratio, args.seed)
+    if args.missing_ratio is None:
+        if is_sparse(args.target):
+            write_sparse(args.target, data.shape, *subsample_points(data, args.ratio, args.seed))
+        else:
+            write_data(args.target, subsample(data, args.ratio, args.seed))
+        return
+    if args.query_target is None:
+        args.query_target = args.data.with_stem(args.data.stem + _QUERY_SUFFIX)
+    subsampled, incomplete_data = holdout(data, args.ratio, args.missing_ratio, args.seed)
     write_data(args.target, subsampled)
+    write_data(args.query_target, incomplete_data)
+
+
+if __name__ == "__main__":
+    main()
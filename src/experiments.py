@@ -0,0 +1,402 @@
+"""
+Run experiments comparing models on subsampled data as a graph of subsampling, training,
+prediction and comparison tasks, running independent tasks concurrently and skipping tasks which
+inputs and parameters did not change since they were last run
+"""
+import hashlib
+import json
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from src import runner
+from src.data.generate import GENERATED_DIR
+from src.data.poland_dem import DATA_DIR, RESULTS_DIR
+from src.models.config import MODEL_DIRECTORY
+from src.util import cache
+from src.util.cli import limited_float, limited_int
+from src.util.data_io import ASCII_EXTENSION
+from src.visualization.heatmaps_comparison import FIGURES_DIR
+from src.visualization.metrics import METRICS_DIR
+
+_DATA_FILES = [
+    GENERATED_DIR / f"waves{ASCII_EXTENSION}",
+    RESULTS_DIR / f"area_elevation_1{ASCII_EXTENSION}",
+]
+_RATIOS = [0.01, 0.005, 0.001]
+_IDW_POWERS = [0.5, 1.0, 2.0]
+_IDW_NEIGHBORS = [3, 7, 15]
+_SEED = 1879465786
+_CACHE_FILE = Path("data/interim/experiments_cache.json")
+_HASH_CHUNK_SIZE = 2**20
+
+_SUBSAMPLE_SUFFIX = "_sub"
+_FIGURE_EXTENSION = ".png"
+_METRICS_SUFFIX = "_metrics.csv"
+
+
+def parse_args(argv: list[str] = None):
+    parser = ArgumentParser(
+        description="""Subsample data, train models, predict missing values and visualize
+        predictions for every combination of data, subsampling ratio and model parameters,
+        skipping steps which inputs and parameters did not change"""
+    )
+    parser.add_argument(
+        "-d",
+        "--data",
+        nargs="+",
+        type=Path,
+        default=_DATA_FILES,
+        help="Files containing complete data experiments are carried out on",
+    )
+    parser.add_argument(
+        "-r",
+        "--ratios",
+        nargs="+",
+        type=limited_float(0.0, 1.0),
+        default=_RATIOS,
+        help="""Numbers in range (0, 1). Ratios of values kept when subsampling data. IDW and
+        kriging use only the smallest of them""",
+    )
+    parser.add_argument(
+        "-p",
+        "--idw-powers",
+        nargs="+",
+        type=limited_float(0.0),
+        default=_IDW_POWERS,
+        help="Positive numbers. Powers of IDW models",
+    )
+    parser.add_argument(
+        "-n",
+        "--idw-neighbors",
+        nargs="+",
+        type=limited_int(1),
+        default=_IDW_NEIGHBORS,
+        help="Positive integers. Numbers of neighbors used by IDW models",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        default=_SEED,
+        help="Seed to use for RNG used in subsampling",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=limited_int(1),
+        default=1,
+        help="Positive integer. Number of processes running independent tasks concurrently",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        type=Path,
+        default=_CACHE_FILE,
+        help=f"""File with hashes of inputs, parameters and outputs of tasks that were run.
+        Defaults to '{_CACHE_FILE}'""",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        default=False,
+        help="Run all tasks, including those which are up to date",
+    )
+    return parser.parse_args(argv)
+
+
+@dataclass
+class Task:
+    """
+    Job of the runner with its arguments, files it reads and files it writes. Tasks depend on
+    tasks writing files they read
+    """
+
+    name: str
+    job: str
+    args: list[str]
+    inputs: list[Path] = field(default_factory=list)
+    outputs: list[Path] = field(default_factory=list)
+
+
+def _label(number: float):
+    """
+    Number without decimal point, like in names of files created by carry_out_experiments.sh
+    """
+    return f"{number:g}".replace(".", "")
+
+
+def experiment_tasks(
+    data_files: list[Path],
+    ratios: list[float],
+    idw_powers: list[float],
+    idw_neighbors: list[int],
+    seed: int,
+):
+    """
+    Tasks of experiments on every data file: subsampling it with every ratio, linear regression
+    trained on every subsample, IDW with every combination of parameters and kriging on the
+    smallest subsample, visualizations of all predictions and table of their metrics for every
+    subsample. Data files are also generated or processed from raw data if they are among files
+    those produce
+    """
+    tasks = []
+    generated = GENERATED_DIR / f"waves{ASCII_EXTENSION}"
+    if generated in data_files:
+        tasks.append(Task("generate", "generate", [], outputs=[generated]))
+    raw_files = []
+    if DATA_DIR.is_dir():
+        raw_files = sorted(path for path in DATA_DIR.iterdir() if path.is_file())
+    processed = [RESULTS_DIR / path.with_suffix(ASCII_EXTENSION).name for path in raw_files]
+    if set(processed) & set(data_files):
+        tasks.append(
+            Task("poland_dem", "poland_dem", ["-e", ASCII_EXTENSION], raw_files, processed)
+        )
+
+    smallest_ratio = min(ratios)
+    for data in data_files:
+        predictions = []
+        for ratio in ratios:
+            samples = data.with_stem(f"{data.stem}{_SUBSAMPLE_SUFFIX}{_label(ratio)}")
+            tasks.append(
+                Task(
+                    f"subsample {samples.stem}",
+                    "subsample",
+                    ["-d", data, "-t", samples, "-r", ratio, "-s", seed],
+                    [data],
+                    [samples],
+                )
+            )
+            model = MODEL_DIRECTORY / f"linear_regression_{samples.stem}"
+            tasks.append(
+                Task(
+                    f"train {model.name}",
+                    "linear_regression",
+                    ["train", "-d", samples, "-t", model],
+                    [samples],
+                    [model],
+                )
+            )
+            predicted = samples.with_stem(f"{samples.stem}_predicted_linear")
+            tasks.append(
+                Task(
+                    f"predict {predicted.stem}",
+                    "linear_regression",
+                    ["predict", "-m", model, "-q", samples, "-t", predicted],
+                    [model, samples],
+                    [predicted],
+                )
+            )
+            predictions.append((samples, predicted, "linear"))
+
+            if ratio != smallest_ratio:
+                continue
+            # Predictions for all parameters are made at once, from neighbors queried once
+            idw_predictions = [
+                samples.with_stem(f"{samples.stem}_{_label(power)}_{neighbors}_predicted_idw")
+                for power in idw_powers
+                for neighbors in idw_neighbors
+            ]
+            target = samples.parent if len(set(idw_predictions)) > 1 else idw_predictions[0]
+            tasks.append(
+                Task(
+                    f"predict {samples.stem}_predicted_idw",
+                    "idw",
+                    ["-q", samples, "-p", *idw_powers, "-n", *idw_neighbors, "-t", target],
+                    [samples],
+                    idw_predictions,
+                )
+            )
+            predictions.extend((samples, predicted, "idw") for predicted in idw_predictions)
+
+            model = MODEL_DIRECTORY / f"kriging_{samples.stem}"
+            tasks.append(
+                Task(
+                    f"train {model.name}",
+                    "kriging",
+                    ["train", "-d", samples, "-t", model],
+                    [samples],
+                    [model],
+                )
+            )
+            predicted = samples.with_stem(f"{samples.stem}_predicted_kriging")
+            tasks.append(
+                Task(
+                    f"predict {predicted.stem}",
+                    "kriging",
+                    ["predict", "-m", model, "-q", samples, "-t", predicted],
+                    [model, samples],
+                    [predicted],
+                )
+            )
+            predictions.append((samples, predicted, "kriging"))
+
+        for samples, predicted, model_type in predictions:
+            figure = FIGURES_DIR / (
+                predicted.stem.replace(f"_predicted_{model_type}", "")
+                + f"_{model_type}_predictions_visualization{_FIGURE_EXTENSION}"
+            )
+            tasks.append(
+                Task(
+                    f"compare {figure.stem}",
+                    "compare",
+                    ["-r", data, "-s", samples, "-p", predicted, "-t", figure],
+                    [data, samples, predicted],
+                    [figure],
+                )
+            )
+
+        predictions_by_samples = {}
+        for samples, predicted, _ in predictions:
+            predictions_by_samples.setdefault(samples, []).append(predicted)
+        for samples, predicted in predictions_by_samples.items():
+            table = METRICS_DIR / f"{samples.stem}{_METRICS_SUFFIX}"
+            tasks.append(
+                Task(
+                    f"metrics {samples.stem}",
+                    "metrics",
+                    ["-r", data, "-s", samples, "-p", *predicted, "-o", table],
+                    [data, samples, *predicted],
+                    [table],
+                )
+            )
+    return tasks
+
+
+class _Cache:
+    """
+    Hashes of contents of files, remembered together with their sizes and modification times so
+    that unchanged files are not read again, and keys of tasks that were run with hashes of files
+    they wrote
+    """
+
+    def __init__(self, file: Path):
+        self.file = file
+        self.files = {}
+        self.tasks = {}
+        if file.exists():
+            with open(file, encoding="utf-8") as reader:
+                content = json.load(reader)
+            self.files, self.tasks = content["files"], content["tasks"]
+
+    def save(self):
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.file, "w", encoding="utf-8") as writer:
+            json.dump({"files": self.files, "tasks": self.tasks}, writer, indent=2)
+
+    def file_hash(self, file: Path):
+        stat = file.stat()
+        entry = self.files.get(str(file))
+        if entry is not None and (entry["size"], entry["mtime_ns"]) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        ):
+            return entry["hash"]
+        digest = hashlib.sha256()
+        with open(file, "rb") as reader:
+            while chunk := reader.read(_HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        self.files[str(file)] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": digest.hexdigest(),
+        }
+        return digest.hexdigest()
+
+    def key(self, task: Task):
+        """
+        Hash of job, arguments and contents of inputs of task
+        """
+        for path in task.inputs:
+            if not path.exists():
+                raise FileNotFoundError(f"Input {path} of task '{task.name}' does not exist")
+        description = [task.job, [str(arg) for arg in task.args]]
+        description.append([[str(path), self.file_hash(path)] for path in task.inputs])
+        return hashlib.sha256(json.dumps(description).encode("utf-8")).hexdigest()
+
+    def is_up_to_date(self, task: Task, key: str):
+        entry = self.tasks.get(task.name)
+        if entry is None or entry["key"] != key:
+            return False
+        return all(
+            path.exists() and self.file_hash(path) == entry["outputs"].get(str(path))
+            for path in task.outputs
+        )
+
+    def record(self, task: Task, key: str):
+        self.tasks[task.name] = {
+            "key": key,
+            "outputs": {str(path): self.file_hash(path) for path in task.outputs},
+        }
+
+
+def _run_task(task: Task):
+    for path in task.outputs:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    runner.run_job({"job": task.job, "args": task.args})
+
+
+def run(
+    tasks: list[Task],
+    cache_file: Path = _CACHE_FILE,
+    workers: int = 1,
+    force: bool = False,
+):
+    """
+    Run tasks after tasks writing their inputs, on a pool of processes. Task is skipped if hashes
+    of its job, arguments and contents of inputs are equal to those of its last run and its
+    outputs were not modified since, so tasks which inputs were written again with the same
+    content are skipped too. Cache is saved after every task
+    """
+    producers = {path: task.name for task in tasks for path in task.outputs}
+    dependencies = {
+        task.name: {producers[path] for path in task.inputs if path in producers}
+        for task in tasks
+    }
+    pending = {task.name: task for task in tasks}
+    finished = set()
+    running = {}
+    cached = _Cache(cache_file)
+
+    with ProcessPoolExecutor(workers, initializer=cache.enable) as pool:
+        try:
+            while pending or running:
+                ready = [
+                    task for name, task in pending.items() if dependencies[name] <= finished
+                ]
+                for task in ready:
+                    del pending[task.name]
+                    key = cached.key(task)
+                    if not force and cached.is_up_to_date(task, key):
+                        print(f"Up to date: {task.name}")
+                        finished.add(task.name)
+                    else:
+                        running[pool.submit(_run_task, task)] = (task, key)
+                if ready and not running:
+                    # Skipped tasks may have made others ready
+                    continue
+                if not running:
+                    raise ValueError(f"Tasks {', '.join(pending)} depend on each other")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, key = running.pop(future)
+                    future.result()
+                    cached.record(task, key)
+                    finished.add(task.name)
+                    print(f"Finished: {task.name}")
+        finally:
+            cached.save()
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    tasks = experiment_tasks(
+        args.data, args.ratios, args.idw_powers, args.idw_neighbors, args.seed
+    )
+    run(tasks, args.cache, args.workers, args.force)
+
+
+if __name__ == "__main__":
+    main()
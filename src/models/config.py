@@ -1,3 +1,9 @@
 from pathlib import Path
 
+from joblib import load
+
+from src.util.cache import file_cached
+
 MODEL_DIRECTORY = Path("models")
+
+load_model = file_cached(load)
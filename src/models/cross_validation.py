@@ -0,0 +1,420 @@
+"""
+Spatial cross-validation of IDW parameters and kriging variogram models on known samples. Every
+fold builds a single spatial index of its training samples and queries neighbors of its held out
+samples once, and all candidate configurations are evaluated from those neighbors
+"""
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from src.models import idw
+from src.models.kriging import LocalKriging
+from src.models.variogram import MAX_PAIRS, MODELS, BinnedVariogram
+from src.util import instrumentation, precision
+from src.util.cli import limited_float, limited_int
+from src.util.data_io import read_known_points
+from src.visualization.metrics import ErrorAccumulator, write_table
+
+_FOLDS = 5
+_IDW_POWERS = [0.5, 1.0, 2.0]
+_IDW_NEIGHBORS = [3, 7, 15]
+_KRIGING_NEIGHBORS = 16
+
+
+def _parse_args(argv: list[str] = None):
+    parser = ArgumentParser(
+        description="""Cross-validate IDW parameters and kriging variogram models on known values
+        of data and report errors of predictions of held out values and time of every
+        configuration"""
+    )
+    parser.add_argument(
+        "-d",
+        "--data",
+        type=Path,
+        required=True,
+        help="File containing data which known values are used for cross-validation",
+    )
+    parser.add_argument(
+        "-k",
+        "--folds",
+        type=limited_int(2),
+        default=_FOLDS,
+        help=f"""Integer greater than 1. Number of folds known values are split into. Defaults to
+        {_FOLDS}""",
+    )
+    parser.add_argument(
+        "-l",
+        "--leave-one-out",
+        action="store_true",
+        default=False,
+        help="""Predict every known value from all other ones instead of splitting them into
+        folds. Variograms are fitted once, to all known values""",
+    )
+    parser.add_argument(
+        "-b",
+        "--block-size",
+        type=limited_int(1),
+        default=None,
+        help="""Positive integer. If specified, known values are assigned to folds in square
+        blocks of that many rows and columns instead of one by one, so that held out values are
+        not predicted from their closest neighbors only""",
+    )
+    parser.add_argument(
+        "-p",
+        "--idw-powers",
+        nargs="*",
+        type=limited_float(0.0),
+        default=_IDW_POWERS,
+        help="Positive numbers. Powers of IDW models. If none are given IDW is not evaluated",
+    )
+    parser.add_argument(
+        "-n",
+        "--idw-neighbors",
+        nargs="+",
+        type=limited_int(1),
+        default=_IDW_NEIGHBORS,
+        help="Positive integers. Numbers of neighbors used by IDW models",
+    )
+    parser.add_argument(
+        "-v",
+        "--variogram-models",
+        nargs="*",
+        choices=MODELS,
+        default=list(MODELS),
+        help="""Theoretical variogram models of kriging. If none are given kriging is not
+        evaluated""",
+    )
+    parser.add_argument(
+        "--kriging-neighbors",
+        type=limited_int(1),
+        default=_KRIGING_NEIGHBORS,
+        help=f"""Positive integer. Number of nearest samples used by local kriging to predict a
+        value. Defaults to {_KRIGING_NEIGHBORS}""",
+    )
+    parser.add_argument(
+        "--max-pairs",
+        type=limited_int(1),
+        default=MAX_PAIRS,
+        help=f"""Positive integer. Largest number of pairs of samples variograms are estimated
+        from. Defaults to {MAX_PAIRS}""",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed to use for RNG used in assigning values to folds and sampling pairs",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=limited_int(1),
+        default=1,
+        help="Positive integer. Number of processes evaluating folds concurrently",
+    )
+    parser.add_argument(
+        "--max-rmse",
+        type=limited_float(0.0),
+        default=None,
+        help="""Positive number. If specified, the fastest configuration which RMSE does not
+        exceed it is reported""",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=None,
+        help="""File to save table of errors and times in, as JSON if its extension is '.json'
+        and as CSV otherwise. If omitted CSV is printed""",
+    )
+    precision.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if not args.idw_powers and not args.variogram_models:
+        parser.error("at least one IDW power or variogram model is required")
+    return args
+
+
+@dataclass(frozen=True)
+class Candidates:
+    """
+    Configurations evaluated in every fold: IDW with every combination of power and number of
+    neighbors, and local kriging with every variogram model
+    """
+
+    idw_powers: list[float] = field(default_factory=lambda: list(_IDW_POWERS))
+    idw_neighbors: list[int] = field(default_factory=lambda: list(_IDW_NEIGHBORS))
+    variogram_models: list[str] = field(default_factory=lambda: list(MODELS))
+    kriging_neighbors: int = _KRIGING_NEIGHBORS
+    max_pairs: int = MAX_PAIRS
+    seed: int = None
+
+    def max_neighbors(self):
+        neighbors = list(self.idw_neighbors) if self.idw_powers else []
+        if self.variogram_models:
+            neighbors.append(self.kriging_neighbors)
+        return max(neighbors, default=0)
+
+
+def spatial_folds(
+    coordinates: np.ndarray, folds: int, block_size: int = None, seed: int = None
+):
+    """
+    Index of fold of every point. Points are shuffled into folds one by one, or in square blocks
+    of `block_size` cells if it is specified
+
+    Returns:
+        np.ndarray: Index of fold, from 0 to `folds` - 1, of every point
+    """
+    if block_size is None:
+        blocks = np.arange(coordinates.shape[0])
+    else:
+        _, blocks = np.unique(
+            np.asarray(coordinates) // block_size, axis=0, return_inverse=True
+        )
+        blocks = blocks.reshape(-1)
+    blocks_count = int(blocks.max(initial=-1)) + 1
+    if blocks_count < folds:
+        raise ValueError(f"{blocks_count} blocks of points can not be split into {folds} folds")
+    rng = np.random.default_rng(seed)
+    return (rng.permutation(blocks_count) % folds)[blocks]
+
+
+def _configuration(model: str, power=None, neighbors=None, variogram_model=None):
+    return {
+        "model": model,
+        "power": power,
+        "neighbors": neighbors,
+        "variogram_model": variogram_model,
+    }
+
+
+def evaluate_fold(
+    coordinates: np.ndarray,
+    values: np.ndarray,
+    held_out: np.ndarray,
+    candidates: Candidates,
+    leave_one_out: bool = False,
+):
+    """
+    Predict values of points at indices `held_out` with every candidate configuration, trained
+    on all other points, or on all points excluding the predicted one if `leave_one_out`
+
+    Returns:
+        list[tuple[dict, np.ndarray, float]]: Configuration, errors of its predictions and time
+        taken to make them, including time of building the index and querying neighbors, which
+        are shared by all configurations
+    """
+    training = np.ones(values.size, dtype=bool)
+    if not leave_one_out:
+        training[held_out] = False
+    training_coordinates = np.asarray(coordinates[training], dtype=np.float64)
+    training_values = values[training]
+    queries = np.asarray(coordinates[held_out], dtype=np.float64)
+    expected = values[held_out].astype(np.float64)
+
+    start = time.perf_counter()
+    with instrumentation.span("cross_validation.query", held_out.size):
+        # Leaf size used by IDW, so that order of equidistant neighbors is the same
+        kdtree = cKDTree(training_coordinates, leafsize=10)
+        # In leave-one-out every point is its own closest neighbor, which is skipped
+        skipped = 1 if leave_one_out else 0
+        k = min(candidates.max_neighbors() + skipped, kdtree.n)
+        distances, neighbors = kdtree.query(queries, k=k, workers=-1)
+        distances = np.reshape(distances, (queries.shape[0], k))[:, skipped:]
+        neighbors = np.reshape(neighbors, (queries.shape[0], k))[:, skipped:]
+    shared_s = time.perf_counter() - start
+
+    results = []
+    for power in candidates.idw_powers:
+        start = time.perf_counter()
+        with instrumentation.span("cross_validation.idw", held_out.size, power=power):
+            predictions = idw.predict_from_neighbors(
+                distances.astype(training_values.dtype, copy=False),
+                training_values[neighbors],
+                candidates.idw_neighbors,
+                [power],
+            )
+        power_s = time.perf_counter() - start
+        for n_neighbors in candidates.idw_neighbors:
+            results.append(
+                (
+                    _configuration("idw", power, n_neighbors),
+                    predictions[n_neighbors, power] - expected,
+                    shared_s + power_s,
+                )
+            )
+
+    if candidates.variogram_models:
+        # Experimental variogram is estimated once, only models are fitted for every candidate,
+        # so time of estimating it is shared by all of them like time of querying neighbors
+        start = time.perf_counter()
+        with instrumentation.span("cross_validation.variogram", training_values.size):
+            binned = BinnedVariogram(
+                training_coordinates,
+                training_values,
+                candidates.variogram_models[0],
+                max_pairs=candidates.max_pairs,
+                seed=candidates.seed,
+            )
+        binning_s = time.perf_counter() - start
+    for variogram_model in candidates.variogram_models:
+        start = time.perf_counter()
+        with instrumentation.span(
+            "cross_validation.kriging", held_out.size, model=variogram_model
+        ):
+            variogram = binned.with_model(variogram_model)
+            kriging = LocalKriging(
+                variogram, min(candidates.kriging_neighbors, neighbors.shape[1]), kdtree
+            )
+            predictions = kriging.predict_from_neighbors(
+                queries, neighbors[:, : kriging.n_neighbors]
+            )
+        results.append(
+            (
+                _configuration(
+                    "kriging", neighbors=kriging.n_neighbors, variogram_model=variogram_model
+                ),
+                predictions - expected,
+                shared_s + binning_s + time.perf_counter() - start,
+            )
+        )
+    return results
+
+
+_worker_points: tuple[np.ndarray, np.ndarray, Candidates, bool] = None
+
+
+def _initialize_worker(
+    coordinates: np.ndarray,
+    values: np.ndarray,
+    candidates: Candidates,
+    leave_one_out: bool,
+    worker_precision: precision.Precision,
+):
+    global _worker_points
+    precision.set_precision(worker_precision)
+    _worker_points = (coordinates, values, candidates, leave_one_out)
+
+
+def _evaluate_fold(held_out: np.ndarray):
+    coordinates, values, candidates, leave_one_out = _worker_points
+    return evaluate_fold(coordinates, values, held_out, candidates, leave_one_out)
+
+
+def cross_validate(
+    coordinates: np.ndarray,
+    values: np.ndarray,
+    candidates: Candidates = Candidates(),
+    folds: int = _FOLDS,
+    leave_one_out: bool = False,
+    block_size: int = None,
+    seed: int = None,
+    workers: int = 1,
+):
+    """
+    Evaluate every candidate configuration on every fold and sum up its errors and time. In
+    leave-one-out, points are split into as many chunks as there are workers, every one querying
+    neighbors of its points in index of all points
+
+    Returns:
+        list[dict]: Row of table for every configuration, with metrics of errors of all its
+        predictions and total time over all folds
+    """
+    if candidates.max_neighbors() == 0:
+        raise ValueError("There are no configurations to evaluate")
+    if leave_one_out:
+        held_out_sets = np.array_split(np.arange(values.size), workers)
+    else:
+        assignment = spatial_folds(coordinates, folds, block_size, seed)
+        held_out_sets = [(assignment == fold).nonzero()[0] for fold in range(folds)]
+    held_out_sets = [held_out for held_out in held_out_sets if held_out.size > 0]
+
+    initargs = (coordinates, values, candidates, leave_one_out, precision.get_precision())
+    if workers > 1 and len(held_out_sets) > 1:
+        with ProcessPoolExecutor(
+            min(workers, len(held_out_sets)), initializer=_initialize_worker, initargs=initargs
+        ) as pool:
+            fold_results = list(pool.map(_evaluate_fold, held_out_sets))
+    else:
+        _initialize_worker(*initargs)
+        fold_results = [_evaluate_fold(held_out) for held_out in held_out_sets]
+
+    rows = []
+    for results in zip(*fold_results):
+        accumulator = ErrorAccumulator()
+        for _, errors, _ in results:
+            accumulator.add(errors)
+        rows.append(
+            {
+                **results[0][0],
+                "folds": values.size if leave_one_out else len(results),
+                "evaluated": accumulator.count,
+                **accumulator.result(),
+                "seconds": sum(seconds for _, _, seconds in results),
+            }
+        )
+    return rows
+
+
+def fastest_within(rows: list[dict], max_rmse: float):
+    """
+    Row of the fastest configuration which RMSE does not exceed `max_rmse`, or None if there is no
+    such configuration
+    """
+    accurate = [row for row in rows if row["rmse"] <= max_rmse]
+    return min(accurate, key=lambda row: row["seconds"], default=None)
+
+
+def main(argv: list[str] = None):
+    args = _parse_args(argv)
+    precision.set_precision(precision.Precision(args.precision))
+    candidates = Candidates(
+        list(dict.fromkeys(args.idw_powers)),
+        list(dict.fromkeys(args.idw_neighbors)),
+        list(dict.fromkeys(args.variogram_models)),
+        args.kriging_neighbors,
+        args.max_pairs,
+        args.seed,
+    )
+    with instrumentation.session(args.trace, args.profile):
+        coordinates, values = read_known_points(args.data)
+        rows = cross_validate(
+            coordinates,
+            values,
+            candidates,
+            args.folds,
+            args.leave_one_out,
+            args.block_size,
+            args.seed,
+            args.workers,
+        )
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+    write_table(rows, args.output)
+
+    if args.max_rmse is not None:
+        row = fastest_within(rows, args.max_rmse)
+        if row is None:
+            print(f"No configuration has RMSE of at most {args.max_rmse}", file=sys.stderr)
+        else:
+            description = ", ".join(
+                f"{key}={value}"
+                for key, value in row.items()
+                if key in ("model", "power", "neighbors", "variogram_model") and value is not None
+            )
+            print(
+                f"Fastest configuration with RMSE of at most {args.max_rmse}: {description} "
+                f"(RMSE={row['rmse']:.4g}, {row['seconds']:.3g} s)",
+                file=sys.stderr,
+            )
+
+
+if __name__ == "__main__":
+    main()
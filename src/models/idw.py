@@ -1,16 +1,194 @@
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+from contextlib import ExitStack
+from enum import Enum
+from itertools import product
 from pathlib import Path
 
 import numpy as np
 from photutils.utils import ShepardIDWInterpolator
+from scipy.spatial import cKDTree
 
-from src.util.cli import limited_float
-from src.util.data_io import read_data, write_data
+from src.models.idw_grid import GridIDWInterpolator
+from src.models.predictor import Predictor
+from src.util import instrumentation, precision, tiling
+from src.util.cli import limited_float, limited_int
+from src.util.data import indices_to_coordinates, known_points
+from src.util.data_io import (
+    RowBandWriter,
+    iter_row_bands,
+    read_data,
+    read_georeference,
+    read_known_points,
+    read_shape,
+    transform_row_bands,
+    write_data,
+)
 
 _PREDICTED_SUFFIX = "_predicted_idw"
+_TILE_SIZE = 2**16
 
 
-def _parse_args():
+class Backend(Enum):
+    """
+    Implementations of IDW. KDTREE and GRID may pick different neighbors where the last of them
+    is as far as the next one, so their predictions can differ in cells with such ties
+    """
+
+    PHOTUTILS = "photutils"
+    KDTREE = "kdtree"
+    GRID = "grid"
+
+
+class KDTreeIDWInterpolator:
+    """
+    Inverse Distance Weighting interpolator with the same calling convention as
+    `photutils.utils.ShepardIDWInterpolator`.
+
+    Queries are processed in tiles of fixed size, so memory used for neighbors' distances and
+    indices is bounded by `tile_size * n_neighbors`, and neighbors of points in a tile are
+    searched for using all available cores. Weights are computed in place, in the floating point
+    type of known values.
+    """
+
+    def __init__(
+        self, coordinates: np.ndarray, values: np.ndarray, tile_size: int = _TILE_SIZE
+    ):
+        self.values = np.asarray(values)
+        if not np.issubdtype(self.values.dtype, np.floating):
+            self.values = self.values.astype(np.float64)
+        # Leaf size used by photutils, it keeps order of equidistant neighbors, which are common
+        # in grids, the same in both backends
+        self.kdtree = cKDTree(coordinates, leafsize=10)
+        self.tile_size = tile_size
+
+    def __call__(self, positions: np.ndarray, n_neighbors: int = 8, power: float = 1.0):
+        positions = np.reshape(positions, (-1, self.kdtree.m))
+        n_neighbors = min(n_neighbors, self.kdtree.n)
+        predictions = np.empty(positions.shape[0], dtype=self.values.dtype)
+        for start in range(0, positions.shape[0], self.tile_size):
+            stop = start + self.tile_size
+            distances, indices = self.kdtree.query(
+                positions[start:stop], k=n_neighbors, workers=-1
+            )
+            if n_neighbors == 1:
+                predictions[start:stop] = self.values[indices]
+            else:
+                predictions[start:stop] = _weighted_mean(
+                    distances.astype(self.values.dtype, copy=False),
+                    self.values[indices],
+                    power,
+                )
+        return predictions
+
+    def sweep(self, positions: np.ndarray, neighbors: list[int], powers: list[float]):
+        """
+        Predict values for every combination of number of neighbors and power, querying the
+        largest number of neighbors only once.
+
+        Neighbors for smaller numbers are the first ones of that query. Where the last of them
+        is as far as the next one, the tie can be broken differently than by a query for fewer
+        neighbors, so predictions there may differ from a separate run with the same parameters
+
+        Returns:
+            dict[tuple[int, float], np.ndarray]: Predictions by number of neighbors and power
+        """
+        positions = np.reshape(positions, (-1, self.kdtree.m))
+        max_neighbors = min(max(neighbors), self.kdtree.n)
+        predictions = {
+            (n_neighbors, power): np.empty(positions.shape[0], dtype=self.values.dtype)
+            for n_neighbors, power in product(neighbors, powers)
+        }
+        for start in range(0, positions.shape[0], self.tile_size):
+            stop = start + self.tile_size
+            distances, indices = self.kdtree.query(
+                positions[start:stop], k=max_neighbors, workers=-1
+            )
+            distances = np.reshape(distances, (distances.shape[0], max_neighbors))
+            tile_predictions = predict_from_neighbors(
+                distances.astype(self.values.dtype, copy=False),
+                self.values[np.reshape(indices, distances.shape)],
+                neighbors,
+                powers,
+            )
+            for combination, values in tile_predictions.items():
+                predictions[combination][start:stop] = values
+        return predictions
+
+
+def predict_from_neighbors(
+    distances: np.ndarray,
+    neighbors_values: np.ndarray,
+    neighbors: list[int],
+    powers: list[float],
+):
+    """
+    Predictions for every combination of number of neighbors and power from distances to already
+    queried neighbors, sorted by distance, and their values. For every power, weighted sums over
+    growing numbers of the closest neighbors are cumulative sums of the same products
+
+    Returns:
+        dict[tuple[int, float], np.ndarray]: Predictions by number of neighbors and power
+    """
+    predictions = {}
+    for power in powers:
+        weights = _weights(np.array(distances), power)
+        weighted_sums = np.cumsum(weights * neighbors_values, axis=1)
+        weights_sums = np.cumsum(weights, axis=1)
+        for n_neighbors in neighbors:
+            column = min(n_neighbors, distances.shape[1]) - 1
+            predictions[n_neighbors, power] = weighted_sums[:, column] / weights_sums[:, column]
+    return predictions
+
+
+def _weights(distances: np.ndarray, power: float):
+    """
+    Inverse distance weights computed in place, with queries placed at a known point having all
+    weight given to it
+    """
+    # Neighbors are sorted by distance, query placed at a known point has it in the first column
+    exact = distances[:, 0] == 0
+    with np.errstate(divide="ignore"):
+        weights = np.power(distances, -power, out=distances)
+    weights[exact] = 0
+    weights[exact, 0] = 1
+    return weights
+
+
+def _weighted_mean(distances: np.ndarray, neighbors_values: np.ndarray, power: float):
+    weights = _weights(distances, power)
+    weighted_sum = np.einsum("ij,ij->i", weights, neighbors_values)
+    weighted_sum /= weights.sum(axis=1)
+    return weighted_sum
+
+
+def _build_interpolator(
+    backend: Backend,
+    coordinates: np.ndarray,
+    values: np.ndarray,
+    tile_size: int = _TILE_SIZE,
+):
+    with instrumentation.span("idw.build_index", values.size, backend=backend.value):
+        return _build_index(backend, coordinates, values, tile_size)
+
+
+def _build_index(
+    backend: Backend,
+    coordinates: np.ndarray,
+    values: np.ndarray,
+    tile_size: int,
+):
+    if backend == Backend.GRID:
+        interpolator = GridIDWInterpolator(coordinates, values)
+        if interpolator.suitable:
+            return interpolator
+        # Known points are too clustered for the grid index, tree adapts to them better
+        backend = Backend.KDTREE
+    if backend == Backend.KDTREE:
+        return KDTreeIDWInterpolator(coordinates, values, tile_size)
+    return ShepardIDWInterpolator(coordinates, values)
+
+
+def _parse_args(argv: list[str] = None):
     parser = ArgumentParser(
         description="""Use Inverse Distance Weighting algorithm to predict values"""
     )
@@ -24,55 +202,320 @@ def _parse_args():
     parser.add_argument(
         "-p",
         "--power",
+        nargs="+",
         type=limited_float(0.0),
-        default=2.0,
-        help="""Real positive number. Weights of neighbors of predicted point will be raised to the
-        power it specifies.""",
+        default=[2.0],
+        help="""Real positive numbers. Weights of neighbors of predicted point will be raised to
+        the power it specifies. If several powers or numbers of neighbors are given, predictions
+        are made for all their combinations, with neighbors of every point queried only once""",
     )
     parser.add_argument(
         "-n",
         "--neighbors",
+        nargs="+",
         type=limited_float(1.0, low_inclusive=True),
-        default=5.0,
-        help="Positive inteder. Number of closest neighbors used to predict value of a point.",
+        default=[5.0],
+        help="Positive integers. Number of closest neighbors used to predict value of a point.",
     )
     parser.add_argument(
         "-t",
         "--target",
         type=Path,
         default=None,
-        help=f"""File to save data with missing values filled in using predictions. If omitted,
-        results will be saved in the same directory as 'data' under name
+        help=f"""File to save data with missing values filled in using predictions, or directory
+        to save predictions for every combination of parameters in, if there are several. If
+        omitted, results will be saved in the same directory as 'data' under name
         '<data>_<power>_<neighbors>{_PREDICTED_SUFFIX}'""",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "-b",
+        "--band-rows",
+        type=limited_int(1),
+        default=None,
+        help="""Positive integer. If specified, data will be read, predicted and saved in bands of
+        that many rows instead of being loaded into memory at once. Known values are still
+        gathered from the whole file before predictions are made""",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=[backend.value for backend in Backend],
+        type=str,
+        default=Backend.KDTREE.value,
+        help=f"""Implementation of IDW used to make predictions. '{Backend.KDTREE.value}' queries
+        neighbors in parallel, in tiles of bounded size. '{Backend.GRID.value}' finds neighbors
+        using regularity of the grid, falling back to '{Backend.KDTREE.value}' when known values
+        are too clustered""",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=limited_int(1),
+        default=_TILE_SIZE,
+        help=f"""Positive integer. Number of missing values predicted at once by
+        '{Backend.KDTREE.value}' backend. Memory used for neighbors' distances and indices is
+        proportional to it""",
+    )
+    tiling.add_arguments(parser)
+    precision.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
 
 
-def predict(incomplete_data: np.ndarray, n_neighbors: int, power: float):
-    is_missing = np.isnan(incomplete_data)
-    data_points_indices = np.asarray(np.logical_not(is_missing)).nonzero()
-    values = incomplete_data[data_points_indices]
-    model = ShepardIDWInterpolator(np.array(data_points_indices).T, values)
-    missing_values_indices = np.asarray(is_missing).nonzero()
-    predictions = model(
-        np.array(missing_values_indices).T, n_neighbors=n_neighbors, power=power
-    )
-    filled_data = incomplete_data.copy()
+def predict(
+    incomplete_data: np.ndarray,
+    n_neighbors: int,
+    power: float,
+    backend: Backend = Backend.KDTREE,
+    tile_size: int = _TILE_SIZE,
+    offset: tuple[int, int] = (0, 0),
+):
+    with instrumentation.span("idw.find_known"):
+        coordinates, values = known_points(incomplete_data, offset)
+    model = _build_interpolator(backend, coordinates, values, tile_size)
+    return _fill(model, incomplete_data, n_neighbors, power, offset)
+
+
+def _fill(
+    model: ShepardIDWInterpolator | KDTreeIDWInterpolator,
+    incomplete_data: np.ndarray,
+    n_neighbors: int,
+    power: float,
+    offset: tuple[int, int] = (0, 0),
+):
+    with instrumentation.span("idw.find_missing"):
+        missing_values_indices = np.asarray(np.isnan(incomplete_data)).nonzero()
+    filled_data = np.array(incomplete_data, dtype=precision.float_dtype())
+    queries_count = missing_values_indices[0].size
+    if queries_count == 0:
+        return filled_data
+    with instrumentation.span("idw.interpolate", queries_count):
+        predictions = model(
+            indices_to_coordinates(missing_values_indices, offset),
+            n_neighbors=n_neighbors,
+            power=power,
+        )
     filled_data[missing_values_indices] = predictions
     return filled_data
 
 
-if __name__ == "__main__":
-    args = _parse_args()
-    args.neighbors = int(args.neighbors)
-    if args.target is None:
-        integer, fraction = str(args.power).split(".")
-        last_nonzero = max([fraction.rfind(digit) for digit in "123456789"])
-        power_str = integer + fraction[: last_nonzero + 1]
-        args.target = args.query.with_stem(
-            f"{args.query.stem}_{power_str}_{args.neighbors}{_PREDICTED_SUFFIX}"
+def sweep(
+    incomplete_data: np.ndarray,
+    neighbors: list[int],
+    powers: list[float],
+    backend: Backend = Backend.KDTREE,
+    tile_size: int = _TILE_SIZE,
+    offset: tuple[int, int] = (0, 0),
+):
+    """
+    Fill missing values with predictions for every combination of number of neighbors and power.
+    For backend KDTREE they may differ from separate runs where neighbors are tied on distance,
+    see `KDTreeIDWInterpolator.sweep`
+
+    Returns:
+        dict[tuple[int, float], np.ndarray]: Filled data by number of neighbors and power
+    """
+    with instrumentation.span("idw.find_known"):
+        coordinates, values = known_points(incomplete_data, offset)
+    model = _build_interpolator(backend, coordinates, values, tile_size)
+    return _sweep_fill(model, incomplete_data, neighbors, powers, offset)
+
+
+def _sweep_fill(
+    model: ShepardIDWInterpolator | KDTreeIDWInterpolator,
+    incomplete_data: np.ndarray,
+    neighbors: list[int],
+    powers: list[float],
+    offset: tuple[int, int] = (0, 0),
+):
+    with instrumentation.span("idw.find_missing"):
+        missing_values_indices = np.asarray(np.isnan(incomplete_data)).nonzero()
+    combinations = list(product(neighbors, powers))
+    queries_count = missing_values_indices[0].size
+    predictions = {}
+    if queries_count > 0:
+        positions = indices_to_coordinates(missing_values_indices, offset)
+        with instrumentation.span(
+            "idw.sweep", queries_count, combinations=len(combinations)
+        ):
+            if isinstance(model, KDTreeIDWInterpolator):
+                predictions = model.sweep(positions, neighbors, powers)
+            else:
+                # Other backends do not expose neighbors, only the index is shared
+                predictions = {
+                    (n_neighbors, power): model(positions, n_neighbors=n_neighbors, power=power)
+                    for n_neighbors, power in combinations
+                }
+    filled = {}
+    for combination in combinations:
+        filled_data = np.array(incomplete_data, dtype=precision.float_dtype())
+        if queries_count > 0:
+            filled_data[missing_values_indices] = predictions[combination]
+        filled[combination] = filled_data
+    return filled
+
+
+class IDWPredictor(Predictor):
+    """
+    Inverse Distance Weighting with spatial index of known values built once, when it is fitted,
+    and saved with it, so that repeated predictions do not rebuild it
+    """
+
+    name = "idw"
+    predicted_suffix = _PREDICTED_SUFFIX
+
+    def __init__(
+        self,
+        n_neighbors: int = 5,
+        power: float = 2.0,
+        backend: Backend = Backend.KDTREE,
+        tile_size: int = _TILE_SIZE,
+    ):
+        self.n_neighbors = n_neighbors
+        self.power = power
+        self.backend = backend
+        self.tile_size = tile_size
+        self.interpolator = None
+
+    @classmethod
+    def add_arguments(cls, parser: ArgumentParser):
+        parser.add_argument(
+            "-p",
+            "--power",
+            type=limited_float(0.0),
+            default=2.0,
+            help="""Real positive number. Weights of neighbors of predicted point will be raised
+            to the power it specifies""",
+        )
+        parser.add_argument(
+            "-n",
+            "--neighbors",
+            type=limited_int(1),
+            default=5,
+            help="Positive integer. Number of closest neighbors used to predict value of a point",
+        )
+        parser.add_argument(
+            "--backend",
+            choices=[backend.value for backend in Backend],
+            type=str,
+            default=Backend.KDTREE.value,
+            help="Implementation of IDW used to make predictions",
+        )
+        parser.add_argument(
+            "--tile-size",
+            type=limited_int(1),
+            default=_TILE_SIZE,
+            help=f"""Positive integer. Number of missing values predicted at once by
+            '{Backend.KDTREE.value}' backend""",
         )
 
-    data = read_data(args.query)
-    data = predict(data, args.neighbors, args.power)
-    write_data(args.target, data)
+    @classmethod
+    def from_args(cls, args: Namespace):
+        return cls(args.neighbors, args.power, Backend(args.backend), args.tile_size)
+
+    def fit(self, coordinates: np.ndarray, values: np.ndarray):
+        self.interpolator = _build_interpolator(self.backend, coordinates, values, self.tile_size)
+        return self
+
+    def predict(self, coordinates: np.ndarray):
+        return self.interpolator(coordinates, n_neighbors=self.n_neighbors, power=self.power)
+
+
+def _default_target(query: Path, power: float, n_neighbors: int):
+    integer, fraction = str(float(power)).split(".")
+    last_nonzero = max([fraction.rfind(digit) for digit in "123456789"])
+    power_str = integer + fraction[: last_nonzero + 1]
+    return query.with_stem(f"{query.stem}_{power_str}_{n_neighbors}{_PREDICTED_SUFFIX}")
+
+
+def _sweep_files(args: Namespace):
+    """
+    Save predictions for every combination of number of neighbors and power in separate files
+    """
+    if args.tile_shape is not None:
+        raise ValueError("Predictions for several combinations of parameters can not be tiled")
+    directory = args.query.parent if args.target is None else args.target
+    directory.mkdir(parents=True, exist_ok=True)
+    targets = {
+        (n_neighbors, power): directory / _default_target(args.query, power, n_neighbors).name
+        for n_neighbors, power in product(args.neighbors, args.power)
+    }
+    if args.band_rows is None:
+        filled = sweep(
+            read_data(args.query), args.neighbors, args.power, args.backend, args.tile_size
+        )
+        for combination, target in targets.items():
+            write_data(target, filled[combination])
+        return
+
+    with instrumentation.span("idw.find_known"):
+        coordinates, values = read_known_points(args.query, args.band_rows)
+    interpolator = _build_interpolator(args.backend, coordinates, values, args.tile_size)
+    shape = read_shape(args.query)
+    georeference = read_georeference(args.query)
+    with ExitStack() as stack:
+        writers = {
+            combination: stack.enter_context(
+                RowBandWriter(target, shape, georeference=georeference)
+            )
+            for combination, target in targets.items()
+        }
+        for first_row, band in iter_row_bands(args.query, args.band_rows):
+            filled = _sweep_fill(
+                interpolator, band, args.neighbors, args.power, (first_row, 0)
+            )
+            for combination, writer in writers.items():
+                writer.write(filled[combination])
+
+
+def main(argv: list[str] = None):
+    args = _parse_args(argv)
+    args.neighbors = list(dict.fromkeys(int(neighbors) for neighbors in args.neighbors))
+    args.power = list(dict.fromkeys(args.power))
+    args.backend = Backend(args.backend)
+    precision.set_precision(precision.Precision(args.precision))
+    if len(args.neighbors) * len(args.power) > 1:
+        with instrumentation.session(args.trace, args.profile):
+            _sweep_files(args)
+        return
+
+    (args.neighbors,), (args.power,) = args.neighbors, args.power
+    if args.target is None:
+        args.target = _default_target(args.query, args.power, args.neighbors)
+    with instrumentation.session(args.trace, args.profile):
+        if args.tile_shape is not None:
+            # Interpolator is fitted to all known values, not only to those in a tile and its
+            # halo, so that cells close to edges of tiles have the same neighbors as in the
+            # whole grid
+            with instrumentation.span("idw.find_known"):
+                coordinates, values = read_known_points(args.query, args.tile_shape[0])
+            predictor = IDWPredictor(args.neighbors, args.power, args.backend, args.tile_size)
+            predictor.fit(coordinates, values)
+            tiling.predict_tiled(
+                args.query,
+                args.target,
+                predictor.predict_grid,
+                args.tile_shape,
+                args.halo,
+                args.tile_workers,
+            )
+        elif args.band_rows is None:
+            data = read_data(args.query)
+            data = predict(data, args.neighbors, args.power, args.backend, args.tile_size)
+            write_data(args.target, data)
+        else:
+            with instrumentation.span("idw.find_known"):
+                coordinates, values = read_known_points(args.query, args.band_rows)
+            interpolator = _build_interpolator(
+                args.backend, coordinates, values, args.tile_size
+            )
+            transform_row_bands(
+                args.query,
+                args.target,
+                args.band_rows,
+                lambda band, first_row: _fill(
+                    interpolator, band, args.neighbors, args.power, (first_row, 0)
+                ),
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Inverse Distance Weighting specialised for data placed on a regular grid
+"""
+import math
+
+import numpy as np
+from numba import njit, prange
+
+# Average number of known points in a bucket of the index
+_POINTS_PER_BUCKET = 4.0
+# Part of buckets that need to contain any known points for the index to be worth using
+_MIN_OCCUPANCY = 0.05
+
+
+class GridIDWInterpolator:
+    """
+    Inverse Distance Weighting interpolator with the same calling convention as
+    `photutils.utils.ShepardIDWInterpolator`.
+
+    Known points are bucketed into square cells of a coarse grid and nearest neighbors of a
+    query are found by visiting rings of buckets around the one containing it, until no
+    unvisited bucket can contain a point closer than the furthest of found neighbors. For
+    evenly spread points it takes constant time per query and no tree needs to be built.
+
+    Of neighbors tied on distance with the furthest one, those found first, in order in which
+    buckets are visited, are kept. KD-tree breaks such ties differently, so predictions may
+    differ from the KD-tree backend in cells where they occur.
+    """
+
+    def __init__(
+        self, coordinates: np.ndarray, values: np.ndarray, bucket_size: float = None
+    ):
+        coordinates = np.asarray(coordinates, dtype=np.float64)
+        self.values = np.asarray(values)
+        if not np.issubdtype(self.values.dtype, np.floating):
+            self.values = self.values.astype(np.float64)
+        self.origin = coordinates.min(axis=0)
+        extent = coordinates.max(axis=0) - self.origin + 1
+        if bucket_size is None:
+            bucket_size = math.sqrt(
+                extent[0] * extent[1] * _POINTS_PER_BUCKET / coordinates.shape[0]
+            )
+        self.bucket_size = max(float(bucket_size), 1.0)
+        self.buckets_shape = np.ceil(extent / self.bucket_size).astype(np.int64)
+
+        bucket_ids = self._bucket_ids(coordinates)
+        order = np.argsort(bucket_ids, kind="stable")
+        self.coordinates = coordinates[order]
+        self.values = self.values[order]
+        counts = np.bincount(bucket_ids, minlength=np.prod(self.buckets_shape))
+        self.bucket_starts = np.zeros(counts.size + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.bucket_starts[1:])
+        self.occupancy = np.count_nonzero(counts) / counts.size
+
+    @property
+    def suitable(self):
+        """
+        Whether known points are spread evenly enough for the index to be faster than a tree
+        """
+        return self.occupancy >= _MIN_OCCUPANCY
+
+    def _bucket_ids(self, coordinates: np.ndarray):
+        buckets = np.floor((coordinates - self.origin) / self.bucket_size).astype(np.int64)
+        np.clip(buckets, 0, self.buckets_shape - 1, out=buckets)
+        return buckets[:, 0] * self.buckets_shape[1] + buckets[:, 1]
+
+    def __call__(self, positions: np.ndarray, n_neighbors: int = 8, power: float = 1.0):
+        positions = np.reshape(np.asarray(positions, dtype=np.float64), (-1, 2))
+        predictions = np.empty(positions.shape[0], dtype=self.values.dtype)
+        _predict(
+            positions,
+            self.coordinates,
+            self.values,
+            self.bucket_starts,
+            self.origin,
+            self.bucket_size,
+            self.buckets_shape[0],
+            self.buckets_shape[1],
+            min(int(n_neighbors), self.coordinates.shape[0]),
+            float(power),
+            predictions,
+        )
+        return predictions
+
+
+@njit(cache=True)
+def _visit_bucket(
+    bucket, query, coordinates, bucket_starts, best_distances, best_indices, found
+):
+    for point in range(bucket_starts[bucket], bucket_starts[bucket + 1]):
+        row_difference = coordinates[point, 0] - query[0]
+        column_difference = coordinates[point, 1] - query[1]
+        distance = row_difference * row_difference + column_difference * column_difference
+        k = best_distances.size
+        if found == k and distance >= best_distances[k - 1]:
+            continue
+        # Insertion into neighbors sorted by distance
+        position = found if found < k else k - 1
+        while position > 0 and best_distances[position - 1] > distance:
+            best_distances[position] = best_distances[position - 1]
+            best_indices[position] = best_indices[position - 1]
+            position -= 1
+        best_distances[position] = distance
+        best_indices[position] = point
+        if found < k:
+            found += 1
+    return found
+
+
+@njit(parallel=True, cache=True)
+def _predict(
+    positions,
+    coordinates,
+    values,
+    bucket_starts,
+    origin,
+    bucket_size,
+    bucket_rows,
+    bucket_columns,
+    n_neighbors,
+    power,
+    predictions,
+):
+    for query_index in prange(positions.shape[0]):
+        query = positions[query_index]
+        best_distances = np.empty(n_neighbors)
+        best_indices = np.empty(n_neighbors, dtype=np.int64)
+        found = 0
+        center_row = min(
+            max(int(math.floor((query[0] - origin[0]) / bucket_size)), 0), bucket_rows - 1
+        )
+        center_column = min(
+            max(int(math.floor((query[1] - origin[1]) / bucket_size)), 0),
+            bucket_columns - 1,
+        )
+        ring = 0
+        while True:
+            for row in range(center_row - ring, center_row + ring + 1):
+                if row < 0 or row >= bucket_rows:
+                    continue
+                step = 1 if abs(row - center_row) == ring else max(2 * ring, 1)
+                for column in range(center_column - ring, center_column + ring + 1, step):
+                    if 0 <= column < bucket_columns:
+                        found = _visit_bucket(
+                            row * bucket_columns + column,
+                            query,
+                            coordinates,
+                            bucket_starts,
+                            best_distances,
+                            best_indices,
+                            found,
+                        )
+            # Lower bound of distance between query and points in buckets not visited yet
+            bound = np.inf
+            if center_row - ring > 0:
+                bound = min(
+                    bound,
+                    max(query[0] - origin[0] - (center_row - ring) * bucket_size, 0.0),
+                )
+            if center_row + ring < bucket_rows - 1:
+                bound = min(
+                    bound,
+                    max(origin[0] + (center_row + ring + 1) * bucket_size - query[0], 0.0),
+                )
+            if center_column - ring > 0:
+                bound = min(
+                    bound,
+                    max(query[1] - origin[1] - (center_column - ring) * bucket_size, 0.0),
+                )
+            if center_column + ring < bucket_columns - 1:
+                bound = min(
+                    bound,
+                    max(origin[1] + (center_column + ring + 1) * bucket_size - query[1], 0.0),
+                )
+            if bound == np.inf or (
+                found == n_neighbors and best_distances[n_neighbors - 1] <= bound * bound
+            ):
+                break
+            ring += 1
+
+        if best_distances[0] == 0.0:
+            predictions[query_index] = values[best_indices[0]]
+            continue
+        weighted_sum = 0.0
+        weights_sum = 0.0
+        for neighbor in range(found):
+            weight = best_distances[neighbor] ** (-power / 2.0)
+            weighted_sum += weight * values[best_indices[neighbor]]
+            weights_sum += weight
+        predictions[query_index] = weighted_sum / weights_sum
@@ -1,15 +1,26 @@
+import hashlib
 import sys
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from functools import partial
 from pathlib import Path
 
 import matplotlib.pyplot as plt
 import numpy as np
 import skgstat as skg
-from joblib import dump, load
+from joblib import dump
+from scipy.linalg import lu_factor, lu_solve
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
 
-from src.models.config import MODEL_DIRECTORY
-from src.util.data_io import read_data, write_data
+from src.models.config import MODEL_DIRECTORY, load_model
+from src.models.predictor import Predictor
+from src.models.variogram import MODELS, BinnedVariogram, VariogramModel
+from src.util import instrumentation, precision, tiling
+from src.util.cli import limited_int
+from src.util.data import known_points
+from src.util.data_io import read_data, read_known_points, transform_row_bands, write_data
 
 
 class _Commands(Enum):
@@ -17,7 +28,13 @@ class _Commands(Enum):
     PREDICT = "predict"
 
 
-def _parse_command():
+class Solver(Enum):
+    SKGSTAT = "skgstat"
+    LOCAL = "local"
+    GLOBAL = "global"
+
+
+def _parse_command(argv: list[str]):
     parser = ArgumentParser(
         description="""Train models implementing ordinary kriging algorithm and use them to
         predict values"""
@@ -28,13 +45,14 @@ def _parse_command():
         type=str,
         help="Command to execute",
     )
-    return parser.parse_args(sys.argv[1:2])
+    return parser.parse_args(argv[:1])
 
 
 _TRAINED_PREFIX = "kriging_"
+_FACTORIZATION_SUFFIX = ".factorization.npz"
 
 
-def _parse_train_params():
+def _parse_train_params(argv: list[str]):
     parser = ArgumentParser()
     parser.prog += " " + _Commands.TRAIN.value
     parser.add_argument(
@@ -59,13 +77,47 @@ def _parse_train_params():
         default=False,
         help="Display variogram characterizing model",
     )
-    return parser.parse_args(sys.argv[2:])
+    parser.add_argument(
+        "-f",
+        "--factorize",
+        action="store_true",
+        default=False,
+        help=f"""Factorize kriging system of all samples and save it at
+        '<target>{_FACTORIZATION_SUFFIX}', so that predictions with '{Solver.GLOBAL.value}' solver
+        do not need to build it again""",
+    )
+    parser.add_argument(
+        "-p",
+        "--max-pairs",
+        type=limited_int(1),
+        default=None,
+        help="""Positive integer. If specified, experimental variogram is estimated from binned
+        statistics of pairs of samples computed in chunks. If samples form more pairs than
+        specified, that many random pairs are used instead of all of them""",
+    )
+    parser.add_argument(
+        "--variogram-model",
+        choices=MODELS,
+        default=MODELS[0],
+        help="Theoretical model fitted to variogram estimated with '--max-pairs'",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed to use for RNG used in sampling pairs of samples",
+    )
+    precision.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
 
 
 _PREDICTED_SUFFIX = "_predicted_kriging"
+_BATCH_SIZE = 2**10 * 4
+_LOCAL_NEIGHBORS = 16
 
 
-def _parse_predict_params():
+def _parse_predict_params(argv: list[str]):
     parser = ArgumentParser()
     parser.prog += " " + _Commands.TRAIN.value
     parser.add_argument(
@@ -91,66 +143,663 @@ def _parse_predict_params():
         results will be saved in the same directory as 'data' under name
         '<data>{_PREDICTED_SUFFIX}'""",
     )
-    return parser.parse_args(sys.argv[2:])
+    parser.add_argument(
+        "-b",
+        "--band-rows",
+        type=limited_int(1),
+        default=None,
+        help="""Positive integer. If specified, data will be read, predicted and saved in bands of
+        that many rows instead of being loaded into memory at once""",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=limited_int(1),
+        default=1,
+        help="""Positive integer. Number of processes making predictions. If greater than 1,
+        batches of missing values are distributed between processes in a pool""",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=limited_int(1),
+        default=_BATCH_SIZE,
+        help="Positive integer. Number of missing values predicted in a single batch",
+    )
+    parser.add_argument(
+        "-s",
+        "--solver",
+        choices=[solver.value for solver in Solver],
+        type=str,
+        default=Solver.SKGSTAT.value,
+        help=f"""Implementation of kriging used to make predictions. '{Solver.LOCAL.value}'
+        solves small systems built from nearest samples of every missing value.
+        '{Solver.GLOBAL.value}' uses all samples, with the kriging system factorized once or
+        loaded from '<model>{_FACTORIZATION_SUFFIX}' saved during training""",
+    )
+    parser.add_argument(
+        "-n",
+        "--neighbors",
+        type=limited_int(1),
+        default=_LOCAL_NEIGHBORS,
+        help=f"""Positive integer. Number of nearest samples used by '{Solver.LOCAL.value}'
+        solver to predict a value""",
+    )
+    tiling.add_arguments(parser)
+    precision.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
 
 
-def _train_subroutine():
-    t_args = _parse_train_params()
+def _train_subroutine(argv: list[str]):
+    t_args = _parse_train_params(argv)
     if t_args.target is None:
         t_args.target = MODEL_DIRECTORY / Path(f"{_TRAINED_PREFIX}{t_args.data.stem}")
-    data = read_data(t_args.data)
-    model = train(data)
-    if t_args.show:
-        model.plot(show=False)
-        plt.show()
-    dump(model, t_args.target)
+    precision.set_precision(precision.Precision(t_args.precision))
+    with instrumentation.session(t_args.trace, t_args.profile):
+        with instrumentation.span("kriging.find_known"):
+            coordinates, values = read_known_points(t_args.data)
+        model = fit_variogram(
+            coordinates, values, t_args.max_pairs, t_args.variogram_model, t_args.seed
+        )
+        if t_args.show:
+            model.plot(show=False)
+            plt.show()
+        dump(model, t_args.target)
+        if t_args.factorize:
+            save_factorization(t_args.target, factorize(model))
 
 
-def train(data: np.ndarray):
-    data_points_indices = np.asarray(np.logical_not(np.isnan(data))).nonzero()
-    values = data[data_points_indices]
-    data_points_indices = np.transpose(data_points_indices)
-    model = skg.Variogram(data_points_indices, values)
-    return model
+def train(
+    data: np.ndarray,
+    max_pairs: int = None,
+    variogram_model: str = MODELS[0],
+    seed: int = None,
+):
+    with instrumentation.span("kriging.find_known"):
+        data_points_indices, values = known_points(data)
+    return fit_variogram(data_points_indices, values, max_pairs, variogram_model, seed)
 
 
-def _predict_subroutine():
-    p_args = _parse_predict_params()
+def fit_variogram(
+    coordinates: np.ndarray,
+    values: np.ndarray,
+    max_pairs: int = None,
+    variogram_model: str = MODELS[0],
+    seed: int = None,
+):
+    with instrumentation.span("kriging.fit_variogram", values.size, binned=max_pairs is not None):
+        if max_pairs is None:
+            return skg.Variogram(coordinates, values)
+        return BinnedVariogram(
+            coordinates, values, variogram_model, max_pairs=max_pairs, seed=seed
+        )
+
+
+def _predict_subroutine(argv: list[str]):
+    p_args = _parse_predict_params(argv)
     if p_args.target is None:
         p_args.target = p_args.query.with_stem(p_args.query.stem + _PREDICTED_SUFFIX)
-    incomplete_data = read_data(p_args.query)
-    model: skg.Variogram = load(p_args.model)
-    filled_data = predict(model, incomplete_data)
-    write_data(p_args.target, filled_data)
+    precision.set_precision(precision.Precision(p_args.precision))
+    with instrumentation.session(p_args.trace, p_args.profile):
+        _predict_files(p_args)
+
+
+def _predict_files(p_args):
+    if p_args.tile_shape is not None and p_args.tile_workers > 1 and p_args.workers > 1:
+        raise ValueError("Tiles can be predicted in parallel only by a single pool of processes")
+    model: VariogramModel = load_model(p_args.model)
+    solver = Solver(p_args.solver)
+    factorization = None
+    if solver == Solver.GLOBAL:
+        factorization = load_factorization(p_args.model)
+        if factorization is None:
+            factorization = factorize(model)
+    if p_args.workers == 1:
+        pool = None
+        kriging = build_kriging(model, solver, p_args.neighbors, factorization)
+    else:
+        pool = create_pool(
+            model, p_args.workers, solver, p_args.neighbors, factorization
+        )
+        kriging = None
+    try:
+        if p_args.tile_shape is not None:
+            tiling.predict_tiled(
+                p_args.query,
+                p_args.target,
+                partial(
+                    predict, model, kriging=kriging, batch_size=p_args.batch_size, pool=pool
+                ),
+                p_args.tile_shape,
+                p_args.halo,
+                p_args.tile_workers,
+            )
+            return
+        if p_args.band_rows is not None:
+            transform_row_bands(
+                p_args.query,
+                p_args.target,
+                p_args.band_rows,
+                lambda band, first_row: predict(
+                    model, band, (first_row, 0), kriging, p_args.batch_size, pool
+                ),
+            )
+            return
+        incomplete_data = read_data(p_args.query)
+        filled_data = predict(
+            model, incomplete_data, kriging=kriging, batch_size=p_args.batch_size, pool=pool
+        )
+        write_data(p_args.target, filled_data)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def _spherical(h: np.ndarray, r: float, c0: float, b: float):
+    ratio = h / r
+    return np.where(h <= r, b + c0 * (1.5 * ratio - 0.5 * ratio**3), b + c0)
+
+
+def _exponential(h: np.ndarray, r: float, c0: float, b: float):
+    return b + c0 * (1.0 - np.exp(-h / (r / 3.0)))
+
+
+def _gaussian(h: np.ndarray, r: float, c0: float, b: float):
+    return b + c0 * (1.0 - np.exp(-(h**2) / (r / 2.0) ** 2))
+
+
+def _cubic(h: np.ndarray, r: float, c0: float, b: float):
+    ratio = h / r
+    polynomial = 7 * ratio**2 - 35 / 4 * ratio**3 + 7 / 2 * ratio**5 - 3 / 4 * ratio**7
+    return np.where(h < r, b + c0 * polynomial, b + c0)
+
+
+# The same formulas as models of skgstat, which are evaluated value by value, applied to whole
+# arrays at once
+_VECTORIZED_MODELS = {
+    "spherical": _spherical,
+    "exponential": _exponential,
+    "gaussian": _gaussian,
+    "cubic": _cubic,
+}
+
+
+def _semivariance_function(model: VariogramModel):
+    description = model.describe()
+    vectorized = _VECTORIZED_MODELS.get(description["model"])
+    if vectorized is not None:
+        return partial(
+            vectorized,
+            r=description["effective_range"],
+            c0=description["sill"],
+            b=description["nugget"],
+        )
+    if description["model"] == "harmonize":
+        description["model"] = model._build_harmonized_model()
+    return skg.Variogram.fitted_model_function(**description)
+
+
+# Largest squared distance for which semivariances are tabulated
+_MAX_TABULATED_SQUARED_DISTANCE = 2**20
+
+
+class _Semivariance:
+    """
+    Semivariance model evaluated for whole arrays of squared distances.
+
+    Models of skgstat are evaluated value by value, which is slow for big arrays, so models
+    described only by effective range, sill and nugget are evaluated with numpy instead. Squared
+    distances between cells of a grid are integers, so semivariances of them are tabulated and
+    looked up, and other distances are deduplicated before evaluation.
+    """
+
+    def __init__(self, model: VariogramModel, dtype: np.dtype = np.float64):
+        self.function = _semivariance_function(model)
+        self.dtype = np.dtype(dtype)
+        self._table = np.empty(0, dtype=self.dtype)
+
+    def __call__(self, squared_distances: np.ndarray):
+        largest = squared_distances.max(initial=0)
+        if largest < _MAX_TABULATED_SQUARED_DISTANCE and np.array_equal(
+            squared_distances, np.floor(squared_distances)
+        ):
+            if largest >= self._table.size:
+                # Table grows to the next power of two, only semivariances of new squared
+                # distances are evaluated
+                size = 1 << int(largest).bit_length()
+                added = self.function(np.sqrt(np.arange(self._table.size, size)))
+                self._table = np.concatenate((self._table, added.astype(self.dtype)))
+            return self._table[squared_distances.astype(np.intp)]
+        unique_distances, inverse = np.unique(squared_distances, return_inverse=True)
+        semivariances = self.function(np.sqrt(unique_distances)).astype(self.dtype)
+        return semivariances[inverse].reshape(squared_distances.shape)
+
+
+def _squared_distances(queries: np.ndarray, coordinates: np.ndarray):
+    """
+    Squared distances between all queries and coordinates computed in floating point type of
+    queries, unlike `cdist`, which always uses float64
+    """
+    differences = queries[:, 0, np.newaxis] - coordinates[:, 0]
+    squared_distances = np.square(differences, out=differences)
+    differences = queries[:, 1, np.newaxis] - coordinates[:, 1]
+    squared_distances += np.square(differences, out=differences)
+    return squared_distances
+
+
+class LocalKriging:
+    """
+    Ordinary kriging with the same calling convention as `skg.OrdinaryKriging.transform`, that
+    predicts every value using only its nearest samples, found with a spatial index.
 
+    Queries sharing the same neighborhood share the kriging system. It is inverted once, and
+    combined with samples' values, so that prediction for every query reduces to a dot product
+    with its vector of semivariances.
 
-def predict(model: skg.Variogram, incomplete_data: np.ndarray):
-    y, x = np.asarray(np.isnan(incomplete_data)).nonzero()
-    kriging = skg.OrdinaryKriging(model)
-    filled_data = incomplete_data.copy()
+    Kriging systems are always inverted in float64, arrays of size proportional to number of
+    queries use floating point type of precision current when it is created.
+    """
+
+    def __init__(
+        self,
+        model: VariogramModel,
+        n_neighbors: int = _LOCAL_NEIGHBORS,
+        kdtree: cKDTree = None,
+    ):
+        self.dtype = precision.float_dtype()
+        self.semivariance = _Semivariance(model)
+        self.query_semivariance = _Semivariance(model, self.dtype)
+        self.coordinates = np.asarray(model.coordinates, dtype=np.float64)
+        self.values = np.asarray(model.values, dtype=np.float64)
+        # Index of the same samples can be shared with other models, e.g. in cross-validation
+        self.kdtree = cKDTree(self.coordinates) if kdtree is None else kdtree
+        self.n_neighbors = min(n_neighbors, self.kdtree.n)
+
+    def transform(self, *x: np.ndarray):
+        queries = np.column_stack(x).astype(self.dtype)
+        _, neighbors = self.kdtree.query(queries, k=self.n_neighbors, workers=-1)
+        return self.predict_from_neighbors(
+            queries, np.reshape(neighbors, (queries.shape[0], self.n_neighbors))
+        )
+
+    def predict_from_neighbors(self, queries: np.ndarray, neighbors: np.ndarray):
+        """
+        Predict values at queries from indices of their `n_neighbors` nearest samples, already
+        queried
+        """
+        queries = np.asarray(queries, dtype=self.dtype)
+        neighborhoods, inverse = np.unique(
+            np.sort(neighbors, axis=1), axis=0, return_inverse=True
+        )
+        inverse = inverse.reshape(-1)
+        instrumentation.record("kriging.local.neighborhoods", neighborhoods.shape[0])
+
+        # Kriging system of every distinct neighborhood
+        neighborhoods_coordinates = self.coordinates[neighborhoods]
+        differences = (
+            neighborhoods_coordinates[:, :, np.newaxis]
+            - neighborhoods_coordinates[:, np.newaxis]
+        )
+        k = self.n_neighbors
+        systems = np.ones((neighborhoods.shape[0], k + 1, k + 1))
+        systems[:, :k, :k] = self.semivariance(np.square(differences).sum(axis=-1))
+        systems[:, range(k + 1), range(k + 1)] = 0
+        try:
+            inverted = np.linalg.inv(systems)
+        except np.linalg.LinAlgError:
+            inverted = np.linalg.pinv(systems)
+        # Prediction is values^T * weights = values^T * (A^-1 * b)[:k] = (values^T * A^-1[:k]) * b
+        values_by_inverted = np.einsum(
+            "nk,nkj->nj", self.values[neighborhoods], inverted[:, :k, :]
+        ).astype(self.dtype, copy=False)
+
+        semivariances = np.ones((queries.shape[0], k + 1), dtype=self.dtype)
+        neighborhoods_coordinates = neighborhoods_coordinates.astype(self.dtype, copy=False)
+        semivariances[:, :k] = self.query_semivariance(
+            np.square(neighborhoods_coordinates[inverse] - queries[:, np.newaxis]).sum(
+                axis=-1
+            )
+        )
+        return np.einsum("qj,qj->q", values_by_inverted[inverse], semivariances)
+
+
+def factorize(model: VariogramModel):
+    """
+    Compute LU factorization of ordinary kriging system built from all samples of the model
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Factorization in format of `scipy.linalg.lu_factor`
+    """
+    coordinates = np.asarray(model.coordinates, dtype=np.float64)
+    samples_count = coordinates.shape[0]
+    with instrumentation.span("kriging.factorize", samples_count):
+        system = np.ones((samples_count + 1, samples_count + 1))
+        system[:samples_count, :samples_count] = _Semivariance(model)(
+            cdist(coordinates, coordinates, "sqeuclidean")
+        )
+        np.fill_diagonal(system, 0)
+        return lu_factor(system, overwrite_a=True)
+
+
+def _model_key(model_file: Path):
+    digest = hashlib.sha256()
+    with open(model_file, "rb") as reader:
+        while chunk := reader.read(2**20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _factorization_path(model_file: Path):
+    return Path(f"{model_file}{_FACTORIZATION_SUFFIX}")
+
+
+def save_factorization(model_file: Path, factorization: tuple[np.ndarray, np.ndarray]):
+    """
+    Save factorization of kriging system next to the file containing the model, with a key
+    identifying content of that file
+    """
+    lu, pivots = factorization
+    np.savez(
+        _factorization_path(model_file), lu=lu, pivots=pivots, key=_model_key(model_file)
+    )
+
+
+def load_factorization(model_file: Path):
+    """
+    Load factorization saved by `save_factorization`
+
+    Returns:
+        tuple[np.ndarray, np.ndarray] | None: Factorization or None if it was not saved or it was
+        saved for a different version of the model file
+    """
+    path = _factorization_path(model_file)
+    if not path.is_file():
+        return None
+    with np.load(path) as artefact:
+        if str(artefact["key"]) != _model_key(model_file):
+            print(
+                f"Warning: {path} was computed for another version of {model_file}, ignoring it",
+                file=sys.stderr,
+            )
+            return None
+        return artefact["lu"], artefact["pivots"]
+
+
+class GlobalKriging:
+    """
+    Ordinary kriging with the same calling convention as `skg.OrdinaryKriging.transform`, that
+    predicts every value using all samples.
+
+    Prediction is values^T * (A^-1 * b)[:n] = (A^-T * [values, 0])^T * b, so factorization of
+    kriging system A is used only once, to solve a single system, and prediction for every query
+    reduces to a dot product with its vector of semivariances b.
+
+    The system is always solved in float64, distances and semivariances of queries use floating
+    point type of precision current when it is created.
+    """
+
+    def __init__(
+        self,
+        model: VariogramModel,
+        factorization: tuple[np.ndarray, np.ndarray] = None,
+    ):
+        self.dtype = precision.float_dtype()
+        self.semivariance = _Semivariance(model, self.dtype)
+        self.coordinates = np.asarray(model.coordinates, dtype=self.dtype)
+        if factorization is None:
+            factorization = factorize(model)
+        self.weights = lu_solve(
+            factorization, np.append(np.asarray(model.values, dtype=np.float64), 0), trans=1
+        ).astype(self.dtype)
+
+    def transform(self, *x: np.ndarray):
+        queries = np.column_stack(x).astype(self.dtype)
+        if self.dtype == np.float64:
+            squared_distances = cdist(queries, self.coordinates, "sqeuclidean")
+        else:
+            squared_distances = _squared_distances(queries, self.coordinates)
+        semivariances = self.semivariance(squared_distances)
+        return semivariances @ self.weights[:-1] + self.weights[-1]
+
+
+def build_kriging(
+    model: VariogramModel,
+    solver: Solver = Solver.SKGSTAT,
+    n_neighbors: int = _LOCAL_NEIGHBORS,
+    factorization: tuple[np.ndarray, np.ndarray] = None,
+):
+    if solver == Solver.LOCAL:
+        return LocalKriging(model, n_neighbors)
+    if solver == Solver.GLOBAL:
+        return GlobalKriging(model, factorization)
+    if isinstance(model, skg.Variogram):
+        return skg.OrdinaryKriging(model)
+    return skg.OrdinaryKriging(
+        model.describe(), coordinates=model.coordinates, values=model.values
+    )
+
+
+_worker_kriging: skg.OrdinaryKriging | LocalKriging | GlobalKriging = None
+
+
+def _initialize_worker(
+    model: VariogramModel,
+    solver: Solver,
+    n_neighbors: int,
+    factorization: tuple[np.ndarray, np.ndarray],
+    worker_precision: precision.Precision,
+):
+    global _worker_kriging
+    precision.set_precision(worker_precision)
+    _worker_kriging = build_kriging(model, solver, n_neighbors, factorization)
+
+
+def _transform_batch(batch: tuple[np.ndarray, np.ndarray]):
+    return _worker_kriging.transform(*batch)
+
+
+def create_pool(
+    model: VariogramModel,
+    workers: int,
+    solver: Solver = Solver.SKGSTAT,
+    n_neighbors: int = _LOCAL_NEIGHBORS,
+    factorization: tuple[np.ndarray, np.ndarray] = None,
+):
+    """
+    Create pool of processes for `predict`. Model is sent to every process once, when it is
+    started, instead of with every batch of missing values
+
+    Args:
+        model (VariogramModel): Model that will be used for predictions
+        workers (int): Number of processes in the pool
+        solver (Solver, optional): Implementation of kriging used by processes. Defaults to
+        Solver.SKGSTAT.
+        n_neighbors (int, optional): Number of nearest samples used by Solver.LOCAL. Defaults to
+        16.
+        factorization (tuple[np.ndarray, np.ndarray], optional): Factorization used by
+        Solver.GLOBAL. If omitted every process computes it. Defaults to None.
+
+    Returns:
+        ProcessPoolExecutor: Pool that needs to be shut down by the caller
+    """
+    return ProcessPoolExecutor(
+        workers,
+        initializer=_initialize_worker,
+        initargs=(model, solver, n_neighbors, factorization, precision.get_precision()),
+    )
+
+
+def predict(
+    model: VariogramModel,
+    incomplete_data: np.ndarray,
+    offset: tuple[int, int] = (0, 0),
+    kriging: skg.OrdinaryKriging | LocalKriging | GlobalKriging = None,
+    batch_size: int = _BATCH_SIZE,
+    pool: ProcessPoolExecutor = None,
+):
+    """
+    Fill in missing values of data with kriging predictions, solved by `pool` if it is given, by
+    `kriging` otherwise, or by skgstat's solver built for `model` if neither is
+
+    Args:
+        model (skg.Variogram | BinnedVariogram): Variogram fitted by `train`, either exact or
+        binned
+    """
+    with instrumentation.span("kriging.find_missing"):
+        y, x = (
+            indices.astype(precision.index_dtype(), copy=False)
+            for indices in np.asarray(np.isnan(incomplete_data)).nonzero()
+        )
+    filled_data = np.array(incomplete_data, dtype=precision.float_dtype())
     queries_count = x.size
-    batch_size = 2**10 * 4
-    start = 0
-    for stop in range(batch_size, queries_count, batch_size):
-        y_chunk = y[start:stop]
-        x_chunk = x[start:stop]
-        start = stop
-        predictions = kriging.transform(y_chunk, x_chunk)
-        filled_data[y_chunk, x_chunk] = predictions
-    y_chunk = y[start:]
-    x_chunk = x[start:]
-    predictions = kriging.transform(y_chunk, x_chunk)
-    filled_data[y_chunk, x_chunk] = predictions
+    if queries_count == 0:
+        return filled_data
+    batches = [
+        (y[start : start + batch_size] + offset[0], x[start : start + batch_size] + offset[1])
+        for start in range(0, queries_count, batch_size)
+    ]
+    if pool is None:
+        if kriging is None:
+            kriging = build_kriging(model)
+        predictions = []
+        for batch in batches:
+            instrumentation.record("kriging.batch_size", batch[0].size)
+            with instrumentation.span("kriging.solve_batch", batch[0].size):
+                predictions.append(kriging.transform(*batch))
+    else:
+        # Batches are solved in other processes, so only their total time is measured here
+        with instrumentation.span("kriging.solve_in_pool", queries_count, batches=len(batches)):
+            # Results are returned in order of batches, regardless of the order they were
+            # computed in
+            predictions = list(pool.map(_transform_batch, batches))
+    filled_data[y, x] = np.concatenate(predictions)
     return filled_data
 
 
-if __name__ == "__main__":
-    args = _parse_command()
+class KrigingPredictor(Predictor):
+    """
+    Ordinary kriging with variogram fitted to known values. Factorization of the kriging system
+    used by Solver.GLOBAL is computed when it is fitted and saved with it. Solver itself is built
+    when it is first used, since skgstat's one can not be pickled
+    """
+
+    name = "kriging"
+    predicted_suffix = _PREDICTED_SUFFIX
+
+    def __init__(
+        self,
+        solver: Solver = Solver.SKGSTAT,
+        n_neighbors: int = _LOCAL_NEIGHBORS,
+        max_pairs: int = None,
+        variogram_model: str = MODELS[0],
+        seed: int = None,
+        batch_size: int = _BATCH_SIZE,
+    ):
+        self.solver = solver
+        self.n_neighbors = n_neighbors
+        self.max_pairs = max_pairs
+        self.variogram_model = variogram_model
+        self.seed = seed
+        self.batch_size = batch_size
+        self.model = None
+        self.factorization = None
+        self._kriging = None
+
+    @classmethod
+    def add_arguments(cls, parser: ArgumentParser):
+        parser.add_argument(
+            "-s",
+            "--solver",
+            choices=[solver.value for solver in Solver],
+            type=str,
+            default=Solver.SKGSTAT.value,
+            help="Implementation of kriging used to make predictions",
+        )
+        parser.add_argument(
+            "-n",
+            "--neighbors",
+            type=limited_int(1),
+            default=_LOCAL_NEIGHBORS,
+            help=f"""Positive integer. Number of nearest samples used by '{Solver.LOCAL.value}'
+            solver to predict a value""",
+        )
+        parser.add_argument(
+            "-p",
+            "--max-pairs",
+            type=limited_int(1),
+            default=None,
+            help="""Positive integer. If specified, experimental variogram is estimated from
+            binned statistics of at most that many pairs of samples""",
+        )
+        parser.add_argument(
+            "--variogram-model",
+            choices=MODELS,
+            default=MODELS[0],
+            help="Theoretical model fitted to variogram estimated with '--max-pairs'",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=None,
+            help="Seed to use for RNG used in sampling pairs of samples",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=limited_int(1),
+            default=_BATCH_SIZE,
+            help="Positive integer. Number of missing values predicted in a single batch",
+        )
+
+    @classmethod
+    def from_args(cls, args: Namespace):
+        return cls(
+            Solver(args.solver),
+            args.neighbors,
+            args.max_pairs,
+            args.variogram_model,
+            args.seed,
+            args.batch_size,
+        )
+
+    def fit(self, coordinates: np.ndarray, values: np.ndarray):
+        self.model = fit_variogram(
+            coordinates, values, self.max_pairs, self.variogram_model, self.seed
+        )
+        self.factorization = factorize(self.model) if self.solver == Solver.GLOBAL else None
+        self._kriging = None
+        return self
+
+    def predict(self, coordinates: np.ndarray):
+        if self._kriging is None:
+            self._kriging = build_kriging(
+                self.model, self.solver, self.n_neighbors, self.factorization
+            )
+        predictions = []
+        for start in range(0, coordinates.shape[0], self.batch_size):
+            batch = coordinates[start : start + self.batch_size]
+            with instrumentation.span("kriging.solve_batch", batch.shape[0]):
+                predictions.append(self._kriging.transform(batch[:, 0], batch[:, 1]))
+        return np.concatenate(predictions) if predictions else np.empty(0)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_kriging"] = None
+        return state
+
+
+def main(argv: list[str] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = _parse_command(argv)
     match args.command:
         case _Commands.TRAIN.value:
-            _train_subroutine()
+            _train_subroutine(argv[1:])
         case _Commands.PREDICT.value:
-            _predict_subroutine()
+            _predict_subroutine(argv[1:])
         case _:
             print("Unknown command")
             sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
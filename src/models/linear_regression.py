@@ -1,14 +1,19 @@
 import sys
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
 from enum import Enum
+from functools import partial
 from pathlib import Path
 
 import numpy as np
-from joblib import dump, load
+from joblib import dump
 from sklearn.linear_model import LinearRegression
 
-from src.models.config import MODEL_DIRECTORY
-from src.util.data_io import read_data, write_data
+from src.models.config import MODEL_DIRECTORY, load_model
+from src.models.predictor import Predictor
+from src.util import instrumentation, precision, tiling
+from src.util.cli import limited_int
+from src.util.data import indices_to_coordinates, known_points
+from src.util.data_io import read_data, read_known_points, transform_row_bands, write_data
 
 
 class _Commands(Enum):
@@ -16,7 +21,7 @@ class _Commands(Enum):
     PREDICT = "predict"
 
 
-def _parse_command():
+def _parse_command(argv: list[str]):
     parser = ArgumentParser(
         description="""Train models implementing linear regression algorithm and use them to
         predict values"""
@@ -27,13 +32,13 @@ def _parse_command():
         type=str,
         help="Command to execute",
     )
-    return parser.parse_args(sys.argv[1:2])
+    return parser.parse_args(argv[:1])
 
 
 _TRAINED_PREFIX = "linear_regression_"
 
 
-def _parse_train_params():
+def _parse_train_params(argv: list[str]):
     parser = ArgumentParser()
     parser.prog += " " + _Commands.TRAIN.value
     parser.add_argument(
@@ -51,13 +56,15 @@ def _parse_train_params():
         help=f"""File to save trained model in. If omitted model will be saved at
         '{MODEL_DIRECTORY}/{_TRAINED_PREFIX}<data>'""",
     )
-    return parser.parse_args(sys.argv[2:])
+    precision.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
 
 
 _PREDICTED_SUFFIX = "_predicted_linear"
 
 
-def _parse_predict_params():
+def _parse_predict_params(argv: list[str]):
     parser = ArgumentParser()
     parser.prog += " " + _Commands.TRAIN.value
     parser.add_argument(
@@ -83,53 +90,130 @@ def _parse_predict_params():
         results will be saved in the same directory as 'data' under name
         '<data>{_PREDICTED_SUFFIX}'""",
     )
-    return parser.parse_args(sys.argv[2:])
+    parser.add_argument(
+        "-b",
+        "--band-rows",
+        type=limited_int(1),
+        default=None,
+        help="""Positive integer. If specified, data will be read, predicted and saved in bands of
+        that many rows instead of being loaded into memory at once""",
+    )
+    tiling.add_arguments(parser)
+    precision.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
 
 
-def _train_subroutine():
-    t_args = _parse_train_params()
+def _train_subroutine(argv: list[str]):
+    t_args = _parse_train_params(argv)
     if t_args.target is None:
         t_args.target = MODEL_DIRECTORY / Path(f"{_TRAINED_PREFIX}{t_args.data.stem}")
-    data = read_data(t_args.data)
-    model = train(data)
-    dump(model, t_args.target)
+    precision.set_precision(precision.Precision(t_args.precision))
+    with instrumentation.session(t_args.trace, t_args.profile):
+        with instrumentation.span("linear_regression.find_known"):
+            coordinates, values = read_known_points(t_args.data)
+        model = fit(coordinates, values)
+        dump(model, t_args.target)
 
 
 def train(data: np.ndarray):
-    data_points_indices = np.asarray(np.logical_not(np.isnan(data))).nonzero()
-    values = data[data_points_indices]
-    data_points_indices = np.transpose(data_points_indices)
-    model = LinearRegression()
-    model.fit(data_points_indices, values)
+    with instrumentation.span("linear_regression.find_known"):
+        data_points_indices, values = known_points(data)
+    return fit(data_points_indices, values)
+
+
+def fit(coordinates: np.ndarray, values: np.ndarray):
+    with instrumentation.span("linear_regression.fit", values.size):
+        model = LinearRegression()
+        model.fit(coordinates, values)
     return model
 
 
-def _predict_subroutine():
-    p_args = _parse_predict_params()
+def _predict_subroutine(argv: list[str]):
+    p_args = _parse_predict_params(argv)
     if p_args.target is None:
         p_args.target = p_args.query.with_stem(p_args.query.stem + _PREDICTED_SUFFIX)
-    incomplete_data = read_data(p_args.query)
-    model: LinearRegression = load(p_args.model)
-    filled_data = predict(model, incomplete_data)
-    write_data(p_args.target, filled_data)
-
-
-def predict(model: LinearRegression, incomplete_data: np.ndarray):
-    queries_indices = np.asarray(np.isnan(incomplete_data)).nonzero()
-    prediction_indices = np.transpose(queries_indices)
-    predictions = model.predict(prediction_indices)
-    filled_data = incomplete_data.copy()
+    precision.set_precision(precision.Precision(p_args.precision))
+    with instrumentation.session(p_args.trace, p_args.profile):
+        model: LinearRegression = load_model(p_args.model)
+        if p_args.tile_shape is not None:
+            tiling.predict_tiled(
+                p_args.query,
+                p_args.target,
+                partial(predict, model),
+                p_args.tile_shape,
+                p_args.halo,
+                p_args.tile_workers,
+            )
+            return
+        if p_args.band_rows is not None:
+            transform_row_bands(
+                p_args.query,
+                p_args.target,
+                p_args.band_rows,
+                lambda band, first_row: predict(model, band, (first_row, 0)),
+            )
+            return
+        incomplete_data = read_data(p_args.query)
+        filled_data = predict(model, incomplete_data)
+        write_data(p_args.target, filled_data)
+
+
+def predict(
+    model: LinearRegression,
+    incomplete_data: np.ndarray,
+    offset: tuple[int, int] = (0, 0),
+):
+    with instrumentation.span("linear_regression.find_missing"):
+        queries_indices = np.asarray(np.isnan(incomplete_data)).nonzero()
+    prediction_indices = indices_to_coordinates(queries_indices, offset)
+    with instrumentation.span("linear_regression.predict", queries_indices[0].size):
+        predictions = model.predict(prediction_indices)
+    filled_data = np.array(incomplete_data, dtype=precision.float_dtype())
     filled_data[queries_indices] = predictions
     return filled_data
 
 
-if __name__ == "__main__":
-    args = _parse_command()
+class LinearRegressionPredictor(Predictor):
+    """
+    Plane fitted to known values with least squares
+    """
+
+    name = "linear_regression"
+    predicted_suffix = _PREDICTED_SUFFIX
+
+    def __init__(self):
+        self.model = None
+
+    @classmethod
+    def add_arguments(cls, parser: ArgumentParser):
+        pass
+
+    @classmethod
+    def from_args(cls, args: Namespace):
+        return cls()
+
+    def fit(self, coordinates: np.ndarray, values: np.ndarray):
+        self.model = fit(coordinates, values)
+        return self
+
+    def predict(self, coordinates: np.ndarray):
+        return self.model.predict(coordinates)
+
+
+def main(argv: list[str] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = _parse_command(argv)
     match args.command:
         case _Commands.TRAIN.value:
-            _train_subroutine()
+            _train_subroutine(argv[1:])
         case _Commands.PREDICT.value:
-            _predict_subroutine()
+            _predict_subroutine(argv[1:])
         case _:
             print("Unknown command")
             sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
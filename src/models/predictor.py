@@ -0,0 +1,121 @@
+"""
+Common interface of spatial prediction models
+"""
+from abc import ABC, abstractmethod
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import ClassVar
+
+import numpy as np
+from joblib import dump
+
+from src.models.config import load_model
+from src.util import instrumentation, precision
+from src.util.data import indices_to_coordinates, known_points
+from src.util.data_io import Georeference, read_known_points
+
+
+class Predictor(ABC):
+    """
+    Model fitted to values known at some points of a grid, that predicts values at other points.
+
+    Implementations need to provide `fit` and `predict` working on arrays of (row, column)
+    coordinates, and ways of building them from command line arguments. Filling missing values
+    of grids, and saving and loading fitted models are shared.
+    """
+
+    # Name under which the model is registered, used in command line and names of files
+    name: ClassVar[str]
+    # Suffix added to names of files with predictions
+    predicted_suffix: ClassVar[str]
+
+    @classmethod
+    @abstractmethod
+    def add_arguments(cls, parser: ArgumentParser):
+        """
+        Add options of the model to command line parser
+        """
+
+    @classmethod
+    @abstractmethod
+    def from_args(cls, args: Namespace) -> "Predictor":
+        """
+        Create unfitted model from parsed command line arguments
+        """
+
+    @abstractmethod
+    def fit(self, coordinates: np.ndarray, values: np.ndarray) -> "Predictor":
+        """
+        Fit model to values known at (row, column) `coordinates`
+
+        Returns:
+            Predictor: The fitted model itself
+        """
+
+    @abstractmethod
+    def predict(self, coordinates: np.ndarray) -> np.ndarray:
+        """
+        Predict values at (row, column) `coordinates`, given as an array of shape (n, 2)
+        """
+
+    def fit_grid(self, data: np.ndarray, offset: tuple[int, int] = (0, 0)):
+        """
+        Fit model to values of grid that are not missing
+        """
+        with instrumentation.span(f"{self.name}.find_known"):
+            coordinates, values = known_points(data, offset)
+        with instrumentation.span(f"{self.name}.fit", values.size):
+            return self.fit(coordinates, values)
+
+    def fit_file(self, file: Path):
+        """
+        Fit model to values of data saved in file that are not missing. Sparse data is used
+        without creating the grid
+        """
+        with instrumentation.span(f"{self.name}.find_known"):
+            coordinates, values = read_known_points(file)
+        with instrumentation.span(f"{self.name}.fit", values.size):
+            return self.fit(coordinates, values)
+
+    def predict_grid(self, incomplete_data: np.ndarray, offset: tuple[int, int] = (0, 0)):
+        """
+        Fill missing values of grid, which first cell is placed at `offset` in the grid the model
+        was fitted to
+        """
+        with instrumentation.span(f"{self.name}.find_missing"):
+            missing_values_indices = np.asarray(np.isnan(incomplete_data)).nonzero()
+        filled_data = np.array(incomplete_data, dtype=precision.float_dtype())
+        queries_count = missing_values_indices[0].size
+        if queries_count == 0:
+            return filled_data
+        with instrumentation.span(f"{self.name}.predict", queries_count):
+            filled_data[missing_values_indices] = self.predict(
+                indices_to_coordinates(missing_values_indices, offset)
+            )
+        return filled_data
+
+    def predict_points(
+        self, points: np.ndarray, georeference: Georeference = None, rows_count: int = None
+    ):
+        """
+        Predict values only at given points, without creating any grid. Points are (row, column)
+        positions, which can be fractional, or (x, y) coordinates if `georeference` and number
+        of rows of the grid the model was fitted to are given
+        """
+        points = np.asarray(points)
+        if points.shape[0] == 0:
+            return np.empty(0, dtype=precision.float_dtype())
+        if georeference is not None:
+            points = georeference.to_indices(points, rows_count)
+        with instrumentation.span(f"{self.name}.predict", points.shape[0]):
+            return self.predict(points)
+
+    def save(self, dest: Path):
+        dump(self, dest)
+
+    @classmethod
+    def load(cls, file: Path) -> "Predictor":
+        model = load_model(file)
+        if not isinstance(model, cls):
+            raise TypeError(f"{file} contains {type(model).__name__}, not {cls.__name__}")
+        return model
@@ -0,0 +1,310 @@
+"""
+Train any registered model and use it to predict values, through a single command line interface
+"""
+import sys
+from argparse import ArgumentParser
+from enum import Enum
+from functools import partial
+from pathlib import Path
+
+from src.models import pyramid
+from src.models.config import MODEL_DIRECTORY
+from src.models.idw import IDWPredictor
+from src.models.kriging import KrigingPredictor
+from src.models.linear_regression import LinearRegressionPredictor
+from src.models.predictor import Predictor
+from src.models.regression_kriging import RegressionKrigingPredictor
+from src.models.trend_surface import TrendSurfacePredictor
+from src.util import instrumentation, precision, tiling
+from src.util.cli import limited_int
+from src.util.data_io import (
+    read_data,
+    read_georeference,
+    read_points,
+    read_shape,
+    transform_row_bands,
+    write_data,
+    write_points,
+)
+
+# Implementations of `Predictor` by name
+PREDICTORS: dict[str, type[Predictor]] = {
+    predictor.name: predictor
+    for predictor in (
+        IDWPredictor,
+        KrigingPredictor,
+        LinearRegressionPredictor,
+        RegressionKrigingPredictor,
+        TrendSurfacePredictor,
+    )
+}
+
+
+class _Commands(Enum):
+    TRAIN = "train"
+    PREDICT = "predict"
+    POINTS = "points"
+
+
+def _parse_command(argv: list[str]):
+    parser = ArgumentParser(
+        description=f"""Train models of any of {', '.join(PREDICTORS)} types and use them to
+        predict values"""
+    )
+    parser.add_argument(
+        "command",
+        choices=[command.value for command in _Commands],
+        type=str,
+        help="Command to execute",
+    )
+    return parser.parse_args(argv[:1])
+
+
+def _parse_train_params(argv: list[str]):
+    parser = ArgumentParser()
+    parser.prog += " " + _Commands.TRAIN.value
+    models = parser.add_subparsers(dest="model", required=True, help="Type of model to train")
+    for name, predictor in PREDICTORS.items():
+        model_parser = models.add_parser(name)
+        model_parser.add_argument(
+            "-d",
+            "--data",
+            type=Path,
+            required=True,
+            help="File containing data to fit the model",
+        )
+        model_parser.add_argument(
+            "-t",
+            "--target",
+            type=Path,
+            default=None,
+            help=f"""File to save trained model in. If omitted model will be saved at
+            '{MODEL_DIRECTORY}/{name}_<data>'""",
+        )
+        predictor.add_arguments(model_parser)
+        precision.add_arguments(model_parser)
+        instrumentation.add_arguments(model_parser)
+    return parser.parse_args(argv)
+
+
+def _parse_predict_params(argv: list[str]):
+    parser = ArgumentParser()
+    parser.prog += " " + _Commands.PREDICT.value
+    parser.add_argument(
+        "-m",
+        "--model",
+        type=Path,
+        required=True,
+        help="File containing model that will be used for predictions",
+    )
+    parser.add_argument(
+        "-q",
+        "--query",
+        type=Path,
+        required=True,
+        help="File containing data with missing values to be predicted",
+    )
+    parser.add_argument(
+        "-t",
+        "--target",
+        type=Path,
+        default=None,
+        help="""File to save data with missing values filled in using predictions. If omitted,
+        results will be saved in the same directory as 'data' under name
+        '<data>_predicted_<model type>'""",
+    )
+    parser.add_argument(
+        "-b",
+        "--band-rows",
+        type=limited_int(1),
+        default=None,
+        help="""Positive integer. If specified, data will be read, predicted and saved in bands of
+        that many rows instead of being loaded into memory at once""",
+    )
+    tiling.add_arguments(parser)
+    pyramid.add_arguments(parser)
+    precision.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def _parse_points_params(argv: list[str]):
+    parser = ArgumentParser(
+        description="""Predict values only at points listed in a file, without reading or
+        writing any grid"""
+    )
+    parser.prog += " " + _Commands.POINTS.value
+    parser.add_argument(
+        "-m",
+        "--model",
+        type=Path,
+        required=True,
+        help="File containing model that will be used for predictions",
+    )
+    parser.add_argument(
+        "-p",
+        "--points",
+        type=Path,
+        required=True,
+        help="""Text file with two coordinates of a point in every line, separated by commas if
+        its extension is '.csv' and by whitespace otherwise, optionally preceded by a header.
+        Coordinates are (row, column) positions in the grid, which can be fractional, unless
+        '--grid' is given""",
+    )
+    parser.add_argument(
+        "-g",
+        "--grid",
+        type=Path,
+        default=None,
+        help="""Georeferenced file containing data the model was fitted to. If specified,
+        coordinates of points are (x, y) coordinates in its coordinate system""",
+    )
+    parser.add_argument(
+        "-t",
+        "--target",
+        type=Path,
+        default=None,
+        help="""File to save coordinates of points with predicted values in, in the same format
+        as points. If omitted, results will be saved in the same directory as 'points' under
+        name '<points>_predicted_<model type>'""",
+    )
+    precision.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def train(name: str, data_file: Path, target: Path, predictor: Predictor = None):
+    """
+    Fit model registered under `name`, created with default parameters if `predictor` is omitted,
+    to known values of data and save it
+    """
+    if predictor is None:
+        predictor = PREDICTORS[name]()
+    predictor.fit_file(data_file)
+    predictor.save(target)
+    return predictor
+
+
+def predict(
+    model_file: Path,
+    query: Path,
+    target: Path = None,
+    band_rows: int = None,
+    tile_shape: tuple[int, int] = None,
+    halo: int = 0,
+    tile_workers: int = 1,
+    pyramid_factor: int = None,
+    pyramid_tolerance: float = None,
+):
+    """
+    Fill missing values of data in `query` with predictions of saved model and save results.
+    If `pyramid_factor` is given, values are predicted coarse-to-fine
+
+    Returns:
+        Path: File results were saved in
+    """
+    predictor = Predictor.load(model_file)
+    if target is None:
+        target = query.with_stem(query.stem + predictor.predicted_suffix)
+    predict_grid = predictor.predict_grid
+    if pyramid_factor is not None:
+        predict_grid = partial(
+            pyramid.predict_pyramid,
+            predictor,
+            factor=pyramid_factor,
+            tolerance=pyramid_tolerance,
+        )
+    if tile_shape is not None:
+        tiling.predict_tiled(query, target, predict_grid, tile_shape, halo, tile_workers)
+    elif band_rows is not None:
+        transform_row_bands(
+            query,
+            target,
+            band_rows,
+            lambda band, first_row: predict_grid(band, (first_row, 0)),
+        )
+    else:
+        write_data(target, predict_grid(read_data(query)))
+    return target
+
+
+def predict_points(
+    model_file: Path, points_file: Path, target: Path = None, grid: Path = None
+):
+    """
+    Predict values of saved model at points listed in `points_file` and save them with the
+    points. Points are (x, y) coordinates in the coordinate system of georeferenced `grid` if it
+    is given
+
+    Returns:
+        Path: File results were saved in
+    """
+    predictor = Predictor.load(model_file)
+    if target is None:
+        target = points_file.with_stem(points_file.stem + predictor.predicted_suffix)
+    points = read_points(points_file)
+    names = ("row", "column")
+    georeference = None
+    rows_count = None
+    if grid is not None:
+        georeference = read_georeference(grid)
+        if georeference is None:
+            raise ValueError(f"{grid} is not georeferenced")
+        rows_count = read_shape(grid)[0]
+        names = ("x", "y")
+    write_points(target, points, predictor.predict_points(points, georeference, rows_count), names)
+    return target
+
+
+def _train_subroutine(argv: list[str]):
+    t_args = _parse_train_params(argv)
+    if t_args.target is None:
+        t_args.target = MODEL_DIRECTORY / Path(f"{t_args.model}_{t_args.data.stem}")
+    precision.set_precision(precision.Precision(t_args.precision))
+    with instrumentation.session(t_args.trace, t_args.profile):
+        predictor = PREDICTORS[t_args.model].from_args(t_args)
+        train(t_args.model, t_args.data, t_args.target, predictor)
+
+
+def _predict_subroutine(argv: list[str]):
+    p_args = _parse_predict_params(argv)
+    precision.set_precision(precision.Precision(p_args.precision))
+    with instrumentation.session(p_args.trace, p_args.profile):
+        predict(
+            p_args.model,
+            p_args.query,
+            p_args.target,
+            p_args.band_rows,
+            p_args.tile_shape,
+            p_args.halo,
+            p_args.tile_workers,
+            p_args.pyramid_factor,
+            p_args.pyramid_tolerance,
+        )
+
+
+def _points_subroutine(argv: list[str]):
+    p_args = _parse_points_params(argv)
+    precision.set_precision(precision.Precision(p_args.precision))
+    with instrumentation.session(p_args.trace, p_args.profile):
+        predict_points(p_args.model, p_args.points, p_args.target, p_args.grid)
+
+
+def main(argv: list[str] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = _parse_command(argv)
+    match args.command:
+        case _Commands.TRAIN.value:
+            _train_subroutine(argv[1:])
+        case _Commands.PREDICT.value:
+            _predict_subroutine(argv[1:])
+        case _Commands.POINTS.value:
+            _points_subroutine(argv[1:])
+        case _:
+            print("Unknown command")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Coarse-to-fine prediction, which predicts values at nodes of a coarse grid, interpolates them and
+runs the model at full resolution only where interpolation is not accurate enough
+"""
+import json
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+from src.models.predictor import Predictor
+from src.util import instrumentation, precision
+from src.util.cli import limited_float, limited_int
+from src.util.data import indices_to_coordinates
+from src.util.data_io import read_data, write_data
+from src.visualization.heatmaps_comparison import compare_predictions
+
+_FACTOR = 4
+_TOLERANCE = 0.1
+_PREDICTED_SUFFIX = "_pyramid"
+
+
+def add_arguments(parser: ArgumentParser):
+    """
+    Add options of coarse-to-fine prediction to command line parser
+    """
+    parser.add_argument(
+        "--pyramid-factor",
+        type=limited_int(2),
+        default=None,
+        help="""Integer greater than 1. If specified, values are first predicted at every that
+        many rows and columns and interpolated between them, and predicted at full resolution
+        only where estimated error of interpolation exceeds '--pyramid-tolerance'""",
+    )
+    parser.add_argument(
+        "--pyramid-tolerance",
+        type=limited_float(0.0, low_inclusive=True),
+        default=_TOLERANCE,
+        help=f"""Non-negative number. Largest estimated absolute error of interpolated values, in
+        units of data, that is accepted without predicting them at full resolution. 0 predicts
+        all values between nodes that are not interpolated exactly. Defaults to {_TOLERANCE}""",
+    )
+
+
+def _parse_args(argv: list[str] = None):
+    parser = ArgumentParser(
+        description="""Fill missing values with coarse-to-fine predictions of a model and report
+        their time and difference from predictions made at full resolution"""
+    )
+    parser.add_argument(
+        "-m",
+        "--model",
+        type=Path,
+        required=True,
+        help="File containing model that will be used for predictions",
+    )
+    parser.add_argument(
+        "-q",
+        "--query",
+        type=Path,
+        required=True,
+        help="File containing data with missing values to be predicted",
+    )
+    parser.add_argument(
+        "-t",
+        "--target",
+        type=Path,
+        default=None,
+        help=f"""File to save data with missing values filled in using predictions. If omitted,
+        results will be saved in the same directory as 'data' under name
+        '<data>_predicted_<model type>{_PREDICTED_SUFFIX}'""",
+    )
+    parser.add_argument(
+        "-f",
+        "--factor",
+        type=limited_int(2),
+        default=_FACTOR,
+        help=f"""Integer greater than 1. Values are first predicted at every that many rows and
+        columns. Defaults to {_FACTOR}""",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=limited_float(0.0, low_inclusive=True),
+        default=_TOLERANCE,
+        help=f"""Non-negative number. Largest estimated absolute error of interpolated values, in
+        units of data, that is accepted without predicting them at full resolution. Defaults to
+        {_TOLERANCE}""",
+    )
+    parser.add_argument(
+        "-r",
+        "--reference",
+        type=Path,
+        default=None,
+        help="File containing complete data, which both predictions are also compared with",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=None,
+        help="File to save report in as JSON. If omitted report is printed",
+    )
+    precision.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def _nodes(length: int, factor: int, start: int):
+    """
+    Indices of rows or columns which index in the whole grid, starting at `start`, is a multiple
+    of `factor`, so that tiles and bands share nodes with the whole grid. The first and the last
+    one are also included, so that values between them are interpolated, never extrapolated
+    """
+    return np.unique(
+        np.concatenate(([0], np.arange(-start % factor, length, factor), [length - 1]))
+    )
+
+
+def _interpolation_weights(length: int, nodes: np.ndarray):
+    """
+    Index of the closest node before every row or column, index of the next one, and weight of
+    the next one in linear interpolation
+    """
+    cells = np.arange(length)
+    lower = np.searchsorted(nodes, cells, side="right") - 1
+    upper = np.minimum(lower + 1, nodes.size - 1)
+    spacing = nodes[upper] - nodes[lower]
+    weights = np.divide(
+        cells - nodes[lower], spacing, out=np.zeros(length), where=spacing > 0
+    )
+    return lower, upper, weights
+
+
+def _interpolate(
+    coarse: np.ndarray,
+    row_weights: tuple[np.ndarray, np.ndarray, np.ndarray],
+    column_weights: tuple[np.ndarray, np.ndarray, np.ndarray],
+    rows: np.ndarray,
+    columns: np.ndarray,
+):
+    """
+    Bilinear interpolation of values at nodes at cells at `rows` and `columns`
+    """
+    row_lower, row_upper, row_weight = (weights[rows] for weights in row_weights)
+    column_lower, column_upper, column_weight = (weights[columns] for weights in column_weights)
+    lower = coarse[row_lower, column_lower] + column_weight * (
+        coarse[row_lower, column_upper] - coarse[row_lower, column_lower]
+    )
+    upper = coarse[row_upper, column_lower] + column_weight * (
+        coarse[row_upper, column_upper] - coarse[row_upper, column_lower]
+    )
+    return lower + row_weight * (upper - lower)
+
+
+def _interpolation_errors(coarse: np.ndarray):
+    """
+    Estimated absolute error of interpolation in every cell of the coarse grid, which has node at
+    [i, j] as its first corner. Linear interpolation between nodes of function which second
+    difference over them is d differs from it by at most d / 8, so second differences at corners
+    of the cell are used
+    """
+    curvature = np.zeros_like(coarse)
+    curvature[1:-1] = np.abs(coarse[:-2] - 2 * coarse[1:-1] + coarse[2:])
+    curvature[:, 1:-1] = np.maximum(
+        curvature[:, 1:-1], np.abs(coarse[:, :-2] - 2 * coarse[:, 1:-1] + coarse[:, 2:])
+    )
+    errors = curvature / 8
+    errors[:-1] = np.maximum(errors[:-1], errors[1:])
+    errors[:, :-1] = np.maximum(errors[:, :-1], errors[:, 1:])
+    return errors
+
+
+def _predict_pyramid(
+    predictor: Predictor,
+    incomplete_data: np.ndarray,
+    offset: tuple[int, int],
+    factor: int,
+    tolerance: float,
+):
+    filled_data = np.array(incomplete_data, dtype=precision.float_dtype())
+    missing = np.isnan(filled_data)
+    if not missing.any():
+        return filled_data, 0
+    row_nodes = _nodes(filled_data.shape[0], factor, offset[0])
+    column_nodes = _nodes(filled_data.shape[1], factor, offset[1])
+    coarse = filled_data[np.ix_(row_nodes, column_nodes)].astype(np.float64)
+    coarse_missing = np.isnan(coarse).nonzero()
+    with instrumentation.span("pyramid.predict_coarse", coarse_missing[0].size):
+        coarse[coarse_missing] = predictor.predict(
+            indices_to_coordinates(
+                (row_nodes[coarse_missing[0]], column_nodes[coarse_missing[1]]), offset
+            )
+        )
+
+    row_weights = _interpolation_weights(filled_data.shape[0], row_nodes)
+    column_weights = _interpolation_weights(filled_data.shape[1], column_nodes)
+    errors = _interpolation_errors(coarse)
+    with instrumentation.span("pyramid.interpolate", filled_data.size):
+        # Known values between nodes show how far interpolation is from data
+        rows, columns = (~missing).nonzero()
+        np.maximum.at(
+            errors,
+            (row_weights[0][rows], column_weights[0][columns]),
+            np.abs(
+                _interpolate(coarse, row_weights, column_weights, rows, columns)
+                - filled_data[rows, columns]
+            ),
+        )
+        rows, columns = missing.nonzero()
+        filled_data[rows, columns] = _interpolate(
+            coarse, row_weights, column_weights, rows, columns
+        )
+
+    # Values at nodes are already predicted at full resolution
+    is_row_node = np.zeros(filled_data.shape[0], dtype=bool)
+    is_row_node[row_nodes] = True
+    is_column_node = np.zeros(filled_data.shape[1], dtype=bool)
+    is_column_node[column_nodes] = True
+    refined = (errors[row_weights[0][rows], column_weights[0][columns]] > tolerance) & ~(
+        is_row_node[rows] & is_column_node[columns]
+    )
+    rows, columns = rows[refined], columns[refined]
+    instrumentation.record("pyramid.refined", rows.size)
+    if rows.size > 0:
+        with instrumentation.span("pyramid.refine", rows.size):
+            filled_data[rows, columns] = predictor.predict(
+                indices_to_coordinates((rows, columns), offset)
+            )
+    return filled_data, rows.size
+
+
+def predict_pyramid(
+    predictor: Predictor,
+    incomplete_data: np.ndarray,
+    offset: tuple[int, int] = (0, 0),
+    factor: int = _FACTOR,
+    tolerance: float = _TOLERANCE,
+):
+    """
+    Fill missing values of grid like `Predictor.predict_grid`, predicting them at full resolution
+    only where interpolation of predictions at every `factor`-th row and column is estimated to
+    differ from them by more than `tolerance`. Edges of tiles and bands are also predicted at
+    full resolution, so results of tiled prediction differ slightly close to them
+    """
+    return _predict_pyramid(predictor, incomplete_data, offset, factor, tolerance)[0]
+
+
+def report(
+    predictor: Predictor,
+    incomplete_data: np.ndarray,
+    factor: int = _FACTOR,
+    tolerance: float = _TOLERANCE,
+    reference: np.ndarray = None,
+):
+    """
+    Predict missing values both coarse-to-fine and at full resolution and compare time and
+    results of both
+
+    Returns:
+        tuple[np.ndarray, dict]: Coarse-to-fine predictions and report
+    """
+    start = time.perf_counter()
+    filled_data, refined_count = _predict_pyramid(
+        predictor, incomplete_data, (0, 0), factor, tolerance
+    )
+    pyramid_s = time.perf_counter() - start
+    start = time.perf_counter()
+    full_resolution_data = predictor.predict_grid(incomplete_data)
+    full_resolution_s = time.perf_counter() - start
+
+    mse, max_absolute_difference = compare_predictions(full_resolution_data, filled_data)
+    result = {
+        "factor": factor,
+        "tolerance": tolerance,
+        "missing": int(np.count_nonzero(np.isnan(incomplete_data))),
+        "refined": int(refined_count),
+        "pyramid_s": pyramid_s,
+        "full_resolution_s": full_resolution_s,
+        "speedup": full_resolution_s / pyramid_s if pyramid_s > 0 else float("inf"),
+        "mse_from_full_resolution": float(mse),
+        "max_abs_difference_from_full_resolution": float(max_absolute_difference),
+    }
+    if reference is not None:
+        compared = {"pyramid": filled_data, "full_resolution": full_resolution_data}
+        for name, predictions in compared.items():
+            mse, max_absolute_difference = compare_predictions(reference, predictions)
+            result[f"{name}_mse_from_reference"] = float(mse)
+            result[f"{name}_max_abs_difference_from_reference"] = float(max_absolute_difference)
+    return filled_data, result
+
+
+def main(argv: list[str] = None):
+    args = _parse_args(argv)
+    precision.set_precision(precision.Precision(args.precision))
+    with instrumentation.session(args.trace, args.profile):
+        predictor = Predictor.load(args.model)
+        if args.target is None:
+            args.target = args.query.with_stem(
+                args.query.stem + predictor.predicted_suffix + _PREDICTED_SUFFIX
+            )
+        reference = read_data(args.reference) if args.reference is not None else None
+        filled_data, result = report(
+            predictor, read_data(args.query), args.factor, args.tolerance, reference
+        )
+        write_data(args.target, filled_data)
+
+    if args.output is None:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as writer:
+            json.dump(result, writer, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Regression kriging, being kriging of residuals of values from their polynomial trend
+"""
+from argparse import ArgumentParser, Namespace
+
+import numpy as np
+
+from src.models.kriging import KrigingPredictor, Solver
+from src.models.predictor import Predictor
+from src.models.trend_surface import TrendSurfacePredictor
+from src.util import instrumentation
+
+_PREDICTED_SUFFIX = "_predicted_regression_kriging"
+
+
+class RegressionKrigingPredictor(Predictor):
+    """
+    Trend surface fitted to known values, with kriging of what it does not explain added to its
+    predictions. Residuals vary much less over the grid than raw values, so their variogram is
+    captured by far fewer samples and a local neighbourhood is enough to krige them
+    """
+
+    name = "regression_kriging"
+    predicted_suffix = _PREDICTED_SUFFIX
+
+    def __init__(self, trend: TrendSurfacePredictor = None, kriging: KrigingPredictor = None):
+        self.trend = TrendSurfacePredictor() if trend is None else trend
+        self.kriging = KrigingPredictor(Solver.LOCAL) if kriging is None else kriging
+
+    @classmethod
+    def add_arguments(cls, parser: ArgumentParser):
+        TrendSurfacePredictor.add_arguments(parser)
+        KrigingPredictor.add_arguments(parser)
+        parser.set_defaults(solver=Solver.LOCAL.value)
+
+    @classmethod
+    def from_args(cls, args: Namespace):
+        return cls(TrendSurfacePredictor.from_args(args), KrigingPredictor.from_args(args))
+
+    def fit(self, coordinates: np.ndarray, values: np.ndarray):
+        self.trend.fit(coordinates, values)
+        with instrumentation.span(f"{self.name}.residuals", values.size):
+            residuals = values - self.trend.predict(coordinates)
+        self.kriging.fit(coordinates, residuals)
+        return self
+
+    def predict(self, coordinates: np.ndarray):
+        return self.trend.predict(coordinates) + self.kriging.predict(coordinates)
+
+
+def train(data: np.ndarray, solver: Solver = Solver.LOCAL, degree: int = 1):
+    return RegressionKrigingPredictor(
+        TrendSurfacePredictor(degree), KrigingPredictor(solver)
+    ).fit_grid(data)
+
+
+def predict(
+    model: RegressionKrigingPredictor,
+    incomplete_data: np.ndarray,
+    offset: tuple[int, int] = (0, 0),
+):
+    return model.predict_grid(incomplete_data, offset)
@@ -0,0 +1,183 @@
+"""
+Polynomial trend surface fitted with least squares in a single streaming pass over data
+"""
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+
+import numpy as np
+
+from src.models.predictor import Predictor
+from src.util import instrumentation, precision
+from src.util.cli import limited_int
+from src.util.data_io import is_sparse, iter_row_bands, read_shape, read_sparse
+
+_PREDICTED_SUFFIX = "_predicted_trend"
+_DEGREE = 1
+# Number of rows of data read at once during training
+_BAND_ROWS = 256
+
+
+def _normalized_powers(indices: np.ndarray, length: int, count: int):
+    """
+    Powers 0, 1, ..., `count` - 1 of indices of rows or columns mapped to range (-1, 1), which
+    keeps normal equations well conditioned
+
+    Returns:
+        np.ndarray: Array of shape (indices.size, count)
+    """
+    normalized = (2 * np.asarray(indices, dtype=np.float64) + 1) / length - 1
+    return np.vander(normalized, count, increasing=True)
+
+
+class TrendSurfacePredictor(Predictor):
+    """
+    Polynomial of (row, column) coordinates of a given degree fitted to known values with least
+    squares.
+
+    Normal equations only need sums of products of powers of rows and columns over known cells,
+    and of them multiplied by values, which are accumulated band after band with matrix products
+    of powers of rows, band and powers of columns, without creating arrays of coordinates.
+    Prediction evaluates the polynomial for a whole band in the same way.
+    """
+
+    name = "trend_surface"
+    predicted_suffix = _PREDICTED_SUFFIX
+
+    def __init__(self, degree: int = _DEGREE):
+        self.degree = degree
+        # Numbers of rows and columns of grid, used to normalize coordinates
+        self.shape = None
+        # Coefficient of row^i * column^j, for i + j <= degree, at [i, j]
+        self.coefficients = None
+        self._moments = None
+        self._weighted_moments = None
+
+    @classmethod
+    def add_arguments(cls, parser: ArgumentParser):
+        parser.add_argument(
+            "--degree",
+            type=limited_int(1),
+            default=_DEGREE,
+            help=f"""Positive integer. Degree of polynomial fitted to data, 1 being a plane.
+            Defaults to {_DEGREE}""",
+        )
+
+    @classmethod
+    def from_args(cls, args: Namespace):
+        return cls(args.degree)
+
+    def _start(self, shape: tuple[int, int]):
+        self.shape = tuple(int(length) for length in shape)
+        moments_count = 2 * self.degree + 1
+        self._moments = np.zeros((moments_count, moments_count))
+        self._weighted_moments = np.zeros((self.degree + 1, self.degree + 1))
+
+    def _add_band(self, band: np.ndarray, offset: tuple[int, int]):
+        known = ~np.isnan(band)
+        moments_count = 2 * self.degree + 1
+        rows = _normalized_powers(
+            np.arange(band.shape[0]) + offset[0], self.shape[0], moments_count
+        )
+        columns = _normalized_powers(
+            np.arange(band.shape[1]) + offset[1], self.shape[1], moments_count
+        )
+        self._moments += rows.T @ (known @ columns)
+        terms_count = self.degree + 1
+        self._weighted_moments += rows[:, :terms_count].T @ (
+            np.where(known, band, 0) @ columns[:, :terms_count]
+        )
+
+    def _add_points(self, coordinates: np.ndarray, values: np.ndarray):
+        moments_count = 2 * self.degree + 1
+        rows = _normalized_powers(coordinates[:, 0], self.shape[0], moments_count)
+        columns = _normalized_powers(coordinates[:, 1], self.shape[1], moments_count)
+        self._moments += rows.T @ columns
+        terms_count = self.degree + 1
+        self._weighted_moments += (rows[:, :terms_count] * values[:, np.newaxis]).T @ columns[
+            :, :terms_count
+        ]
+
+    def _solve(self):
+        terms = [
+            (row_power, column_power)
+            for row_power in range(self.degree + 1)
+            for column_power in range(self.degree + 1 - row_power)
+        ]
+        normal_matrix = np.array(
+            [[self._moments[i + k, j + m] for k, m in terms] for i, j in terms]
+        )
+        normal_vector = np.array([self._weighted_moments[i, j] for i, j in terms])
+        # Least squares solution is well defined even if known points do not determine surface
+        solution = np.linalg.lstsq(normal_matrix, normal_vector, rcond=None)[0]
+        self.coefficients = np.zeros((self.degree + 1, self.degree + 1))
+        for (i, j), coefficient in zip(terms, solution):
+            self.coefficients[i, j] = coefficient
+        self._moments = self._weighted_moments = None
+        return self
+
+    def fit(self, coordinates: np.ndarray, values: np.ndarray):
+        self._start(np.asarray(coordinates).max(axis=0, initial=0) + 1)
+        self._add_points(coordinates, np.asarray(values, dtype=np.float64))
+        return self._solve()
+
+    def fit_grid(self, data: np.ndarray, offset: tuple[int, int] = (0, 0)):
+        with instrumentation.span(f"{self.name}.fit", data.size):
+            self._start((data.shape[0] + offset[0], data.shape[1] + offset[1]))
+            self._add_band(data, offset)
+            return self._solve()
+
+    def fit_file(self, file: Path, band_rows: int = _BAND_ROWS):
+        """
+        Fit model to data saved in file, reading at most `band_rows` rows of it at once. Sparse
+        data is used without creating the grid
+        """
+        with instrumentation.span(f"{self.name}.fit"):
+            if is_sparse(file):
+                shape, coordinates, values = read_sparse(file)
+                self._start(shape)
+                self._add_points(coordinates, np.asarray(values, dtype=np.float64))
+                return self._solve()
+            self._start(read_shape(file))
+            for first_row, band in iter_row_bands(file, band_rows):
+                self._add_band(band, (first_row, 0))
+            return self._solve()
+
+    def surface(self, shape: tuple[int, int], offset: tuple[int, int] = (0, 0)):
+        """
+        Evaluate polynomial for every cell of a grid of given shape, which first cell is placed at
+        `offset` in the grid the model was fitted to
+        """
+        dtype = precision.float_dtype()
+        terms_count = self.degree + 1
+        rows = _normalized_powers(np.arange(shape[0]) + offset[0], self.shape[0], terms_count)
+        columns = _normalized_powers(
+            np.arange(shape[1]) + offset[1], self.shape[1], terms_count
+        )
+        return (rows @ self.coefficients).astype(dtype) @ columns.T.astype(dtype)
+
+    def predict(self, coordinates: np.ndarray):
+        terms_count = self.degree + 1
+        rows = _normalized_powers(coordinates[:, 0], self.shape[0], terms_count)
+        columns = _normalized_powers(coordinates[:, 1], self.shape[1], terms_count)
+        return np.einsum("nj,nj->n", rows @ self.coefficients, columns)
+
+    def predict_grid(self, incomplete_data: np.ndarray, offset: tuple[int, int] = (0, 0)):
+        with instrumentation.span(f"{self.name}.predict", incomplete_data.size):
+            filled_data = np.array(incomplete_data, dtype=precision.float_dtype())
+            missing = np.isnan(filled_data)
+            if missing.any():
+                np.copyto(filled_data, self.surface(filled_data.shape, offset), where=missing)
+            return filled_data
+
+
+def train(data: np.ndarray, degree: int = _DEGREE):
+    return TrendSurfacePredictor(degree).fit_grid(data)
+
+
+def predict(
+    model: TrendSurfacePredictor,
+    incomplete_data: np.ndarray,
+    offset: tuple[int, int] = (0, 0),
+):
+    return model.predict_grid(incomplete_data, offset)
+
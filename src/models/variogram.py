@@ -0,0 +1,146 @@
+"""
+Variogram estimated from binned statistics of pairs of samples, computed in chunks of bounded size
+"""
+import copy
+
+import matplotlib.pyplot as plt
+import numpy as np
+import skgstat as skg
+from scipy.optimize import curve_fit
+from scipy.spatial.distance import cdist
+
+# Models of skgstat described only by effective range and sill
+MODELS = ("spherical", "exponential", "gaussian", "cubic")
+MAX_PAIRS = 10**7
+# Number of pairs which statistics are computed at once
+_CHUNK_PAIRS = 2**20
+
+
+class BinnedVariogram:
+    """
+    Variogram which experimental semivariances are estimated with Matheron's estimator from
+    counts and sums of squared differences of pairs of samples, accumulated in lag classes.
+
+    If samples form at most `max_pairs` pairs, all of them are streamed through in chunks,
+    otherwise `max_pairs` random pairs are used, so memory used does not depend on number of
+    samples and time used does not grow beyond linear.
+
+    It provides the parts of `skg.Variogram` interface that are used for kriging: `coordinates`,
+    `values`, `describe` and `plot`.
+    """
+
+    def __init__(
+        self,
+        coordinates: np.ndarray,
+        values: np.ndarray,
+        model: str = "spherical",
+        n_lags: int = 10,
+        max_pairs: int = MAX_PAIRS,
+        seed: int = None,
+    ):
+        if model not in MODELS:
+            raise ValueError(f"Model needs to be one of {', '.join(MODELS)}")
+        self.coordinates = np.asarray(coordinates, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.model = model
+        # Diagonal of bounding box is used instead of the largest distance between samples, which
+        # would require computing all distances
+        self.maxlag = np.linalg.norm(np.ptp(self.coordinates, axis=0))
+        # Upper edges of evenly spaced lag classes, like 'even' binning of skgstat
+        self.bins = np.linspace(0, self.maxlag, n_lags + 1)[1:]
+        self.counts = np.zeros(n_lags, dtype=np.int64)
+        self._squares_sums = np.zeros(n_lags)
+
+        samples_count = self.values.size
+        if samples_count * (samples_count - 1) // 2 <= max_pairs:
+            self._accumulate_all_pairs()
+        else:
+            self._accumulate_random_pairs(max_pairs, seed)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.experimental = self._squares_sums / (2 * self.counts)
+        self.cof = self._fit()
+
+    def _accumulate(self, distances: np.ndarray, differences: np.ndarray):
+        width = self.bins[0]
+        lag_classes = np.clip(np.ceil(distances / width).astype(np.intp) - 1, 0, None)
+        lag_classes = np.minimum(lag_classes, self.bins.size - 1)
+        self.counts += np.bincount(lag_classes, minlength=self.bins.size)
+        self._squares_sums += np.bincount(
+            lag_classes, weights=np.square(differences), minlength=self.bins.size
+        )
+
+    def _accumulate_all_pairs(self):
+        samples_count = self.values.size
+        chunk_rows = max(_CHUNK_PAIRS // max(samples_count, 1), 1)
+        for start in range(0, samples_count, chunk_rows):
+            stop = min(start + chunk_rows, samples_count)
+            # Pairs of every sample in the chunk with samples after it
+            is_pair = np.arange(start, samples_count) > np.arange(start, stop)[:, np.newaxis]
+            distances = cdist(self.coordinates[start:stop], self.coordinates[start:])
+            differences = self.values[start:stop, np.newaxis] - self.values[start:]
+            self._accumulate(distances[is_pair], differences[is_pair])
+
+    def _accumulate_random_pairs(self, pairs_count: int, seed: int):
+        rng = np.random.default_rng(seed)
+        samples_count = self.values.size
+        for start in range(0, pairs_count, _CHUNK_PAIRS):
+            size = min(_CHUNK_PAIRS, pairs_count - start)
+            first = rng.integers(0, samples_count, size)
+            second = rng.integers(0, samples_count - 1, size)
+            second += second >= first
+            self._accumulate(
+                np.linalg.norm(self.coordinates[first] - self.coordinates[second], axis=1),
+                self.values[first] - self.values[second],
+            )
+
+    def _fit(self):
+        function = getattr(skg.models, self.model)
+        known = ~np.isnan(self.experimental)
+        lags, semivariances = self.bins[known], self.experimental[known]
+        bounds = [lags.max(), semivariances.max()]
+        cof, _ = curve_fit(
+            lambda lag, effective_range, sill: function(lag, effective_range, sill, 0),
+            lags,
+            semivariances,
+            p0=bounds,
+            bounds=(0, bounds),
+            method="trf",
+        )
+        return cof
+
+    def with_model(self, model: str):
+        """
+        Variogram with the same experimental semivariances and another theoretical model fitted
+        to them
+        """
+        if model not in MODELS:
+            raise ValueError(f"Model needs to be one of {', '.join(MODELS)}")
+        variogram = copy.copy(self)
+        variogram.model = model
+        variogram.cof = variogram._fit()
+        return variogram
+
+    def describe(self):
+        return {
+            "model": self.model,
+            "estimator": "matheron",
+            "dist_func": "euclidean",
+            "effective_range": self.cof[0],
+            "sill": self.cof[1],
+            "nugget": 0,
+        }
+
+    def plot(self, show: bool = True):
+        fig, ax = plt.subplots()
+        ax.plot(self.bins, self.experimental, "o", label="Experimental")
+        lags = np.linspace(0, self.maxlag, 100)
+        ax.plot(lags, skg.Variogram.fitted_model_function(**self.describe())(lags), label="Model")
+        ax.set_xlabel("Lag")
+        ax.set_ylabel("Semivariance")
+        ax.legend()
+        if show:
+            plt.show()
+        return fig
+
+
+VariogramModel = skg.Variogram | BinnedVariogram
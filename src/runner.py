@@ -0,0 +1,125 @@
+"""
+Run batch of subsampling, training, prediction and comparison jobs in a single process
+"""
+import json
+import shlex
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import yaml
+
+from src.data import generate, poland_dem, subsample
+from src.models import (
+    cross_validation,
+    idw,
+    kriging,
+    linear_regression,
+    predictors,
+    pyramid,
+)
+from src.util import cache
+from src.util.cli import limited_int
+from src.visualization import heatmaps_comparison, metrics
+
+# Entry points of jobs, every one accepts the same arguments as command line of its module
+JOBS = {
+    "generate": generate.main,
+    "poland_dem": poland_dem.main,
+    "subsample": subsample.main,
+    "idw": idw.main,
+    "linear_regression": linear_regression.main,
+    "kriging": kriging.main,
+    "predictors": predictors.main,
+    "pyramid": pyramid.main,
+    "cross_validation": cross_validation.main,
+    "compare": heatmaps_comparison.main,
+    "metrics": metrics.main,
+}
+
+
+def parse_args(argv: list[str] = None):
+    parser = ArgumentParser(
+        description="""Run jobs listed in a manifest in a single process, keeping loaded data
+        and models in memory between them"""
+    )
+    parser.add_argument(
+        "manifest",
+        type=Path,
+        help=f"""JSON or YAML file with either a list of jobs under key 'jobs', run one after
+        another, or a list of stages under key 'stages', run one after another, each being a list
+        of jobs that do not depend on each other. Job is a mapping with key 'job', being one of
+        {', '.join(JOBS)}, and key 'args', being a list of command line arguments of the job's
+        module or a string with them""",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=limited_int(1),
+        default=1,
+        help="""Positive integer. Number of processes running jobs of a stage concurrently. Every
+        process keeps its own cache""",
+    )
+    return parser.parse_args(argv)
+
+
+def load_manifest(file: Path):
+    """
+    Read manifest of jobs
+
+    Returns:
+        list[list[dict]]: Stages of jobs
+    """
+    with open(file, encoding="utf-8") as reader:
+        if file.suffix in (".yaml", ".yml"):
+            manifest = yaml.safe_load(reader)
+        else:
+            manifest = json.load(reader)
+    if "stages" in manifest:
+        stages = manifest["stages"]
+    else:
+        stages = [[job] for job in manifest["jobs"]]
+    for stage in stages:
+        for job in stage:
+            if job["job"] not in JOBS:
+                raise ValueError(
+                    f"Unknown job '{job['job']}', expected one of {', '.join(JOBS)}"
+                )
+    return stages
+
+
+def run_job(job: dict):
+    args = job["args"]
+    if isinstance(args, str):
+        args = shlex.split(args)
+    JOBS[job["job"]]([str(arg) for arg in args])
+
+
+def _initialize_worker():
+    cache.enable()
+
+
+def run(stages: list[list[dict]], workers: int = 1):
+    if workers == 1:
+        cache.enable()
+        try:
+            for stage in stages:
+                for job in stage:
+                    run_job(job)
+        finally:
+            cache.disable()
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_initialize_worker) as pool:
+        for stage in stages:
+            # Consuming results propagates exceptions raised by jobs
+            list(pool.map(run_job, stage))
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    run(load_manifest(args.manifest), args.workers)
+
+
+if __name__ == "__main__":
+    main()
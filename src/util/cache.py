@@ -0,0 +1,54 @@
+import functools
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+# Loaded files, None when caching is disabled
+_cache: OrderedDict | None = None
+_max_entries = 0
+
+
+def enable(max_entries: int = 16):
+    """
+    Start caching results of functions decorated with `file_cached` in this process. Least
+    recently used results are dropped when there are more than `max_entries` of them
+    """
+    global _cache, _max_entries
+    _cache = OrderedDict()
+    _max_entries = max_entries
+
+
+def disable():
+    global _cache
+    _cache = None
+
+
+def file_cached(loader):
+    """
+    Decorate function loading content of a file, so that while caching is enabled, it is loaded
+    only once. Entries are identified by path, size and modification time of the file, so
+    overwritten files are loaded again. Cached objects are shared and must not be modified
+    """
+
+    @functools.wraps(loader)
+    def load(file: Path):
+        if _cache is None:
+            return loader(file)
+        stat = os.stat(file)
+        key = (
+            loader.__module__,
+            loader.__qualname__,
+            Path(file).resolve(),
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+        content = loader(file)
+        _cache[key] = content
+        if len(_cache) > _max_entries:
+            _cache.popitem(last=False)
+        return content
+
+    return load
@@ -46,3 +46,36 @@ def limited_float(
         return val
 
     return convert
+
+
+def limited_int(
+    low: float = -inf,
+    high: float = inf,
+    low_inclusive: bool = True,
+    high_inclusive: bool = True,
+):
+    """
+    Check if passed string is an integer in specified range
+
+    Args:
+        low (float, optional): Lower bound of range. Defaults to -inf.
+        high (float, optional): Higher bound of range. Defaults to inf.
+        low_inclusive (bool, optional): Is lower bound inclusive. Defaults to True.
+        high_inclusive (bool, optional): Is higher bound inclusive. Defaults to True.
+
+    Returns:
+        Callable[[str], int]: Function converting string to int. It raises
+        argparse.ArgumentTypeError if passed string can not be converted to an integer in
+        specified range
+    """
+    check_range = limited_float(low, high, low_inclusive, high_inclusive)
+
+    def convert(x: str):
+        try:
+            val = int(x)
+        except ValueError as exc:
+            raise argparse.ArgumentTypeError(f"{x} is not an integer") from exc
+        check_range(x)
+        return val
+
+    return convert
@@ -2,17 +2,107 @@ import math
 
 import numpy as np
 
+from src.util import precision
+
 
 def subsample(data: np.ndarray, ratio: float, seed: int = None):
+    coordinates, values = subsample_points(data, ratio, seed)
+    subsampled = np.full_like(data, np.nan, subok=False)
+    subsampled[coordinates[:, 0], coordinates[:, 1]] = values
+    return subsampled
+
+
+def subsample_points(data: np.ndarray, ratio: float, seed: int = None):
+    """
+    Sample the same cells of data as `subsample`, without creating grid of samples
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Array of (row, column) coordinates of shape (n, 2) and
+        array of n sampled values
+    """
     if not 0 < ratio < 1:
         raise ValueError("Ratio needs to be between 0 and 1")
-    subsampled = np.full_like(data, np.nan)
     samples_count = math.floor(data.size * ratio)
     rng = np.random.default_rng(seed)
-    while samples_count > 0:
-        x = rng.integers(0, data.shape[1])  # data.shape[1] - number of columns
-        y = rng.integers(0, data.shape[0])  # data.shape[0] - number of rows
-        if np.isnan(subsampled[y, x]):
-            subsampled[y, x] = data[y, x]
-            samples_count -= 1
-    return subsampled
+    # Flat indices of all samples are drawn without replacement at once, and sorted so that
+    # samples are in the same order as when they are extracted from grid
+    indices = np.unravel_index(
+        np.sort(rng.choice(data.size, samples_count, replace=False)), data.shape
+    )
+    return np.transpose(indices), data[indices]
+
+
+def holdout(data: np.ndarray, samples_ratio: float, missing_ratio: float, seed: int = None):
+    """
+    Split data into samples and data with missing values to be predicted on their basis. Cells of
+    samples and missing cells are disjoint
+
+    Args:
+        data (np.ndarray): Complete data
+        samples_ratio (float): Part of cells of `data` that should be sampled
+        missing_ratio (float): Part of cells of `data` that should be missing
+        seed (int, optional): Seed to use for RNG used in sampling. Defaults to None.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Samples, with all other cells set to NaN, and copy of `data`
+        with missing cells set to NaN
+    """
+    if not (0 < samples_ratio < 1 and 0 < missing_ratio < 1):
+        raise ValueError("Ratios need to be between 0 and 1")
+    samples_count = math.floor(data.size * samples_ratio)
+    missing_count = math.floor(data.size * missing_ratio)
+    if samples_count + missing_count > data.size:
+        raise ValueError("Sum of ratios can not be greater than 1")
+    rng = np.random.default_rng(seed)
+    indices = rng.choice(data.size, samples_count + missing_count, replace=False)
+    samples_indices = np.unravel_index(indices[:samples_count], data.shape)
+    missing_indices = np.unravel_index(indices[samples_count:], data.shape)
+    samples = np.full_like(data, np.nan, subok=False)
+    samples[samples_indices] = data[samples_indices]
+    incomplete_data = np.array(data)
+    incomplete_data[missing_indices] = np.nan
+    return samples, incomplete_data
+
+
+def known_points(data: np.ndarray, offset: tuple[int, int] = (0, 0)):
+    """
+    Extract coordinates and values of data points that are not missing
+
+    Args:
+        data (np.ndarray): Data with missing values marked as NaN
+        offset (tuple[int, int], optional): Coordinates of the first cell of `data` in the whole
+        grid it is a part of. Defaults to (0, 0).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Array of (row, column) coordinates of shape (n, 2) and
+        array of n corresponding values
+    """
+    data_points_indices = np.asarray(np.logical_not(np.isnan(data))).nonzero()
+    values = data[data_points_indices]
+    return indices_to_coordinates(data_points_indices, offset), values
+
+
+def indices_to_coordinates(
+    indices: tuple[np.ndarray, np.ndarray], offset: tuple[int, int] = (0, 0)
+):
+    """
+    Convert indices of cells, as returned by `np.nonzero`, to array of their (row, column)
+    coordinates of shape (n, 2) in the whole grid, of integer type of current precision
+    """
+    coordinates = np.transpose(indices).astype(precision.index_dtype())
+    coordinates += np.asarray(offset, dtype=coordinates.dtype)
+    return coordinates
+
+
+def known_points_in_bands(bands):
+    """
+    Extract coordinates and values of data points that are not missing from bands of rows yielded
+    by `src.util.data_io.iter_row_bands`
+    """
+    indices = [np.empty((0, 2), dtype=precision.index_dtype())]
+    values = [np.empty(0, dtype=precision.float_dtype())]
+    for first_row, band in bands:
+        band_indices, band_values = known_points(band, (first_row, 0))
+        indices.append(band_indices)
+        values.append(band_values)
+    return np.concatenate(indices), np.concatenate(values)
@@ -1,30 +1,477 @@
+import json
+import struct
+import warnings
+from dataclasses import asdict, dataclass
+from itertools import islice
 from pathlib import Path
+from typing import Callable, Iterator
 
 import numpy as np
 
+from src.util import instrumentation, precision
+from src.util.cache import file_cached
+from src.util.data import known_points, known_points_in_bands
+
 _COLUMNS_NUMBER_HEADER = "ncols"
 _ROWS_NUMBER_HEADER = "nrows"
+_DTYPE_HEADER = "dtype"
+_NODATA_HEADER = "nodata"
+_GEOREFERENCE_HEADER = "georeference"
+
+ASCII_EXTENSION = ".asc"
+BINARY_EXTENSION = ".grid"
+SPARSE_EXTENSION = ".npz"
+_CSV_EXTENSION = ".csv"
+
+# Binary grid layout: magic, little-endian uint32 length of JSON header, JSON header padded with
+# spaces so that the raw little-endian array body starts at a multiple of _BINARY_ALIGNMENT bytes
+_BINARY_MAGIC = b"SPDBGRID"
+_HEADER_LENGTH_FORMAT = "<I"
+_BINARY_ALIGNMENT = 64
+
+# Sparse layout: NumPy archive with shape of the grid, and int32 rows, int32 columns and values of
+# cells that are not missing
+_SHAPE_KEY = "shape"
+_ROWS_KEY = "rows"
+_COLUMNS_KEY = "columns"
+_VALUES_KEY = "values"
+_INDEX_DTYPE = np.int32
+
+
+@dataclass(frozen=True)
+class Georeference:
+    """
+    Placement of grid in a projected coordinate system, with the first row of grid being its top
+    """
+
+    # Coordinates of lower left corner of lower left cell
+    xllcorner: float
+    yllcorner: float
+    # Length of side of a cell
+    cellsize: float
+
+    def to_indices(self, points: np.ndarray, rows_count: int):
+        """
+        Convert (x, y) coordinates of points to fractional (row, column) positions in grid of
+        `rows_count` rows, with centres of cells at whole numbers
+        """
+        points = np.asarray(points, dtype=np.float64)
+        top = self.yllcorner + rows_count * self.cellsize
+        return np.column_stack(
+            (
+                (top - points[:, 1]) / self.cellsize - 0.5,
+                (points[:, 0] - self.xllcorner) / self.cellsize - 0.5,
+            )
+        )
+
+
+def is_binary(file: Path):
+    with open(file, "rb") as reader:
+        return reader.read(len(_BINARY_MAGIC)) == _BINARY_MAGIC
+
+
+def is_sparse(file: Path):
+    return Path(file).suffix == SPARSE_EXTENSION
 
 
 def read_data(file: Path):
+    """
+    Read data saved in any format, converted to floating point type of current precision
+    """
+    return precision.as_float(_load_data(file))
+
+
+@file_cached
+def _load_data(file: Path):
+    with instrumentation.span("data_io.read", file=str(file)):
+        if is_sparse(file):
+            return to_dense(*read_sparse(file))
+        if is_binary(file):
+            return _read_binary(file)
+        return _read_ascii(file)
+
+
+def write_data(dest: Path, data: np.ndarray, georeference: Georeference = None):
+    """
+    Save data in format chosen on the basis of extension of `dest`. Only values that are not
+    missing are saved in sparse format, and georeference is saved only in binary format
+    """
+    with instrumentation.span("data_io.write", data.size, file=str(dest)):
+        suffix = Path(dest).suffix
+        if suffix == SPARSE_EXTENSION:
+            write_sparse(dest, data.shape, *known_points(data))
+        elif suffix == BINARY_EXTENSION:
+            _write_binary(dest, data, georeference)
+        else:
+            _write_ascii(dest, data)
+
+
+@file_cached
+def read_sparse(file: Path):
+    """
+    Read data saved in sparse format
+
+    Returns:
+        tuple[tuple[int, int], np.ndarray, np.ndarray]: Shape of the grid, array of (row, column)
+        coordinates of shape (n, 2) and array of n values of cells that are not missing
+    """
+    with np.load(file) as archive:
+        shape = tuple(int(length) for length in archive[_SHAPE_KEY])
+        coordinates = np.column_stack((archive[_ROWS_KEY], archive[_COLUMNS_KEY]))
+        return shape, coordinates, archive[_VALUES_KEY]
+
+
+def write_sparse(
+    dest: Path, shape: tuple[int, int], coordinates: np.ndarray, values: np.ndarray
+):
+    if max(shape) > np.iinfo(_INDEX_DTYPE).max:
+        raise ValueError(f"Grid of shape {shape} is too large for sparse format")
+    # File object is passed, as np.savez would append extension to a path without it
+    with open(dest, "wb") as writer:
+        np.savez(
+            writer,
+            **{
+                _SHAPE_KEY: np.asarray(shape, dtype=np.int64),
+                _ROWS_KEY: np.asarray(coordinates[:, 0], dtype=_INDEX_DTYPE),
+                _COLUMNS_KEY: np.asarray(coordinates[:, 1], dtype=_INDEX_DTYPE),
+                _VALUES_KEY: np.asarray(values),
+            },
+        )
+
+
+def to_dense(
+    shape: tuple[int, int],
+    coordinates: np.ndarray,
+    values: np.ndarray,
+    offset: tuple[int, int] = (0, 0),
+):
+    """
+    Create grid of given shape, which first cell is placed at `offset` in the whole grid, with
+    values at `coordinates` and all other cells missing
+    """
+    data = np.full(shape, np.nan, dtype=precision.float_dtype())
+    data[coordinates[:, 0] - offset[0], coordinates[:, 1] - offset[1]] = values
+    return data
+
+
+def read_known_points(file: Path, band_rows: int = None):
+    """
+    Read coordinates and values of data points that are not missing, like
+    `src.util.data.known_points`. Sparse data is used as it is saved, other formats are read in
+    bands of `band_rows` rows, if specified, or at once
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Array of (row, column) coordinates of shape (n, 2) and
+        array of n corresponding values
+    """
+    if is_sparse(file):
+        _, coordinates, values = read_sparse(file)
+        return np.asarray(coordinates, dtype=precision.index_dtype()), precision.as_float(values)
+    if band_rows is not None:
+        return known_points_in_bands(iter_row_bands(file, band_rows))
+    return known_points(read_data(file))
+
+
+def read_points(file: Path):
+    """
+    Read coordinates of points from text file with two columns, separated by commas if its
+    extension is '.csv' and by whitespace otherwise. Lines starting with '#' and a header line
+    with names of columns are skipped
+
+    Returns:
+        np.ndarray: Array of coordinates of shape (n, 2)
+    """
+    delimiter = "," if Path(file).suffix == _CSV_EXTENSION else None
     with open(file, encoding="utf-8") as reader:
-        shape = {}
-        for _ in range(2):
-            line = reader.readline()
-            line = line.rstrip()
-            line = line.split()
-            shape[line[0]] = int(line[1])
+        first_line = reader.readline()
+    try:
+        [float(field) for field in first_line.split(delimiter)]
+        skipped_rows = 0
+    except ValueError:
+        skipped_rows = 0 if first_line.startswith("#") else 1
+    with warnings.catch_warnings():
+        # File with header only lists no points
+        warnings.filterwarnings("ignore", "loadtxt: input contained no data")
+        points = np.loadtxt(file, delimiter=delimiter, skiprows=skipped_rows, ndmin=2)
+    if points.size == 0:
+        return np.empty((0, 2))
+    if points.shape[1] < 2:
+        raise ValueError(f"{file} needs to contain two coordinates of every point")
+    return points[:, :2]
+
+
+def write_points(dest: Path, points: np.ndarray, values: np.ndarray, names: tuple[str, str]):
+    """
+    Save coordinates of points named `names` and values at them as text file with header, in
+    format read by `read_points`
+    """
+    delimiter = "," if Path(dest).suffix == _CSV_EXTENSION else " "
+    np.savetxt(
+        dest,
+        np.column_stack((points, values)),
+        delimiter=delimiter,
+        header=delimiter.join((*names, "value")),
+        comments="",
+    )
+
+
+def _read_ascii_header(reader):
+    shape = {}
+    for _ in range(2):
+        line = reader.readline()
+        line = line.rstrip()
+        line = line.split()
+        shape[line[0]] = int(line[1])
+    return shape[_ROWS_NUMBER_HEADER], shape[_COLUMNS_NUMBER_HEADER]
+
+
+def _read_ascii(file: Path):
+    with open(file, encoding="utf-8") as reader:
+        shape = _read_ascii_header(reader)
         data = np.fromfile(reader, sep=" ")
-        data = data.reshape((shape[_ROWS_NUMBER_HEADER], shape[_COLUMNS_NUMBER_HEADER]))
+        data = data.reshape(shape)
     return data
 
 
-def write_data(dest: Path, data: np.ndarray):
+def _write_ascii_header(writer, shape: tuple[int, int]):
+    writer.writelines(
+        [
+            f"{_COLUMNS_NUMBER_HEADER}        {shape[1]}\n",
+            f"{_ROWS_NUMBER_HEADER}        {shape[0]}\n",
+        ]
+    )
+
+
+def _write_ascii(dest: Path, data: np.ndarray):
     with open(dest, "w", encoding="utf-8") as writer:
-        writer.writelines(
-            [
-                f"{_COLUMNS_NUMBER_HEADER}        {data.shape[1]}\n",
-                f"{_ROWS_NUMBER_HEADER}        {data.shape[0]}\n",
-            ]
-        )
+        _write_ascii_header(writer, data.shape)
         np.savetxt(writer, data)
+
+
+def _read_binary_header(reader):
+    if reader.read(len(_BINARY_MAGIC)) != _BINARY_MAGIC:
+        raise ValueError(f"{reader.name} is not a binary grid file")
+    length_size = struct.calcsize(_HEADER_LENGTH_FORMAT)
+    (header_length,) = struct.unpack(_HEADER_LENGTH_FORMAT, reader.read(length_size))
+    header = json.loads(reader.read(header_length).decode("utf-8"))
+    header["offset"] = len(_BINARY_MAGIC) + length_size + header_length
+    return header
+
+
+def _read_binary(file: Path):
+    """
+    Open binary grid as a copy-on-write memory map, values are loaded from disk only when they are
+    accessed and modifications are never written back to the file
+    """
+    with open(file, "rb") as reader:
+        header = _read_binary_header(reader)
+    data = np.memmap(
+        file,
+        dtype=np.dtype(header[_DTYPE_HEADER]),
+        mode="c",
+        offset=header["offset"],
+        shape=(header[_ROWS_NUMBER_HEADER], header[_COLUMNS_NUMBER_HEADER]),
+    )
+    nodata = header[_NODATA_HEADER]
+    if nodata is not None:
+        data = np.where(data == nodata, np.nan, data)
+    return data
+
+
+def _write_binary_header(
+    writer, shape: tuple[int, int], dtype: np.dtype, georeference: Georeference = None
+):
+    header = {
+        _COLUMNS_NUMBER_HEADER: shape[1],
+        _ROWS_NUMBER_HEADER: shape[0],
+        _DTYPE_HEADER: dtype.str,
+        # Missing values are stored as NaN
+        _NODATA_HEADER: None,
+        _GEOREFERENCE_HEADER: asdict(georeference) if georeference is not None else None,
+    }
+    encoded = json.dumps(header).encode("utf-8")
+    prefix_length = len(_BINARY_MAGIC) + struct.calcsize(_HEADER_LENGTH_FORMAT)
+    padding = -(prefix_length + len(encoded)) % _BINARY_ALIGNMENT
+    encoded += b" " * padding
+    writer.write(_BINARY_MAGIC)
+    writer.write(struct.pack(_HEADER_LENGTH_FORMAT, len(encoded)))
+    writer.write(encoded)
+
+
+def _write_binary(dest: Path, data: np.ndarray, georeference: Georeference = None):
+    dtype = data.dtype.newbyteorder("<")
+    with open(dest, "wb") as writer:
+        _write_binary_header(writer, data.shape, dtype, georeference)
+        np.ascontiguousarray(data, dtype=dtype).tofile(writer)
+
+
+def read_georeference(file: Path):
+    """
+    Georeference saved with data, or None if data is not georeferenced
+    """
+    if is_sparse(file) or not is_binary(file):
+        return None
+    with open(file, "rb") as reader:
+        georeference = _read_binary_header(reader).get(_GEOREFERENCE_HEADER)
+    return Georeference(**georeference) if georeference is not None else None
+
+
+def read_shape(file: Path):
+    if is_sparse(file):
+        with np.load(file) as archive:
+            return tuple(int(length) for length in archive[_SHAPE_KEY])
+    if is_binary(file):
+        with open(file, "rb") as reader:
+            header = _read_binary_header(reader)
+        return header[_ROWS_NUMBER_HEADER], header[_COLUMNS_NUMBER_HEADER]
+    with open(file, encoding="utf-8") as reader:
+        return _read_ascii_header(reader)
+
+
+def iter_row_bands(file: Path, band_rows: int) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Read data file in bands of consecutive rows, so that at most `band_rows` rows are held in
+    memory at once
+
+    Args:
+        file (Path): File containing data
+        band_rows (int): Maximal number of rows in a band
+
+    Yields:
+        tuple[int, np.ndarray]: Index of the first row of a band and the band itself
+    """
+    if is_sparse(file):
+        shape, coordinates, values = read_sparse(file)
+        # Points are ordered by rows, so that points of every band form a contiguous range
+        order = np.argsort(coordinates[:, 0], kind="stable")
+        coordinates, values = coordinates[order], values[order]
+        for first_row in range(0, shape[0], band_rows):
+            with instrumentation.span("data_io.read_band", first_row=first_row):
+                start, stop = np.searchsorted(
+                    coordinates[:, 0], (first_row, first_row + band_rows)
+                )
+                band = to_dense(
+                    (min(band_rows, shape[0] - first_row), shape[1]),
+                    coordinates[start:stop],
+                    values[start:stop],
+                    (first_row, 0),
+                )
+            yield first_row, band
+        return
+
+    if is_binary(file):
+        data = _read_binary(file)
+        for first_row in range(0, data.shape[0], band_rows):
+            with instrumentation.span("data_io.read_band", first_row=first_row):
+                band = np.array(
+                    data[first_row : first_row + band_rows], dtype=precision.float_dtype()
+                )
+            yield first_row, band
+        return
+
+    with open(file, encoding="utf-8") as reader:
+        rows_count, columns_count = _read_ascii_header(reader)
+        for first_row in range(0, rows_count, band_rows):
+            with instrumentation.span("data_io.read_band", first_row=first_row):
+                band = _read_ascii_band(
+                    file, reader, min(band_rows, rows_count - first_row), columns_count
+                )
+            yield first_row, band
+
+
+def _read_ascii_band(file: Path, reader, band_rows: int, columns_count: int):
+    expected_size = band_rows * columns_count
+    values = []
+    size = 0
+    # Rows are usually written one per line, but nothing in the format guarantees that
+    while size < expected_size:
+        lines = list(islice(reader, band_rows))
+        if not lines:
+            raise ValueError(f"{file} contains less values than its header declares")
+        chunk = np.fromstring(" ".join(lines), sep=" ")
+        values.append(chunk)
+        size += chunk.size
+    band = np.concatenate(values)
+    if band.size != expected_size:
+        raise ValueError(f"Rows in {file} are not aligned with lines")
+    return precision.as_float(band.reshape((-1, columns_count)))
+
+
+class RowBandWriter:
+    """
+    Write data file incrementally, band of rows after band of rows. Format of the file is chosen
+    on the basis of its extension, like in `write_data`
+    """
+
+    def __init__(
+        self,
+        dest: Path,
+        shape: tuple[int, int],
+        dtype=None,
+        georeference: Georeference = None,
+    ):
+        if dtype is None:
+            dtype = precision.float_dtype()
+        self.shape = shape
+        self.rows_written = 0
+        self._binary = Path(dest).suffix == BINARY_EXTENSION
+        if self._binary:
+            self._dtype = np.dtype(dtype).newbyteorder("<")
+            self._writer = open(dest, "wb")
+            _write_binary_header(self._writer, shape, self._dtype, georeference)
+        else:
+            self._writer = open(dest, "w", encoding="utf-8")
+            _write_ascii_header(self._writer, shape)
+
+    def write(self, band: np.ndarray):
+        if band.shape[1] != self.shape[1]:
+            raise ValueError(
+                f"Band has {band.shape[1]} columns, expected {self.shape[1]}"
+            )
+        if self.rows_written + band.shape[0] > self.shape[0]:
+            raise ValueError(f"Writing band would exceed {self.shape[0]} rows")
+        with instrumentation.span("data_io.write_band", band.size, first_row=self.rows_written):
+            if self._binary:
+                np.ascontiguousarray(band, dtype=self._dtype).tofile(self._writer)
+            else:
+                np.savetxt(self._writer, band)
+        self.rows_written += band.shape[0]
+
+    def close(self):
+        self._writer.close()
+        if self.rows_written != self.shape[0]:
+            raise ValueError(
+                f"Only {self.rows_written} out of {self.shape[0]} rows were written"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._writer.close()
+
+
+def transform_row_bands(
+    source: Path,
+    dest: Path,
+    band_rows: int,
+    transform: Callable[[np.ndarray, int], np.ndarray],
+):
+    """
+    Stream data from `source` to `dest` in bands of rows, passing every band through `transform`
+
+    Args:
+        source (Path): File containing input data
+        dest (Path): File to save transformed data in
+        band_rows (int): Maximal number of rows held in memory at once
+        transform (Callable[[np.ndarray, int], np.ndarray]): Function receiving a band and index
+        of its first row and returning transformed band of the same shape
+    """
+    with RowBandWriter(
+        dest, read_shape(source), georeference=read_georeference(source)
+    ) as writer:
+        for first_row, band in iter_row_bands(source, band_rows):
+            writer.write(transform(band, first_row))
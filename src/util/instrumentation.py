@@ -0,0 +1,208 @@
+"""
+Lightweight timing spans, counters and memory measurements, saved as Chrome trace JSON which can be
+opened in chrome://tracing or https://ui.perfetto.dev
+"""
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+TRACE_VARIABLE = "SPDB_TRACE"
+PROFILE_VARIABLE = "SPDB_PROFILE"
+
+# Recorder of current run, None when instrumentation is disabled
+_recorder: "_Recorder | None" = None
+_NULL_SPAN = nullcontext()
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _now_us():
+    return time.perf_counter_ns() / 1000
+
+
+class _Recorder:
+    def __init__(self):
+        self.events = []
+        # Total duration, number of calls and number of processed items of spans by name
+        self.spans = {}
+        # Number of records, sum, minimum and maximum of recorded values by name
+        self.counters = {}
+        self.pid = os.getpid()
+
+    def add_span(self, name: str, start: float, duration: float, items: int, args: dict):
+        if items is not None:
+            args = {**args, "items": items}
+        self.events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": start,
+                "dur": duration,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+        self.events.append(
+            {
+                "name": "peak_rss_mb",
+                "ph": "C",
+                "ts": start + duration,
+                "pid": self.pid,
+                "args": {"peak_rss_mb": _peak_rss_mb()},
+            }
+        )
+        total = self.spans.setdefault(name, {"calls": 0, "seconds": 0.0, "items": 0})
+        total["calls"] += 1
+        total["seconds"] += duration / 10**6
+        total["items"] += items or 0
+
+    def add_value(self, name: str, value: float):
+        counter = self.counters.get(name)
+        if counter is None:
+            self.counters[name] = {"count": 1, "sum": value, "min": value, "max": value}
+        else:
+            counter["count"] += 1
+            counter["sum"] += value
+            counter["min"] = min(counter["min"], value)
+            counter["max"] = max(counter["max"], value)
+
+    def summary(self):
+        spans = {}
+        for name, total in self.spans.items():
+            spans[name] = dict(total)
+            if total["items"] and total["seconds"] > 0:
+                spans[name]["items_per_second"] = total["items"] / total["seconds"]
+        return {"spans": spans, "counters": self.counters, "peak_rss_mb": _peak_rss_mb()}
+
+
+class _Span:
+    __slots__ = ("name", "items", "args", "start")
+
+    def __init__(self, name: str, items: int, args: dict):
+        self.name = name
+        self.items = items
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if _recorder is not None:
+            _recorder.add_span(
+                self.name, self.start, _now_us() - self.start, self.items, self.args
+            )
+
+
+def enabled():
+    return _recorder is not None
+
+
+def enable():
+    """
+    Start recording spans and counters in this process, dropping previously recorded ones
+    """
+    global _recorder
+    _recorder = _Recorder()
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+def span(name: str, items: int = None, **args):
+    """
+    Context manager measuring time taken by a block of code. Does nothing while instrumentation
+    is disabled
+
+    Args:
+        name (str): Name of the measured operation, spans with the same name are summed up
+        items (int, optional): Number of items processed in the block, e.g. queries, used to
+        compute throughput. Defaults to None.
+        **args: Additional JSON serializable details shown in the trace
+    """
+    if _recorder is None:
+        return _NULL_SPAN
+    return _Span(name, items, args)
+
+
+def record(name: str, value: float = 1):
+    """
+    Add value to counter, e.g. size of a batch. Count, sum, minimum and maximum of values are kept
+    """
+    if _recorder is not None:
+        _recorder.add_value(name, value)
+
+
+def save_trace(dest: Path):
+    """
+    Save recorded events as Chrome trace JSON, with summary of spans and counters under key
+    'summary'
+    """
+    if _recorder is None:
+        raise RuntimeError("Instrumentation is not enabled")
+    with open(dest, "w", encoding="utf-8") as writer:
+        json.dump(
+            {
+                "traceEvents": _recorder.events,
+                "displayTimeUnit": "ms",
+                "summary": _recorder.summary(),
+            },
+            writer,
+        )
+
+
+def add_arguments(parser: ArgumentParser):
+    """
+    Add options enabling tracing and profiling of the run to command line parser
+    """
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        default=os.environ.get(TRACE_VARIABLE),
+        help=f"""File to save Chrome trace JSON with timings, counters and peak memory of
+        operations in. Can also be set with {TRACE_VARIABLE} environment variable""",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        default=os.environ.get(PROFILE_VARIABLE),
+        help=f"""File to save cProfile statistics of the run in, which can be read with pstats or
+        snakeviz. Can also be set with {PROFILE_VARIABLE} environment variable""",
+    )
+
+
+@contextmanager
+def session(trace: Path = None, profile: Path = None):
+    """
+    Record spans and counters of a run and save them in `trace`, and profile the run with cProfile
+    saving statistics in `profile`. Does nothing for omitted files
+    """
+    profiler = None
+    if trace is not None:
+        enable()
+    if profile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        if trace is not None:
+            save_trace(trace)
+            disable()
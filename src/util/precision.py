@@ -0,0 +1,70 @@
+"""
+Floating point precision of grids, values and intermediate arrays used in computations
+"""
+import os
+from argparse import ArgumentParser
+from enum import Enum
+
+import numpy as np
+
+PRECISION_VARIABLE = "SPDB_PRECISION"
+
+
+class Precision(Enum):
+    DOUBLE = "float64"
+    SINGLE = "float32"
+
+
+# Floating point and coordinates' integer types of every precision
+_FLOAT_DTYPES = {Precision.DOUBLE: np.dtype(np.float64), Precision.SINGLE: np.dtype(np.float32)}
+_INDEX_DTYPES = {Precision.DOUBLE: np.dtype(np.int64), Precision.SINGLE: np.dtype(np.int32)}
+
+_precision = Precision(os.environ.get(PRECISION_VARIABLE, Precision.DOUBLE.value))
+
+
+def get_precision():
+    return _precision
+
+
+def set_precision(precision: Precision):
+    """
+    Set precision used in this process. Pools of processes created afterwards pass it to their
+    workers
+    """
+    global _precision
+    _precision = precision
+
+
+def float_dtype():
+    return _FLOAT_DTYPES[_precision]
+
+
+def index_dtype():
+    """
+    Integer type of (row, column) coordinates of cells
+    """
+    return _INDEX_DTYPES[_precision]
+
+
+def as_float(data: np.ndarray):
+    """
+    Convert array to floating point type of current precision, without copying it if it already
+    has that type
+    """
+    return np.asarray(data, dtype=float_dtype())
+
+
+def add_arguments(parser: ArgumentParser):
+    """
+    Add option setting precision to command line parser
+    """
+    parser.add_argument(
+        "--precision",
+        choices=[precision.value for precision in Precision],
+        type=str,
+        default=_precision.value,
+        help=f"""Floating point type of data and of intermediate arrays used in computations.
+        '{Precision.SINGLE.value}' halves memory used, with coordinates of cells stored as 32-bit
+        integers. Can also be set with {PRECISION_VARIABLE} environment variable. Defaults to
+        '{_precision.value}'""",
+    )
@@ -0,0 +1,183 @@
+"""
+Prediction of grids too large to fit in memory, split into tiles with overlapping margins
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator
+
+import numpy as np
+
+from src.util import instrumentation, precision
+from src.util.cli import limited_int
+from src.util.data_io import RowBandWriter, iter_row_bands, read_georeference, read_shape
+
+# Function filling missing values of a tile, which first cell is placed at given offset in the grid
+TilePredictor = Callable[..., np.ndarray]
+
+_worker_predict: TilePredictor = None
+
+
+def add_arguments(parser: ArgumentParser, default_halo: int = 0):
+    """
+    Add options of tiled prediction to command line parser
+    """
+    parser.add_argument(
+        "--tile-shape",
+        nargs=2,
+        type=limited_int(1),
+        default=None,
+        metavar=("ROWS", "COLUMNS"),
+        help="""Positive integers. If specified, data will be predicted in tiles of that shape,
+        extended with halo, with only one row of tiles held in memory at once""",
+    )
+    parser.add_argument(
+        "--halo",
+        type=limited_int(0),
+        default=default_halo,
+        help=f"""Non-negative integer. Number of cells around every tile that are passed to the
+        model together with it, so that known values close to edges of the tile are used.
+        Defaults to {default_halo}""",
+    )
+    parser.add_argument(
+        "--tile-workers",
+        type=limited_int(1),
+        default=1,
+        help="Positive integer. Number of processes predicting tiles concurrently",
+    )
+
+
+def _row_windows(
+    source: Path, tile_rows: int, halo: int
+) -> Iterator[tuple[int, int, np.ndarray]]:
+    """
+    Yield index of the first row of every row of tiles, index of the first row of window
+    containing it with halo, and the window itself. Rows are read from `source` in bands and only
+    those needed by the current window are kept
+    """
+    rows_count, columns_count = read_shape(source)
+    bands = iter_row_bands(source, tile_rows)
+    buffer = np.empty((0, columns_count))
+    buffer_first_row = 0
+    for first_row in range(0, rows_count, tile_rows):
+        window_first_row = max(first_row - halo, 0)
+        window_stop = min(first_row + tile_rows + halo, rows_count)
+        chunks = [buffer[window_first_row - buffer_first_row :]]
+        read_stop = buffer_first_row + buffer.shape[0]
+        while read_stop < window_stop:
+            _, band = next(bands)
+            chunks.append(band)
+            read_stop += band.shape[0]
+        buffer = np.concatenate(chunks)
+        buffer_first_row = window_first_row
+        yield first_row, window_first_row, buffer[: window_stop - window_first_row]
+
+
+def _tiles(
+    first_row: int,
+    window_first_row: int,
+    window: np.ndarray,
+    tile_shape: tuple[int, int],
+    halo: int,
+):
+    """
+    Split window into tiles extended with halo
+
+    Returns:
+        list[tuple[np.ndarray, tuple[int, int], tuple[slice, slice]]]: Tiles with halo, their
+        offsets in the grid and parts of tiles without halo
+    """
+    tile_rows, tile_columns = tile_shape
+    core_rows = slice(
+        first_row - window_first_row,
+        min(first_row - window_first_row + tile_rows, window.shape[0]),
+    )
+    tiles = []
+    for first_column in range(0, window.shape[1], tile_columns):
+        tile_first_column = max(first_column - halo, 0)
+        tile_stop = min(first_column + tile_columns + halo, window.shape[1])
+        core_columns = slice(
+            first_column - tile_first_column,
+            min(first_column + tile_columns, window.shape[1]) - tile_first_column,
+        )
+        tiles.append(
+            (
+                window[:, tile_first_column:tile_stop],
+                (window_first_row, tile_first_column),
+                (core_rows, core_columns),
+            )
+        )
+    return tiles
+
+
+def _predict_tile(
+    predict: TilePredictor,
+    tile: tuple[np.ndarray, tuple[int, int], tuple[slice, slice]],
+):
+    data, offset, core = tile
+    # Tiles without missing values in their core are copied as they are
+    if not np.isnan(data[core]).any():
+        return data[core]
+    with instrumentation.span("tiling.predict_tile", data.size, offset=offset):
+        return predict(data, offset=offset)[core]
+
+
+def _initialize_worker(predict: TilePredictor, worker_precision: precision.Precision):
+    global _worker_predict
+    precision.set_precision(worker_precision)
+    _worker_predict = predict
+
+
+def _predict_tile_in_worker(tile: tuple[np.ndarray, tuple[int, int], tuple[slice, slice]]):
+    return _predict_tile(_worker_predict, tile)
+
+
+def predict_tiled(
+    source: Path,
+    dest: Path,
+    predict: TilePredictor,
+    tile_shape: tuple[int, int],
+    halo: int = 0,
+    workers: int = 1,
+):
+    """
+    Fill missing values of data in `source` tile by tile and save results in `dest`
+
+    Every tile is passed to `predict` together with `halo` cells around it, and only its part
+    without halo is saved. Models using known values of the data itself, like IDW, give the same
+    results as for the whole grid as long as halo is wider than distance to the furthest of
+    neighbors they use.
+
+    Args:
+        source (Path): File containing data with missing values
+        dest (Path): File to save data with missing values filled in
+        predict (TilePredictor): Function called as `predict(tile, offset=(row, column))`,
+        returning tile with missing values filled in, like `predict` of every model module with
+        all other arguments bound with `functools.partial`. Needs to be picklable if `workers` is
+        greater than 1
+        tile_shape (tuple[int, int]): Number of rows and columns of a tile, without halo
+        halo (int, optional): Width of margin around tiles. Defaults to 0.
+        workers (int, optional): Number of processes predicting tiles concurrently. `predict` is
+        sent to every process once, when it is started. Defaults to 1.
+    """
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(
+            workers,
+            initializer=_initialize_worker,
+            initargs=(predict, precision.get_precision()),
+        )
+    try:
+        with RowBandWriter(
+            dest, read_shape(source), georeference=read_georeference(source)
+        ) as writer:
+            for first_row, window_first_row, window in _row_windows(source, tile_shape[0], halo):
+                tiles = _tiles(first_row, window_first_row, window, tile_shape, halo)
+                if pool is None:
+                    predicted = [_predict_tile(predict, tile) for tile in tiles]
+                else:
+                    predicted = list(pool.map(_predict_tile_in_worker, tiles))
+                writer.write(np.concatenate(predicted, axis=1))
+    finally:
+        if pool is not None:
+            pool.shutdown()
@@ -2,17 +2,21 @@
 Generates heatmaps of data, predicted values and their difference
 """
 import argparse
+import math
 from pathlib import Path
 
 import matplotlib.pyplot as plt
 import numpy as np
 
-from src.util.data_io import read_data
+from src.util.cli import limited_int
+from src.util.data_io import iter_row_bands, read_shape
+from src.visualization import metrics
 
 _TARGET_SUFFIX = "_comparison"
+FIGURES_DIR = Path("reports/figures")
 
 
-def parse_args():
+def parse_args(argv: list[str] = None):
     parser = argparse.ArgumentParser(
         description="""Generate graphical comparison of data"""
     )
@@ -52,7 +56,14 @@ def parse_args():
         default=False,
         help="Display generated figure",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--max-size",
+        type=limited_int(1),
+        default=metrics.MAX_SIZE,
+        help=f"""Positive integer. Largest number of rows and columns of plotted grids, larger
+        ones are downsampled by averaging blocks of cells. Defaults to {metrics.MAX_SIZE}""",
+    )
+    return parser.parse_args(argv)
 
 
 def show_heatmap(
@@ -64,47 +75,110 @@ def show_heatmap(
     plt.colorbar(heatmap)
 
 
-if __name__ == "__main__":
-    FIGURES_DIR = Path("reports/figures")
+def compare_predictions(reference: np.ndarray, predictions: np.ndarray):
+    """
+    Mean squared error and maximum absolute difference of predictions from reference data
+    """
+    difference = predictions - reference
+    mse = np.sum(np.square(difference)) / difference.size
+    return mse, np.absolute(difference).max()
 
-    args = parse_args()
-    ref_data = read_data(args.reference)
-    samples = read_data(args.samples)
-    predictions = read_data(args.predictions)
-    if args.target is None:
-        args.target = FIGURES_DIR / Path(
-            f"{args.reference.stem}_{args.predictions.stem}{_TARGET_SUFFIX}"
+
+def read_downsampled(file: Path, step: int, band_rows: int = metrics.BAND_ROWS):
+    """
+    Read data file averaging known values in blocks of `step` by `step` cells, so that at most
+    about `band_rows` full rows are held in memory at once. Blocks without known values are
+    missing
+    """
+    rows_count, columns_count = read_shape(file)
+    band_rows = step * max(1, band_rows // step)
+    blocks_shape = (math.ceil(rows_count / step), math.ceil(columns_count / step))
+    sums = np.zeros(blocks_shape)
+    counts = np.zeros(blocks_shape)
+    for first_row, band in iter_row_bands(file, band_rows):
+        padded = np.full(
+            (math.ceil(band.shape[0] / step) * step, blocks_shape[1] * step), np.nan
         )
-    args.target = args.target.with_suffix(".png")
+        padded[: band.shape[0], : band.shape[1]] = band
+        blocks = padded.reshape(-1, step, blocks_shape[1], step)
+        known = ~np.isnan(blocks)
+        block_rows = slice(first_row // step, first_row // step + blocks.shape[0])
+        sums[block_rows] = np.sum(blocks, axis=(1, 3), where=known)
+        counts[block_rows] = np.count_nonzero(known, axis=(1, 3))
+    return np.divide(sums, counts, out=np.full(blocks_shape, np.nan), where=counts > 0)
 
-    data_ratio = (samples.size - np.count_nonzero(np.isnan(samples))) / samples.size
-    difference = predictions - ref_data
-    mse = np.sum(np.square(difference)) / difference.size
-    max_absolute_difference = np.absolute(difference).max()
+
+def plot_comparison(
+    reference: Path,
+    samples: Path,
+    predictions: Path,
+    target: Path,
+    metrics_row: dict,
+    max_size: int = metrics.MAX_SIZE,
+    band_rows: int = metrics.BAND_ROWS,
+    display: bool = False,
+):
+    """
+    Save heatmaps of samples, reference data, predictions and their difference, downsampled so
+    that none of them has more than `max_size` rows or columns. Title of difference shows metrics
+    from `metrics.evaluate`
+    """
+    step = math.ceil(max(read_shape(reference)) / max_size)
+    ref_data, samples_data, predictions_data = (
+        read_downsampled(file, step, band_rows) for file in (reference, samples, predictions)
+    )
+    data_ratio = 1 - metrics_row["missing"] / metrics_row["cells"]
+    difference = predictions_data - ref_data
+    max_absolute_difference = np.nanmax(np.absolute(difference), initial=0.0)
 
     fig, axs = plt.subplots(nrows=2, ncols=2)
     fig.tight_layout()
 
-    y, x = samples.nonzero()
+    y, x = (~np.isnan(samples_data)).nonzero()
     axs[0][0].set_title(
         f"Basis of prediction ({data_ratio*100:.2f}% of reference data)"
     )
-    plot = axs[0][0].scatter(x, y, s=0.1, c=samples[y, x], cmap="jet")
+    plot = axs[0][0].scatter(x, y, s=0.1, c=samples_data[y, x], cmap="jet")
     plt.colorbar(plot)
 
     show_heatmap(axs[1][0], ref_data, "Reference data")
-    show_heatmap(axs[0][1], predictions, "Predicted data")
+    show_heatmap(axs[0][1], predictions_data, "Predicted data")
     # Range of values is set manually to ensure that 0 is the center and therefore will be
     # white in bwr colormap
     show_heatmap(
         axs[1][1],
         difference,
-        f"Difference (MSE={mse:.2f})",
+        f"Difference (MSE={metrics_row['mse']:.2f})",
         "bwr",
         vmin=-max_absolute_difference,
         vmax=max_absolute_difference,
     )
 
-    plt.savefig(args.target, bbox_inches="tight")
-    if args.display:
+    plt.savefig(target, bbox_inches="tight")
+    if display:
         plt.show()
+    plt.close(fig)
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    if args.target is None:
+        args.target = FIGURES_DIR / Path(
+            f"{args.reference.stem}_{args.predictions.stem}{_TARGET_SUFFIX}"
+        )
+    args.target = args.target.with_suffix(".png")
+
+    (metrics_row,) = metrics.evaluate(args.reference, args.samples, [args.predictions])
+    plot_comparison(
+        args.reference,
+        args.samples,
+        args.predictions,
+        args.target,
+        metrics_row,
+        args.max_size,
+        display=args.display,
+    )
+
+
+if __name__ == "__main__":
+    main()
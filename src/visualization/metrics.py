@@ -0,0 +1,218 @@
+"""
+Error metrics of predictions of missing values, computed in a single pass over bands of rows of
+reference data, samples and any number of predictions made from them
+"""
+import csv
+import json
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+from src.util import instrumentation
+from src.util.cli import limited_int
+from src.util.data_io import iter_row_bands, read_shape
+
+METRICS_DIR = Path("reports/metrics")
+BAND_ROWS = 1024
+MAX_SIZE = 1000
+_JSON_EXTENSION = ".json"
+_FIGURE_SUFFIX = "_comparison.png"
+
+
+def parse_args(argv: list[str] = None):
+    parser = ArgumentParser(
+        description="""Compute MSE, RMSE, MAE, maximum error and bias of predictions at cells
+        missing in samples they were made from, and save them as a table"""
+    )
+    parser.add_argument(
+        "-r",
+        "--reference",
+        required=True,
+        type=Path,
+        help="File containing reference data to compare predictions with",
+    )
+    parser.add_argument(
+        "-s",
+        "--samples",
+        required=True,
+        type=Path,
+        help="File containing data samples on the basis of which predictions were made",
+    )
+    parser.add_argument(
+        "-p",
+        "--predictions",
+        required=True,
+        nargs="+",
+        type=Path,
+        help="Files containing predictions",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=None,
+        help=f"""File to save table of metrics in, as JSON if its extension is
+        '{_JSON_EXTENSION}' and as CSV otherwise. If omitted CSV is printed""",
+    )
+    parser.add_argument(
+        "-b",
+        "--band-rows",
+        type=limited_int(1),
+        default=BAND_ROWS,
+        help=f"""Positive integer. Number of rows of every file held in memory at once. Defaults
+        to {BAND_ROWS}""",
+    )
+    parser.add_argument(
+        "-f",
+        "--figures",
+        type=Path,
+        default=None,
+        help=f"""Directory to save heatmaps comparing every predictions with reference in, under
+        name '<predictions>{_FIGURE_SUFFIX}'. If omitted no figures are made""",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=limited_int(1),
+        default=MAX_SIZE,
+        help=f"""Positive integer. Largest number of rows and columns of plotted grids, larger
+        ones are downsampled by averaging blocks of cells. Defaults to {MAX_SIZE}""",
+    )
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+class ErrorAccumulator:
+    """
+    Running sums of errors of predictions, from which metrics of all errors added so far are
+    computed
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.squared_sum = 0.0
+        self.absolute_sum = 0.0
+        self.sum = 0.0
+        self.absolute_max = 0.0
+
+    def add(self, errors: np.ndarray):
+        """
+        Add differences between predicted and reference values
+        """
+        if errors.size == 0:
+            return
+        errors = errors.astype(np.float64, copy=False)
+        absolute = np.absolute(errors)
+        self.count += errors.size
+        self.squared_sum += float(np.dot(errors, errors))
+        self.absolute_sum += float(absolute.sum())
+        self.sum += float(errors.sum())
+        self.absolute_max = max(self.absolute_max, float(absolute.max()))
+
+    def result(self):
+        """
+        Metrics of added errors, NaN if none were added
+        """
+        if self.count == 0:
+            return {metric: float("nan") for metric in ("mse", "rmse", "mae", "max_error", "bias")}
+        mse = self.squared_sum / self.count
+        return {
+            "mse": mse,
+            "rmse": mse**0.5,
+            "mae": self.absolute_sum / self.count,
+            "max_error": self.absolute_max,
+            "bias": self.sum / self.count,
+        }
+
+
+def evaluate(
+    reference: Path,
+    samples: Path,
+    predictions: list[Path],
+    band_rows: int = BAND_ROWS,
+):
+    """
+    Metrics of every predictions at cells missing in samples and known in reference, reading all
+    files at once band of rows after band of rows
+
+    Returns:
+        list[dict]: Row of table for every predictions, with numbers of all cells, cells missing in
+        samples and cells evaluated
+    """
+    shape = read_shape(reference)
+    for file in [samples, *predictions]:
+        if read_shape(file) != shape:
+            raise ValueError(f"{file} has shape {read_shape(file)}, expected {shape}")
+
+    accumulators = [ErrorAccumulator() for _ in predictions]
+    missing_count = 0
+    bands = [iter_row_bands(file, band_rows) for file in [reference, samples, *predictions]]
+    for (first_row, reference_band), (_, samples_band), *prediction_bands in zip(*bands):
+        with instrumentation.span(
+            "metrics.evaluate_band", reference_band.size, first_row=first_row
+        ):
+            missing = np.isnan(samples_band)
+            missing_count += int(np.count_nonzero(missing))
+            evaluated = missing & ~np.isnan(reference_band)
+            reference_values = reference_band[evaluated].astype(np.float64)
+            for accumulator, (_, band) in zip(accumulators, prediction_bands):
+                accumulator.add(band[evaluated] - reference_values)
+
+    return [
+        {
+            "predictions": str(file),
+            "cells": shape[0] * shape[1],
+            "missing": missing_count,
+            "evaluated": accumulator.count,
+            **accumulator.result(),
+        }
+        for file, accumulator in zip(predictions, accumulators)
+    ]
+
+
+def write_table(rows: list[dict], dest: Path = None):
+    """
+    Save rows of metrics as JSON if extension of `dest` is '.json' and as CSV otherwise, or print
+    them as CSV if `dest` is omitted
+    """
+    if dest is not None and dest.suffix == _JSON_EXTENSION:
+        with open(dest, "w", encoding="utf-8") as writer:
+            json.dump(rows, writer, indent=2)
+        return
+    writer = sys.stdout if dest is None else open(dest, "w", encoding="utf-8", newline="")
+    try:
+        table = csv.DictWriter(writer, fieldnames=list(rows[0]) if rows else [])
+        table.writeheader()
+        table.writerows(rows)
+    finally:
+        if dest is not None:
+            writer.close()
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    with instrumentation.session(args.trace, args.profile):
+        rows = evaluate(args.reference, args.samples, args.predictions, args.band_rows)
+        if args.figures is not None:
+            # Matplotlib is imported only when figures are requested
+            from src.visualization.heatmaps_comparison import plot_comparison
+
+            args.figures.mkdir(parents=True, exist_ok=True)
+            for file, row in zip(args.predictions, rows):
+                plot_comparison(
+                    args.reference,
+                    args.samples,
+                    file,
+                    args.figures / f"{file.stem}{_FIGURE_SUFFIX}",
+                    row,
+                    args.max_size,
+                    args.band_rows,
+                )
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+    write_table(rows, args.output)
+
+
+if __name__ == "__main__":
+    main()